@@ -3,12 +3,17 @@ import os
 from pathlib import Path
 
 from dotenv import load_dotenv
-from pkg_resources import DistributionNotFound, get_distribution
 
-try:
-    __version__ = get_distribution(__name__).version
-except DistributionNotFound:
-    __version__ = "local dev"
+
+def __getattr__(name):
+    #The version is resolved on demand (reading the package metadata is slow)
+    if name == "__version__":
+        from importlib.metadata import PackageNotFoundError, version
+        try:
+            return version(__name__)
+        except PackageNotFoundError:
+            return "local dev"
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 dotenv_local_path = Path(__file__).parent.parent / ".env.local"
 dotenv_path_example = Path(__file__).parent.parent / ".env"
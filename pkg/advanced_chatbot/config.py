@@ -12,6 +12,79 @@ DEFAULT_RAG_SIMILARITY_TOP_K = 4
 DEFAULT_RAG_WINDOW_SIZE = 1
 DEFAULT_RAG_TOKEN_LIMIT = 2000
 
+############## ANN (approximate search) CONFIG ################
+#Number of IVF lists of an index in ANN mode, 0 means sqrt(number of nodes)
+DEFAULT_RAG_ANN_NLIST = 0
+#Number of IVF lists scanned per index and per query (higher = better recall, slower)
+DEFAULT_RAG_ANN_NPROBE = 8
+
+############## RETRIEVAL MODE ################
+#"dense" (embeddings), "lexical" (BM25 inverted index, no query embedding) or "hybrid" (reciprocal rank fusion of both)
+DEFAULT_RETRIEVAL_MODE = "dense"
+#Hybrid mode: number of dense and of lexical candidates fused, and rank offset of the fusion
+HYBRID_RETRIEVAL_CANDIDATES = 20
+HYBRID_RRF_K = 60
+
+############## VECTOR STORAGE ################
+#Storage type of the embeddings of new indexes: "float32", "float16" (2x smaller) or "int8" (4x smaller, one scale per vector).
+#Searches score the stored (quantized) embeddings.
+VECTOR_STORAGE_DTYPE = "float32"
+#Rescore the top_k * VECTOR_RESCORE_OVERSAMPLING best quantized candidates with exact float32 embeddings (0 disables it).
+#When enabled, new quantized indexes also keep their float32 embeddings on disk (memory mapped, only the candidates are read)
+VECTOR_RESCORE_OVERSAMPLING = 0
+
+############## EMBEDDING REQUESTS ################
+#Batches sent to the embedding API are bounded in tokens and in number of texts
+EMBEDDING_BATCH_MAX_TOKENS = 16000
+EMBEDDING_BATCH_MAX_SIZE = 512
+#Number of embedding requests in flight at the same time
+EMBEDDING_MAX_IN_FLIGHT = 4
+#Rate limits of the embedding API (OpenAI tier 1 for text-embedding-3-small)
+EMBEDDING_REQUESTS_PER_MINUTE = 3000
+EMBEDDING_TOKENS_PER_MINUTE = 1000000
+#Query embeddings of concurrent chats are sent together: a query waits at most QUERY_EMBEDDING_MAX_WAIT_MS
+#for other queries (0 disables the micro-batching) and a batch holds at most QUERY_EMBEDDING_MAX_BATCH_SIZE queries
+QUERY_EMBEDDING_MAX_WAIT_MS = 5
+QUERY_EMBEDDING_MAX_BATCH_SIZE = 64
+
+############## CONNECTIONS ################
+#HTTP connection pool shared by the LLM and embedding clients (one for the sync API, one for the async API)
+OPENAI_MAX_CONNECTIONS = 100
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 20
+
+############## INGESTION ################
+#Number of documents parsed (worker processes) and embedded at the same time
+INGESTION_MAX_WORKERS = 4
+#A document not parsed within this delay (ex: a parser stuck on a malformed file) fails, its worker process is killed
+INGESTION_PARSE_TIMEOUT_SECONDS = 600
+
+############## CACHES ################
+#Memory budget shared by the in-memory caches of the service, split between them by CACHE_BUDGET_SHARES
+CACHE_MAX_BYTES = 768 * 1024 * 1024
+#Share of the budget of each cache (sum <= 1): loaded indexes (size of the persisted index files),
+#stacked (multi index) embedding matrices used for retrieval, sentence windows, lexical (BM25) indexes
+CACHE_BUDGET_SHARES = {"indexes": 0.5, "embedding_blocks": 0.3, "sentence_windows": 0.1, "lexical_indexes": 0.1}
+
+############## ANSWER CACHE ################
+#Reuse the answer of a previous question (same indexes and system prompt) when the questions are similar enough.
+#Disabled by default: MockEmbedding gives the same embedding to every question.
+ANSWER_CACHE_ENABLED = False
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_TTL_SECONDS = 24 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 1000
+
+############## TRACING ################
+#Span timings and counters of ingestion and chat (RagService.trace_stats() keeps the latency histograms)
+TRACING_LOG_SPANS = False
+#Append every span to DATA_PATH/traces/spans.jsonl
+TRACING_JSONL = False
+#Fraction of chat/ingestion operations profiled with cProfile (.prof files in DATA_PATH/traces/profiles)
+TRACING_PROFILE_SAMPLE_RATE = 0.0
+
+############## DOCUMENT PROFILE ################
+#Maximum number of characters of the document sent to the LLM to summarize it (taken from evenly spaced pages)
+PROFILE_SUMMARY_MAX_CHARACTERS = 12000
+
 
 #USE FAKE LLMS
 USE_MOCK_MODELS = True
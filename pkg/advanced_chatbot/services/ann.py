@@ -0,0 +1,146 @@
+
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from advanced_chatbot.services.storage_utils import save_array_atomic
+
+
+IVF_CENTROIDS_FNAME = "ivf_centroids.npy"
+IVF_OFFSETS_FNAME = "ivf_offsets.npy"
+IVF_ROWS_FNAME = "ivf_rows.npy"
+
+_KMEANS_SAMPLES_PER_LIST = 256
+_ASSIGN_BATCH_SIZE = 4096
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Index of the closest (cosine) centroid of every row, computed by batches to bound memory.
+    """
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), _ASSIGN_BATCH_SIZE):
+        batch = _normalize(np.asarray(matrix[start:start + _ASSIGN_BATCH_SIZE], dtype=np.float32))
+        assignments[start:start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(matrix: np.ndarray, nlist: int, n_iter: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Cluster the rows of a matrix by cosine similarity.
+    Trained on a sample of at most 256 rows per cluster.
+    :param matrix: The (n, dim) vectors to cluster.
+    :param nlist: The number of clusters.
+    :param n_iter: The number of Lloyd iterations.
+    :param seed: Seed of the sampling and of the initial centroids.
+    :return: The (nlist, dim) normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), nlist * _KMEANS_SAMPLES_PER_LIST)
+    sample = _normalize(np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))], dtype=np.float32))
+
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+    for _ in range(n_iter):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.bincount(assignments, minlength=nlist) == 0
+        #Re-seed empty clusters with random samples
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """
+    Inverted file index for approximate cosine similarity search.
+    Vectors are partitioned by their closest centroid; a query only scores the rows of the
+    :nprobe lists whose centroids are the closest to it.
+    The lists are stored as one array of rows sorted by list, with the offset of every list.
+    """
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_rows: np.ndarray):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: Optional[int] = None, n_iter: int = 10, seed: int = 0) -> "IVFIndex":
+        """
+        Build the inverted lists of a matrix.
+        :param matrix: The (n, dim) vectors to index.
+        :param nlist: The number of lists, defaults to sqrt(n).
+        """
+        if nlist is None:
+            nlist = int(round(np.sqrt(len(matrix))))
+        nlist = max(1, min(nlist, len(matrix)))
+
+        centroids = spherical_kmeans(matrix, nlist, n_iter=n_iter, seed=seed)
+        assignments = _assign(matrix, centroids)
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int32)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))]).astype(np.int64)
+        return cls(centroids=centroids, list_offsets=list_offsets, list_rows=list_rows)
+
+    @classmethod
+    def merge(cls, ivfs: List[Tuple["IVFIndex", int]]) -> "IVFIndex":
+        """
+        Merge the inverted lists of several matrices stacked on top of each other.
+        :param ivfs: The IVF of every matrix with the row offset of the matrix in the stack.
+        """
+        centroids = np.concatenate([ivf.centroids for ivf, _ in ivfs])
+        list_rows = np.concatenate([np.asarray(ivf.list_rows) + row_offset for ivf, row_offset in ivfs]).astype(np.int32)
+        sizes = np.concatenate([np.diff(ivf.list_offsets) for ivf, _ in ivfs])
+        list_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        return cls(centroids=centroids, list_offsets=list_offsets, list_rows=list_rows)
+
+    def candidates(self, query_embedding: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Rows of the :nprobe lists closest to a query.
+        :param query_embedding: The query vector.
+        :param nprobe: The number of lists to scan, higher is slower with a better recall.
+        """
+        nprobe = min(nprobe, self.nlist)
+        centroid_scores = self.centroids @ query_embedding
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.list_rows[self.list_offsets[probe]:self.list_offsets[probe + 1]] for probe in probes])
+
+    @classmethod
+    def exists(cls, persist_dir: Path) -> bool:
+        return (Path(persist_dir) / IVF_CENTROIDS_FNAME).is_file()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: Path) -> "IVFIndex":
+        """
+        Open a persisted IVF index (memory mapped).
+        """
+        persist_dir = Path(persist_dir)
+        return cls(centroids=np.load(persist_dir / IVF_CENTROIDS_FNAME),
+                   list_offsets=np.load(persist_dir / IVF_OFFSETS_FNAME),
+                   list_rows=np.load(persist_dir / IVF_ROWS_FNAME, mmap_mode="r"))
+
+    def persist(self, persist_dir: Path) -> None:
+        """
+        Persist the IVF index as .npy files.
+        """
+        persist_dir = Path(persist_dir)
+        for fname, array in [(IVF_CENTROIDS_FNAME, self.centroids),
+                             (IVF_OFFSETS_FNAME, self.list_offsets),
+                             (IVF_ROWS_FNAME, self.list_rows)]:
+            save_array_atomic(persist_dir / fname, array)
+
+    @staticmethod
+    def remove(persist_dir: Path) -> None:
+        """
+        Remove the persisted IVF files of a directory.
+        """
+        for fname in [IVF_CENTROIDS_FNAME, IVF_OFFSETS_FNAME, IVF_ROWS_FNAME]:
+            (Path(persist_dir) / fname).unlink(missing_ok=True)
@@ -0,0 +1,136 @@
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import NodeWithScore
+
+
+class _CachedAnswer:
+
+    def __init__(self, key: Hashable, embedding: np.ndarray, answer: str, source_nodes: List["NodeWithScore"]):
+        self.key = key
+        self.embedding = embedding
+        self.answer = answer
+        self.source_nodes = source_nodes
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    """
+    Thread safe semantic cache of chat answers.
+    Answers are grouped by key (ex: sorted index ids and system prompt); within a group, a question
+    hits when the cosine similarity of its embedding with a cached question is above the threshold.
+    Entries expire after :ttl_seconds, the least recently used ones are evicted past :max_entries.
+    """
+
+    def __init__(self, similarity_threshold: float, ttl_seconds: float, max_entries: int):
+        self._similarity_threshold = similarity_threshold
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._groups: Dict[Hashable, Dict[str, _CachedAnswer]] = {}
+        self._lru: "OrderedDict[str, Hashable]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, query_embedding: List[float]) -> Optional[Tuple[str, List["NodeWithScore"]]]:
+        """
+        Find the answer of the most similar cached question.
+        :param key: The group of the question.
+        :param query_embedding: The embedding of the question.
+        :return: The (answer, source nodes) or None on a miss.
+        """
+        query = _normalize(query_embedding)
+        with self._lock:
+            self.__expire(key)
+            group = self._groups.get(key)
+            if not group:
+                self._misses += 1
+                return None
+
+            entry_ids = list(group)
+            scores = np.stack([group[entry_id].embedding for entry_id in entry_ids]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self._similarity_threshold:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            self._lru.move_to_end(entry_ids[best])
+            entry = group[entry_ids[best]]
+            return entry.answer, entry.source_nodes
+
+    def put(self, key: Hashable, query_embedding: List[float], answer: str, source_nodes: List["NodeWithScore"]) -> None:
+        """
+        Cache the answer of a question.
+        :param key: The group of the question.
+        :param query_embedding: The embedding of the question.
+        :param answer: The full answer.
+        :param source_nodes: The nodes the answer was generated from.
+        """
+        entry_id = str(uuid.uuid4())
+        with self._lock:
+            self._groups.setdefault(key, {})[entry_id] = _CachedAnswer(key, _normalize(query_embedding), answer, source_nodes)
+            self._lru[entry_id] = key
+            while len(self._lru) > self._max_entries:
+                self.__remove(next(iter(self._lru)))
+                self._evictions += 1
+
+    def invalidate(self, predicate) -> None:
+        """
+        Remove the groups whose key matches a predicate (ex: the groups using a deleted index).
+        """
+        with self._lock:
+            for key in [key for key in self._groups if predicate(key)]:
+                for entry_id in list(self._groups[key]):
+                    self.__remove(entry_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._groups.clear()
+            self._lru.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the cache counters.
+        :return: hits, misses, hit rate, expired and evicted entries, number of entries.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "expirations": self._expirations,
+                "evictions": self._evictions,
+                "entries": len(self._lru),
+            }
+
+    def __expire(self, key: Hashable) -> None:
+        group = self._groups.get(key, {})
+        now = time.monotonic()
+        for entry_id in [entry_id for entry_id, entry in group.items() if now - entry.created_at > self._ttl_seconds]:
+            self.__remove(entry_id)
+            self._expirations += 1
+
+    def __remove(self, entry_id: str) -> None:
+        key = self._lru.pop(entry_id, None)
+        group = self._groups.get(key)
+        if group is None:
+            return
+        group.pop(entry_id, None)
+        if not group:
+            del self._groups[key]
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
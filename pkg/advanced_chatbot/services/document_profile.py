@@ -0,0 +1,85 @@
+
+import re
+from collections import Counter
+from typing import Dict, List
+
+
+UNKNOWN_LANGUAGE = "unknown"
+
+#Most frequent function words of each language: they make up a large share of any text
+#and are rarely shared between languages (the shared ones, ex: "de", "a", count for both)
+_STOPWORDS = {
+    "en": "the of and to in is that it for was on are as with be by this which or from at not have an but they his her".split(),
+    "fr": "le la les des du de et est une un que qui dans pour pas sur au aux ce cette il elle sont avec par ne se plus".split(),
+    "de": "der die das und ist nicht ein eine zu den mit von sich des auf für im dem auch es ich sie wir werden".split(),
+    "es": "el la los las de que y en un una es por con para del se no su al lo como más pero sus".split(),
+    "it": "il la di che e è un una per non con del della sono si le nel alla anche gli questo".split(),
+    "pt": "o a os as de que e do da em um uma para com não no na por se mais como dos das".split(),
+    "nl": "de het een en van is dat in op te niet zijn met voor er die aan ook als bij".split(),
+}
+_STOPWORD_SETS = {language: frozenset(words) for language, words in _STOPWORDS.items()}
+
+_WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+#Detecting the language on the beginning of a long document is as accurate and much faster
+_DETECTION_MAX_WORDS = 20000
+
+
+def detect_language(text: str) -> str:
+    """
+    Detect the dominant language of a text from its function words (no model, no API call).
+    :param text: The text.
+    :return: The ISO 639-1 code of the language (ex: "fr", "en"), "unknown" if no language is recognized.
+    """
+    words = Counter()
+    for position, match in enumerate(_WORD_PATTERN.finditer(text.lower())):
+        if position >= _DETECTION_MAX_WORDS:
+            break
+        words[match.group()] += 1
+
+    scores = {language: sum(words[word] for word in stopwords) for language, stopwords in _STOPWORD_SETS.items()}
+    language, score = max(scores.items(), key=lambda item: item[1])
+    return language if score > 0 else UNKNOWN_LANGUAGE
+
+
+def compute_document_profile(pages: List[Dict], num_nodes: int) -> Dict:
+    """
+    Profile of a document, computed once at ingestion and saved in its index config.
+    The summaries need LLM calls, they are computed on first use (see RagService.summarize_document_index
+    and RagService.translate_and_summarize_first_page_fr).
+    :param pages: The parsed pages of the document, as {"text", "metadata"}.
+    :param num_nodes: The number of nodes of the index.
+    :return: The language, the page, node, token and character counts, summary=None and first_page_summary_fr=None.
+    """
+    from llama_index.core.utils import get_tokenizer
+
+    tokenizer = get_tokenizer()
+    text = "\n".join(page["text"] for page in pages)
+    return {
+        "language": detect_language(text),
+        "num_pages": len(pages),
+        "num_nodes": num_nodes,
+        "num_tokens": sum(len(tokenizer(page["text"])) for page in pages),
+        "num_characters": len(text),
+        "summary": None,
+        "first_page_summary_fr": None,
+    }
+
+
+def select_summary_content(page_texts: List[str], max_characters: int) -> str:
+    """
+    Select the content to summarize: pages evenly spaced over the document, each one truncated
+    so that the selection fits in :max_characters (deterministic, unlike a random sample of nodes).
+    :param page_texts: The texts of the pages in order.
+    :param max_characters: The budget of the selection.
+    :return: The selected content.
+    """
+    page_texts = [text for text in page_texts if text.strip()]
+    if not page_texts:
+        return ""
+    #At least 1000 characters per selected page, so that each page keeps some context
+    num_selected = max(1, min(len(page_texts), max_characters // 1000))
+    step = len(page_texts) / num_selected
+    selected = [page_texts[int(position * step)] for position in range(num_selected)]
+    per_page = max_characters // num_selected
+    return "\n".join(text[:per_page] for text in selected)
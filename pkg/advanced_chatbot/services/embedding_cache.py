@@ -0,0 +1,155 @@
+
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+def hash_text(text: str) -> bytes:
+    """
+    sha256 digest of a text, used as cache key.
+    """
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of text embeddings keyed by (model name, sha256 of the text).
+    Stored in SQLite (WAL mode, shared by every process) with vectors as raw float32 blobs.
+    """
+
+    def __init__(self, db_path: Path):
+        self._db_path = Path(db_path)
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self.__connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash BLOB NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                ) WITHOUT ROWID
+            """)
+
+    def __connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, model: str, text_hashes: List[bytes]) -> Dict[bytes, List[float]]:
+        """
+        Get the cached embeddings of a list of texts.
+        :param model: The embedding model name.
+        :param text_hashes: The sha256 digests of the texts.
+        :return: The embeddings found, by text hash.
+        """
+        found = {}
+        unique_hashes = list(dict.fromkeys(text_hashes))
+        #Stay under the SQLite limit of variables per statement
+        for start in range(0, len(unique_hashes), 500):
+            batch = unique_hashes[start:start + 500]
+            rows = self.__connection().execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                [model, *batch],
+            ).fetchall()
+            for text_hash, vector in rows:
+                found[bytes(text_hash)] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, embeddings: Dict[bytes, List[float]]) -> None:
+        """
+        Store embeddings.
+        :param model: The embedding model name.
+        :param embeddings: The embeddings by text hash.
+        """
+        with self.__connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model, text_hash, np.asarray(vector, dtype=np.float32).tobytes()) for text_hash, vector in embeddings.items()],
+            )
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model wrapper serving text embeddings from an EmbeddingCache.
+    Only the texts missing from the cache are sent to the wrapped model.
+    Query embeddings are not cached.
+    """
+
+    _backend: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(self, backend: BaseEmbedding, cache: EmbeddingCache, model_name: Optional[str] = None, **kwargs: Any):
+        #The whole batch is looked up at once, the backend applies its own batch size on the misses
+        kwargs.setdefault("embed_batch_size", 2048)
+        super().__init__(model_name=model_name or backend.model_name, **kwargs)
+        self._backend = backend
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def backend(self) -> BaseEmbedding:
+        return self._backend
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Number of texts served from the cache (hits) and sent to the backend (misses).
+        """
+        return {"hits": self._hits, "misses": self._misses}
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._backend.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self._backend.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        text_hashes, cached, misses = self.__lookup(texts)
+        if misses:
+            computed = self._backend.get_text_embedding_batch(list(misses.values()))
+            cached.update(self.__store(misses, computed))
+        return [cached[text_hash] for text_hash in text_hashes]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        text_hashes, cached, misses = self.__lookup(texts)
+        if misses:
+            computed = await self._backend.aget_text_embedding_batch(list(misses.values()))
+            cached.update(self.__store(misses, computed))
+        return [cached[text_hash] for text_hash in text_hashes]
+
+    def __lookup(self, texts: List[str]):
+        text_hashes = [hash_text(text) for text in texts]
+        cached = self._cache.get_many(self.model_name, text_hashes)
+        misses = {text_hash: text for text_hash, text in zip(text_hashes, texts) if text_hash not in cached}
+        self._hits += len(texts) - len(misses)
+        self._misses += len(misses)
+        return text_hashes, cached, misses
+
+    def __store(self, misses: Dict[bytes, str], computed: List[Embedding]) -> Dict[bytes, Embedding]:
+        new_embeddings = dict(zip(misses, computed))
+        self._cache.put_many(self.model_name, new_embeddings)
+        return new_embeddings
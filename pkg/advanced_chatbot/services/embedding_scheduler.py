@@ -0,0 +1,500 @@
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.utils import get_tokenizer
+
+from advanced_chatbot.services.tracing import tracer
+
+
+EmbedBatchFn = Callable[[List[str]], List[Embedding]]
+AsyncEmbedBatchFn = Callable[[List[str]], Awaitable[List[Embedding]]]
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Whether an exception is a HTTP 429 (openai.RateLimitError or any error with a 429 status).
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code == 429
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    The Retry-After header of a rate limit error, if any.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def make_openai_batch_fn(api_key: str, model: str, api_base: Optional[str] = None, http_client: Any = None) -> EmbedBatchFn:
+    """
+    Embedding function sending one request per batch to the OpenAI API.
+    The client does not retry: rate limits and backoff are handled by the EmbeddingScheduler.
+    :param api_key: The OpenAI API key.
+    :param model: The embedding model name.
+    :param api_base: The API base url (ex: a local stand-in server).
+    :param http_client: A httpx.Client to share its connection pool, the OpenAI client creates one by default.
+    """
+    from openai import OpenAI as OpenAIClient
+
+    client = OpenAIClient(api_key=api_key, base_url=api_base, max_retries=0, http_client=http_client)
+
+    def embed_batch(texts: List[str]) -> List[Embedding]:
+        #Same preprocessing as llama_index OpenAIEmbedding
+        response = client.embeddings.create(input=[text.replace("\n", " ") for text in texts], model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    return embed_batch
+
+
+def make_openai_async_batch_fn(api_key: str, model: str, api_base: Optional[str] = None,
+                               http_client: Any = None) -> AsyncEmbedBatchFn:
+    """
+    Async version of :make_openai_batch_fn, the requests are sent on the event loop of the caller.
+    :param http_client: A httpx.AsyncClient to share its connection pool, the OpenAI client creates one by default.
+    """
+    from openai import AsyncOpenAI as AsyncOpenAIClient
+
+    client = AsyncOpenAIClient(api_key=api_key, base_url=api_base, max_retries=0, http_client=http_client)
+
+    async def aembed_batch(texts: List[str]) -> List[Embedding]:
+        response = await client.embeddings.create(input=[text.replace("\n", " ") for text in texts], model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    return aembed_batch
+
+
+class RateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute, shared by every thread and event loop.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self._capacities = {"requests": float(requests_per_minute), "tokens": float(tokens_per_minute)}
+        self._levels = dict(self._capacities)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, num_tokens: int) -> None:
+        """
+        Block until one request of :num_tokens tokens fits in both budgets.
+        """
+        while True:
+            wait = self.__try_acquire(num_tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, num_tokens: int) -> None:
+        """
+        Async version of :acquire, the waits do not block the event loop.
+        """
+        while True:
+            wait = self.__try_acquire(num_tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop every request for a while (after a 429).
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def __try_acquire(self, num_tokens: int) -> float:
+        """
+        Take one request of :num_tokens tokens if it fits in both budgets.
+        :return: 0 when taken, else the wait before it fits.
+        """
+        #A single batch larger than the whole budget waits for a full bucket
+        num_tokens = min(num_tokens, self._capacities["tokens"])
+        with self._lock:
+            now = time.monotonic()
+            self.__refill(now)
+            wait = max(self._paused_until - now,
+                       (1 - self._levels["requests"]) * 60 / self._capacities["requests"],
+                       (num_tokens - self._levels["tokens"]) * 60 / self._capacities["tokens"])
+            if wait > 0:
+                return wait
+            self._levels["requests"] -= 1
+            self._levels["tokens"] -= num_tokens
+            return 0.0
+
+    def __refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        for name, capacity in self._capacities.items():
+            self._levels[name] = min(capacity, self._levels[name] + elapsed * capacity / 60)
+
+
+class EmbeddingScheduler:
+    """
+    Embed a list of texts with concurrent, token-bounded batch requests.
+    Batches are sent through a thread pool (:max_in_flight requests at a time), under the
+    requests/tokens per minute limits. Rate limited batches (429) are retried with an
+    exponential backoff (or the Retry-After delay of the server).
+    With :aembed_batch_fn, :aembed sends the batches on the event loop of the caller (:max_in_flight
+    requests at a time per event loop), under the same limits; without it, :aembed runs :embed in a thread.
+    """
+
+    def __init__(self,
+                 embed_batch_fn: EmbedBatchFn,
+                 max_batch_tokens: int,
+                 max_batch_size: int,
+                 max_in_flight: int,
+                 requests_per_minute: int,
+                 tokens_per_minute: int,
+                 max_retries: int = 8,
+                 backoff_seconds: float = 1.0,
+                 max_backoff_seconds: float = 60.0,
+                 aembed_batch_fn: Optional[AsyncEmbedBatchFn] = None):
+        self._embed_batch_fn = embed_batch_fn
+        self._aembed_batch_fn = aembed_batch_fn
+        self._max_in_flight = max_in_flight
+        self._max_batch_tokens = max_batch_tokens
+        self._max_batch_size = max_batch_size
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding")
+        self._tokenizer = get_tokenizer()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "rate_limited": 0, "texts": 0, "tokens": 0}
+        #Bound of the async requests in flight, one semaphore per event loop
+        self._async_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Number of requests sent, of 429 received, of texts and tokens embedded.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Pack texts (by position) in batches of at most :max_batch_tokens tokens and :max_batch_size texts.
+        """
+        batches, current, current_tokens = [], [], 0
+        for position, text in enumerate(texts):
+            num_tokens = len(self._tokenizer(text))
+            if current and (current_tokens + num_tokens > self._max_batch_tokens or len(current) == self._max_batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(position)
+            current_tokens += num_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def embed(self, texts: List[str]) -> List[Embedding]:
+        """
+        Embed texts, keeping their order.
+        """
+        if not texts:
+            return []
+        batches = self.make_batches(texts)
+        futures = [self._executor.submit(self.__embed_batch, [texts[position] for position in batch]) for batch in batches]
+
+        return self.__reorder(texts, batches, [future.result() for future in futures])
+
+    async def aembed(self, texts: List[str]) -> List[Embedding]:
+        """
+        Async version of :embed.
+        """
+        if not texts:
+            return []
+        if self._aembed_batch_fn is None:
+            return await asyncio.to_thread(self.embed, texts)
+        batches = self.make_batches(texts)
+        results = await asyncio.gather(*[self.__aembed_batch([texts[position] for position in batch]) for batch in batches])
+        return self.__reorder(texts, batches, results)
+
+    @staticmethod
+    def __reorder(texts: List[str], batches: List[List[int]], results: List[List[Embedding]]) -> List[Embedding]:
+        embeddings: List[Optional[Embedding]] = [None] * len(texts)
+        for batch, batch_embeddings in zip(batches, results):
+            for position, embedding in zip(batch, batch_embeddings):
+                embeddings[position] = embedding
+        return embeddings
+
+    def __embed_batch(self, texts: List[str]) -> List[Embedding]:
+        num_tokens = sum(len(self._tokenizer(text)) for text in texts)
+        for attempt in range(self._max_retries + 1):
+            self._rate_limiter.acquire(num_tokens)
+            self.__count(requests=1)
+            try:
+                embeddings = self._embed_batch_fn(texts)
+            except Exception as error:
+                if not self.__back_off(error, attempt):
+                    raise
+                continue
+            self.__count(texts=len(texts), tokens=num_tokens)
+            return embeddings
+
+    async def __aembed_batch(self, texts: List[str]) -> List[Embedding]:
+        num_tokens = sum(len(self._tokenizer(text)) for text in texts)
+        async with self.__async_slots():
+            for attempt in range(self._max_retries + 1):
+                await self._rate_limiter.aacquire(num_tokens)
+                self.__count(requests=1)
+                try:
+                    embeddings = await self._aembed_batch_fn(texts)
+                except Exception as error:
+                    if not self.__back_off(error, attempt):
+                        raise
+                    continue
+                self.__count(texts=len(texts), tokens=num_tokens)
+                return embeddings
+
+    def __back_off(self, error: Exception, attempt: int) -> bool:
+        """
+        Pause the requests after a rate limit error.
+        :return: Whether the batch must be retried (False for other errors and after the last attempt).
+        """
+        if not is_rate_limit_error(error) or attempt == self._max_retries:
+            return False
+        self.__count(rate_limited=1)
+        delay = _retry_after_seconds(error)
+        if delay is None:
+            delay = min(self._max_backoff_seconds, self._backoff_seconds * 2 ** attempt) * random.uniform(0.5, 1.0)
+        self._rate_limiter.pause(delay)
+        return True
+
+    def __count(self, **counts: int) -> None:
+        with self._lock:
+            for name, count in counts.items():
+                self._stats[name] += count
+
+    def __async_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._async_slots.get(loop)
+            if semaphore is None:
+                semaphore = self._async_slots[loop] = asyncio.Semaphore(self._max_in_flight)
+            return semaphore
+
+
+class QueryEmbeddingBatcher:
+    """
+    Micro-batching of the query embeddings of concurrent callers.
+    A query waits at most :max_wait_ms for other queries, then the pending queries (at most :max_batch_size)
+    are embedded with one batched call and every caller gets its own vector back. Identical pending queries
+    are embedded once. Batches are sent by a pool of :max_in_flight threads, so a slow batch does not hold back
+    the next one. Batch sizes are kept in :stats, the waits and batch latencies are traced
+    ("query_embedding_wait", "query_embedding_batch").
+    With :aembed_batch_fn, the queries of :aembed are batched per event loop and sent on it (a timer of the loop
+    replaces the dispatcher thread); without it, they join the batches of the sync callers.
+    """
+
+    def __init__(self, embed_batch_fn: EmbedBatchFn, max_wait_ms: float, max_batch_size: int, max_in_flight: int,
+                 max_samples: int = 1000, aembed_batch_fn: Optional[AsyncEmbedBatchFn] = None):
+        self._embed_batch_fn = embed_batch_fn
+        self._aembed_batch_fn = aembed_batch_fn
+        self._max_wait = max_wait_ms / 1000
+        self._max_batch_size = max_batch_size
+        self._condition = threading.Condition()
+        self._pending: List[Tuple[str, Future, float]] = []
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="query-embedding")
+        self._batch_sizes: Deque[int] = deque(maxlen=max_samples)
+        self._stats = {"batches": 0, "queries": 0, "deduplicated": 0, "failed_batches": 0}
+        #Pending async queries of each event loop, only used from the thread of their loop
+        self._async_pending: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, List[Tuple[str, asyncio.Future, float]]]" = \
+            weakref.WeakKeyDictionary()
+        self._async_tasks: Set[asyncio.Task] = set()
+        threading.Thread(target=self.__dispatch, name="query-embedding-batcher", daemon=True).start()
+
+    def submit(self, query: str) -> Future:
+        """
+        Queue a query, the future resolves to its embedding.
+        """
+        future = Future()
+        with self._condition:
+            self._pending.append((query, future, time.perf_counter()))
+            self._condition.notify()
+        return future
+
+    def embed(self, query: str) -> Embedding:
+        return self.submit(query).result()
+
+    async def aembed(self, query: str) -> Embedding:
+        if self._aembed_batch_fn is None:
+            return await asyncio.wrap_future(self.submit(query))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._async_pending.get(loop)
+        if pending is None:
+            pending = self._async_pending[loop] = []
+            loop.call_later(self._max_wait, self.__flush_async, loop, pending)
+        pending.append((query, future, time.perf_counter()))
+        if len(pending) >= self._max_batch_size:
+            self.__flush_async(loop, pending)
+        return await future
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Number of batches and queries, queries served by an identical query of the same batch,
+        and the mean, median and max size of the recent batches.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            sizes = sorted(self._batch_sizes)
+        stats["mean_batch_size"] = sum(sizes) / len(sizes) if sizes else 0.0
+        stats["p50_batch_size"] = sizes[len(sizes) // 2] if sizes else 0
+        stats["max_batch_size"] = sizes[-1] if sizes else 0
+        return stats
+
+    def __dispatch(self) -> None:
+        while True:
+            with self._condition:
+                #1. Wait for a first query, then for a full batch or the deadline of the oldest query
+                while not self._pending:
+                    self._condition.wait()
+                deadline = self._pending[0][2] + self._max_wait
+                while len(self._pending) < self._max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self._max_batch_size]
+                del self._pending[:self._max_batch_size]
+
+            #2. Send the batch without blocking the next one
+            self.__record_dispatch(batch)
+            self._executor.submit(self.__embed_batch, batch)
+
+    def __flush_async(self, loop: asyncio.AbstractEventLoop, pending: List[Tuple[str, asyncio.Future, float]]) -> None:
+        #The timer of a batch already sent because it was full
+        if self._async_pending.get(loop) is not pending:
+            return
+        del self._async_pending[loop]
+        self.__record_dispatch(pending)
+        task = loop.create_task(self.__aembed_batch(pending))
+        self._async_tasks.add(task)
+        task.add_done_callback(self._async_tasks.discard)
+
+    def __record_dispatch(self, batch: List[Tuple[str, Any, float]]) -> None:
+        with self._condition:
+            self._stats["batches"] += 1
+            self._stats["queries"] += len(batch)
+            self._batch_sizes.append(len(batch))
+        dispatched_at = time.perf_counter()
+        for _, _, submitted_at in batch:
+            tracer.record("query_embedding_wait", dispatched_at - submitted_at)
+
+    def __embed_batch(self, batch: List[Tuple[str, Future, float]]) -> None:
+        queries = list(dict.fromkeys(query for query, _, _ in batch))
+        start = time.perf_counter()
+        try:
+            embeddings = self._embed_batch_fn(queries)
+        except Exception as error:
+            self.__resolve(batch, queries, error=error)
+            return
+        self.__resolve(batch, queries, embeddings=embeddings, start=start)
+
+    async def __aembed_batch(self, batch: List[Tuple[str, asyncio.Future, float]]) -> None:
+        queries = list(dict.fromkeys(query for query, _, _ in batch))
+        start = time.perf_counter()
+        try:
+            embeddings = await self._aembed_batch_fn(queries)
+        except Exception as error:
+            self.__resolve(batch, queries, error=error)
+            return
+        self.__resolve(batch, queries, embeddings=embeddings, start=start)
+
+    def __resolve(self,
+                  batch: List[Tuple[str, Union[Future, asyncio.Future], float]],
+                  queries: List[str],
+                  embeddings: Optional[List[Embedding]] = None,
+                  error: Optional[Exception] = None,
+                  start: float = 0.0) -> None:
+        """
+        Give every caller of a batch its embedding, or the error of the batch.
+        """
+        if error is not None:
+            with self._condition:
+                self._stats["failed_batches"] += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        tracer.record("query_embedding_batch", time.perf_counter() - start, queries=len(batch), texts=len(queries))
+        with self._condition:
+            self._stats["deduplicated"] += len(batch) - len(queries)
+        embeddings_by_query = dict(zip(queries, embeddings))
+        for query, future, _ in batch:
+            #An async caller may have been cancelled
+            if not future.done():
+                future.set_result(embeddings_by_query[query])
+
+
+class ScheduledEmbedding(BaseEmbedding):
+    """
+    Embedding model sending text embeddings through an EmbeddingScheduler.
+    Query embeddings go through the QueryEmbeddingBatcher if any, else directly to the wrapped model
+    (the batcher embeds queries as texts: only for models embedding both the same way, like the OpenAI models).
+    """
+
+    _backend: BaseEmbedding = PrivateAttr()
+    _scheduler: EmbeddingScheduler = PrivateAttr()
+    _query_batcher: Optional[QueryEmbeddingBatcher] = PrivateAttr()
+
+    def __init__(self, backend: BaseEmbedding, scheduler: EmbeddingScheduler,
+                 query_batcher: Optional[QueryEmbeddingBatcher] = None, **kwargs: Any):
+        #The scheduler makes its own batches
+        kwargs.setdefault("embed_batch_size", 2048)
+        super().__init__(model_name=backend.model_name, **kwargs)
+        self._backend = backend
+        self._scheduler = scheduler
+        self._query_batcher = query_batcher
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ScheduledEmbedding"
+
+    @property
+    def scheduler(self) -> EmbeddingScheduler:
+        return self._scheduler
+
+    @property
+    def query_batcher(self) -> Optional[QueryEmbeddingBatcher]:
+        return self._query_batcher
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        if self._query_batcher is not None:
+            return self._query_batcher.embed(query)
+        return self._backend.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        if self._query_batcher is not None:
+            return await self._query_batcher.aembed(query)
+        return await self._backend.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._scheduler.embed([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._scheduler.embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._scheduler.aembed(texts)
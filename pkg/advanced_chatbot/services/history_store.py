@@ -0,0 +1,158 @@
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class ChatHistoryStore:
+    """
+    Chat history persisted in SQLite (WAL mode, shared by every Streamlit session).
+    Messages are appended one by one to their conversation, nothing is rewritten.
+    Conversations are loaded one at a time, the sidebar only reads the conversation index.
+    """
+
+    def __init__(self, db_path: Path):
+        self._db_path = Path(db_path)
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self.__connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    conversation_id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    num_messages INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message_id TEXT NOT NULL,
+                    conversation_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, seq)")
+
+    def __connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def create_conversation(self, conversation_id: Optional[str] = None) -> str:
+        """
+        Create an empty conversation.
+        :param conversation_id: The id of the conversation, a random uuid by default.
+        :return: The id of the conversation.
+        """
+        conversation_id = conversation_id or str(uuid.uuid4())
+        now = time.time()
+        with self.__connection() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO conversations (conversation_id, created_at, updated_at) VALUES (?, ?, ?)",
+                (conversation_id, now, now),
+            )
+        return conversation_id
+
+    def list_conversations(self) -> List[Dict]:
+        """
+        The conversation index, oldest first.
+        :return: The conversations (conversation_id, created_at, updated_at, num_messages), without their messages.
+        """
+        rows = self.__connection().execute("SELECT * FROM conversations ORDER BY created_at").fetchall()
+        return [dict(row) for row in rows]
+
+    def load_conversation(self, conversation_id: str) -> List[Dict]:
+        """
+        Load the messages of a conversation.
+        :param conversation_id: The id of the conversation.
+        :return: The messages (id, role, content) in order.
+        """
+        rows = self.__connection().execute(
+            "SELECT message_id, role, content FROM messages WHERE conversation_id = ? ORDER BY seq",
+            (conversation_id,),
+        ).fetchall()
+        return [{"id": row["message_id"], "role": row["role"], "content": row["content"]} for row in rows]
+
+    def append_message(self, conversation_id: str, message: Dict) -> None:
+        """
+        Append a message to a conversation (created if needed).
+        :param conversation_id: The id of the conversation.
+        :param message: The message (id, role, content).
+        """
+        self.append_messages(conversation_id, [message])
+
+    def append_messages(self, conversation_id: str, messages: List[Dict]) -> None:
+        """
+        Append messages to a conversation (created if needed) in one transaction.
+        :param conversation_id: The id of the conversation.
+        :param messages: The messages (id, role, content).
+        """
+        now = time.time()
+        with self.__connection() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO conversations (conversation_id, created_at, updated_at) VALUES (?, ?, ?)",
+                (conversation_id, now, now),
+            )
+            connection.executemany(
+                "INSERT INTO messages (message_id, conversation_id, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(message.get("id") or str(uuid.uuid4()), conversation_id, message["role"], message["content"], now)
+                 for message in messages],
+            )
+            connection.execute(
+                "UPDATE conversations SET updated_at = ?, num_messages = num_messages + ? WHERE conversation_id = ?",
+                (now, len(messages), conversation_id),
+            )
+
+    def import_json(self, json_path: Path) -> int:
+        """
+        Import a chat_history.json file ({conversation_id: [messages]}) into an empty store.
+        :param json_path: The path of the JSON history.
+        :return: The number of conversations imported (0 if the file is missing or the store is not empty).
+        """
+        json_path = Path(json_path)
+        if not json_path.is_file():
+            return 0
+        with open(json_path, "r") as file:
+            history = json.load(file)
+        if not isinstance(history, dict):
+            return 0
+
+        now = time.time()
+        connection = self.__connection()
+        #Write lock before the emptiness check, so concurrent sessions import the file once
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("SELECT 1 FROM conversations LIMIT 1").fetchone() is not None:
+                connection.rollback()
+                return 0
+            for position, (conversation_id, messages) in enumerate(history.items()):
+                #Keep the order of the JSON file
+                connection.execute(
+                    "INSERT INTO conversations (conversation_id, created_at, updated_at, num_messages) VALUES (?, ?, ?, ?)",
+                    (conversation_id, now + position * 1e-3, now, len(messages)),
+                )
+                connection.executemany(
+                    "INSERT INTO messages (message_id, conversation_id, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [(message.get("id") or str(uuid.uuid4()), conversation_id, message["role"], message["content"], now)
+                     for message in messages],
+                )
+        except Exception:
+            connection.rollback()
+            raise
+        connection.commit()
+        return len(history)
@@ -0,0 +1,89 @@
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class IndexCache:
+    """
+    Thread safe LRU cache of loaded indexes, bounded by a budget in bytes.
+    The size of an entry is provided by the caller (ex: size of the persisted index).
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._current_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a cached value and mark it as most recently used.
+        :param key: The cache key.
+        :return: The cached value or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        """
+        Add a value to the cache, evicting the least recently used entries to fit the budget.
+        Values larger than the whole budget are not cached.
+        :param key: The cache key.
+        :param value: The value to cache.
+        :param size: The size of the value in bytes.
+        """
+        with self._lock:
+            self.__remove(key)
+            if size > self._max_bytes:
+                return
+            while self._entries and self._current_bytes + size > self._max_bytes:
+                self.__remove(next(iter(self._entries)))
+                self._evictions += 1
+            self._entries[key] = (value, size)
+            self._current_bytes += size
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Remove a value from the cache.
+        :param key: The cache key.
+        """
+        with self._lock:
+            self.__remove(key)
+
+    def clear(self) -> None:
+        """
+        Remove every value from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the cache counters.
+        :return: hits, misses, evictions, number of entries and bytes used.
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "bytes": self._current_bytes,
+                "max_bytes": self._max_bytes,
+            }
+
+    def __remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._current_bytes -= entry[1]
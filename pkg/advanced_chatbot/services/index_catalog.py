@@ -0,0 +1,175 @@
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class IndexCatalog:
+    """
+    Catalog of the indexes stored on disk, in SQLite (WAL mode).
+    Holds the config of every index so that listing and filtering indexes does not open
+    one index_config.json per index. Kept up to date by the RagService on create, update and delete;
+    :rebuild rescans the storage directory when the catalog is missing or out of sync.
+    """
+
+    def __init__(self, db_path: Path):
+        self._db_path = Path(db_path)
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self.__connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS indexes (
+                    index_id TEXT PRIMARY KEY,
+                    document_path TEXT NOT NULL,
+                    content_hash TEXT,
+                    language TEXT,
+                    created_at REAL NOT NULL,
+                    config TEXT NOT NULL
+                )
+            """)
+            connection.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            for column in ("document_path", "content_hash", "language", "created_at"):
+                connection.execute(f"CREATE INDEX IF NOT EXISTS indexes_{column} ON indexes ({column})")
+
+    def __connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def is_built(self) -> bool:
+        """
+        Whether the catalog was built from the storage directory at least once.
+        """
+        row = self.__connection().execute("SELECT value FROM catalog_meta WHERE key = 'built_at'").fetchone()
+        return row is not None
+
+    def upsert(self, index_config: Dict) -> None:
+        """
+        Add or replace the entry of an index.
+        :param index_config: The config of the index (as saved in its index_config.json).
+        """
+        with self.__connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO indexes VALUES (?, ?, ?, ?, ?, ?)", _to_row(index_config))
+
+    def remove(self, index_id: str) -> None:
+        with self.__connection() as connection:
+            connection.execute("DELETE FROM indexes WHERE index_id = ?", (index_id,))
+
+    def get(self, index_id: str) -> Optional[Dict]:
+        """
+        The config of an index, None if the index is not in the catalog.
+        """
+        row = self.__connection().execute("SELECT config FROM indexes WHERE index_id = ?", (index_id,)).fetchone()
+        return json.loads(row["config"]) if row is not None else None
+
+    def list(self,
+             document_path: Optional[str] = None,
+             content_hash: Optional[str] = None,
+             language: Optional[str] = None,
+             created_after: Optional[float] = None,
+             created_before: Optional[float] = None,
+             limit: Optional[int] = None,
+             offset: int = 0) -> List[Dict]:
+        """
+        List the index configs matching all the given filters, oldest first.
+        :param document_path: Path of the indexed document.
+        :param content_hash: The sha256 of the indexed document.
+        :param language: The language of the document (ex: "fr").
+        :param created_after: Only the indexes created at or after this timestamp.
+        :param created_before: Only the indexes created before this timestamp.
+        :param limit: The maximum number of configs returned (page size), all by default.
+        :param offset: The number of matching configs skipped.
+        :return: The index configs.
+        """
+        where, params = self.__where(document_path, content_hash, language, created_after, created_before)
+        query = f"SELECT config FROM indexes {where} ORDER BY created_at, index_id LIMIT ? OFFSET ?"
+        rows = self.__connection().execute(query, params + [limit if limit is not None else -1, offset]).fetchall()
+        return [json.loads(row["config"]) for row in rows]
+
+    def count(self,
+              document_path: Optional[str] = None,
+              content_hash: Optional[str] = None,
+              language: Optional[str] = None,
+              created_after: Optional[float] = None,
+              created_before: Optional[float] = None) -> int:
+        """
+        The number of indexes matching the filters (see :list).
+        """
+        where, params = self.__where(document_path, content_hash, language, created_after, created_before)
+        return self.__connection().execute(f"SELECT COUNT(*) FROM indexes {where}", params).fetchone()[0]
+
+    def rebuild(self, storage_path: Path) -> int:
+        """
+        Replace the catalog with the indexes found in the storage directory (one sub directory
+        with an index_config.json per index, the other entries are ignored).
+        :param storage_path: The directory of the indexes.
+        :return: The number of indexes in the catalog.
+        """
+        rows = []
+        storage_path = Path(storage_path)
+        for index_dir in (storage_path.iterdir() if storage_path.is_dir() else []):
+            config_path = index_dir / "index_config.json"
+            if not config_path.is_file():
+                continue
+            try:
+                with open(config_path, "r") as f:
+                    index_config = json.load(f)
+            except (OSError, ValueError):
+                continue
+            #Indexes created before the catalog have no creation date
+            index_config.setdefault("created_at", os.stat(config_path).st_mtime)
+            rows.append(_to_row(index_config))
+
+        with self.__connection() as connection:
+            connection.execute("DELETE FROM indexes")
+            connection.executemany("INSERT OR REPLACE INTO indexes VALUES (?, ?, ?, ?, ?, ?)", rows)
+            connection.execute("INSERT OR REPLACE INTO catalog_meta VALUES ('built_at', strftime('%s', 'now'))")
+        return len(rows)
+
+    def __where(self, document_path, content_hash, language, created_after, created_before):
+        clauses, params = [], []
+        for clause, value in (("document_path = ?", str(document_path) if document_path is not None else None),
+                              ("content_hash = ?", content_hash),
+                              ("language = ?", language),
+                              ("created_at >= ?", created_after),
+                              ("created_at < ?", created_before)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def _to_row(index_config: Dict) -> tuple:
+    return (
+        index_config["index_id"],
+        str(index_config["document_path"]),
+        index_config.get("content_hash"),
+        (index_config.get("profile") or {}).get("language"),
+        index_config.get("created_at", 0.0),
+        json.dumps(index_config, default=str),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the index catalog from the indexes stored in DATA_PATH.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    from advanced_chatbot.services.rag_service import INDEX_CATALOG_PATH, RAG_STORAGE_PATH
+    print(f"{IndexCatalog(INDEX_CATALOG_PATH).rebuild(RAG_STORAGE_PATH)} indexes in the catalog.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def compute_file_hash(document_path: Path) -> str:
+    """
+    Compute the sha256 of a file content.
+    :param document_path: Path to the file to hash.
+    :return: The hex digest of the file content.
+    """
+    sha = hashlib.sha256()
+    with open(document_path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def compute_fingerprint(content_hash: str, rag_config: Dict) -> str:
+    """
+    Combine the content hash of a document and the config used to index it.
+    Two documents with the same fingerprint produce the same index.
+    :param content_hash: The sha256 of the document content.
+    :param rag_config: The chunking/embedding config used for indexing.
+    :return: The fingerprint of the (document, config) pair.
+    """
+    payload = json.dumps({"content_hash": content_hash, "rag_config": rag_config}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IndexRegistry:
+    """
+    Content addressed registry of the indexes stored on disk.
+    Maps the fingerprint of a document (content hash + rag config) to the id of its index,
+    so that indexing the same document twice returns the existing index.
+    """
+
+    def __init__(self, registry_path: Path):
+        self._registry_path = registry_path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, str] = {}
+        self._loaded_mtime: Optional[int] = None
+        #(resolved path, size, mtime) -> content hash, avoids re-hashing unchanged files
+        self._file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+    def content_hash(self, document_path: Path) -> str:
+        """
+        Hash of the document content, memoized on the file size and modification time.
+        :param document_path: Path to the document.
+        :return: The sha256 of the document content.
+        """
+        stat = os.stat(document_path)
+        key = (str(Path(document_path).resolve()), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._file_hashes.get(key)
+        if cached is not None:
+            return cached
+
+        content_hash = compute_file_hash(document_path)
+        with self._lock:
+            self._file_hashes[key] = content_hash
+        return content_hash
+
+    def lookup(self, fingerprint: str) -> Optional[str]:
+        """
+        Get the index id registered for a fingerprint.
+        :param fingerprint: The document fingerprint.
+        :return: The index id or None if the document was never indexed with this config.
+        """
+        with self._lock:
+            self.__reload_if_changed()
+            return self._entries.get(fingerprint)
+
+    def register(self, fingerprint: str, index_id: str) -> None:
+        """
+        Register a new index for a fingerprint.
+        :param fingerprint: The document fingerprint.
+        :param index_id: The id of the index built from the document.
+        """
+        with self._lock:
+            self.__reload_if_changed()
+            self._entries[fingerprint] = index_id
+            self.__save()
+
+    def unregister(self, index_id: str) -> None:
+        """
+        Remove every fingerprint pointing to an index.
+        :param index_id: The id of the removed index.
+        """
+        with self._lock:
+            self.__reload_if_changed()
+            fingerprints = [k for k, v in self._entries.items() if v == index_id]
+            if not fingerprints:
+                return
+            for fingerprint in fingerprints:
+                del self._entries[fingerprint]
+            self.__save()
+
+    def __reload_if_changed(self) -> None:
+        """
+        Reload the registry file when another process updated it.
+        """
+        try:
+            mtime = self._registry_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._entries, self._loaded_mtime = {}, None
+            return
+
+        if mtime == self._loaded_mtime:
+            return
+
+        with open(self._registry_path, "r") as f:
+            self._entries = json.load(f)
+        self._loaded_mtime = mtime
+
+    def __save(self) -> None:
+        """
+        Atomically write the registry file.
+        """
+        tmp_path = self._registry_path.with_name(f"{self._registry_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self._registry_path)
+        self._loaded_mtime = self._registry_path.stat().st_mtime_ns
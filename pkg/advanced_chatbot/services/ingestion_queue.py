@@ -0,0 +1,291 @@
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_name() -> str:
+    """
+    Name of the current process in the claimed_by column of the jobs ("hostname:pid").
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _is_worker_alive(worker_name: Optional[str]) -> bool:
+    """
+    Whether the process that claimed a job may still be running it.
+    Processes of other hosts are assumed alive (their jobs are queued again after the running timeout).
+    """
+    if not worker_name:
+        return False
+    hostname, _, pid = worker_name.rpartition(":")
+    if hostname != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+class IngestionJobQueue:
+    """
+    Queue of document ingestion jobs persisted in SQLite (WAL mode).
+    Jobs can be enqueued and claimed by any thread or process sharing the database.
+    A job goes from queued to running (claimed by a worker) to done or failed.
+    The process claiming a job is recorded (claimed_by), so that the jobs of a killed process can be queued again.
+    """
+
+    def __init__(self, db_path: Path, running_timeout_seconds: float = 3600):
+        self._db_path = Path(db_path)
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._running_timeout_seconds = running_timeout_seconds
+        self._local = threading.local()
+        with self.__connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    document_path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    index_id TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    claimed_by TEXT
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            #Databases created before claimed_by
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+            if "claimed_by" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN claimed_by TEXT")
+
+    def __connection(self) -> sqlite3.Connection:
+        """
+        One connection per thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def __transaction(self) -> "_Transaction":
+        return _Transaction(self.__connection())
+
+    def enqueue(self, document_path: Path) -> str:
+        """
+        Add an ingestion job, unless the document already has a queued or running job.
+        :param document_path: Path to the document to index.
+        :return: The id of the job.
+        """
+        with self.__transaction() as connection:
+            row = connection.execute(
+                "SELECT job_id FROM jobs WHERE document_path = ? AND status IN (?, ?)",
+                (str(document_path), JOB_QUEUED, JOB_RUNNING),
+            ).fetchone()
+            if row is not None:
+                return row["job_id"]
+
+            job_id = str(uuid.uuid4())
+            now = time.time()
+            connection.execute(
+                "INSERT INTO jobs (job_id, document_path, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, str(document_path), JOB_QUEUED, now, now),
+            )
+            return job_id
+
+    def claim(self, max_jobs: int = 1) -> List[Dict]:
+        """
+        Mark the oldest queued jobs as running and return them.
+        Running jobs older than the running timeout (crashed worker) are queued again first.
+        :param max_jobs: The maximum number of jobs to claim.
+        """
+        now = time.time()
+        with self.__transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+                (JOB_QUEUED, now, JOB_RUNNING, now - self._running_timeout_seconds),
+            )
+            rows = connection.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT ?", (JOB_QUEUED, max_jobs)
+            ).fetchall()
+            connection.executemany(
+                "UPDATE jobs SET status = ?, updated_at = ?, claimed_by = ? WHERE job_id = ?",
+                [(JOB_RUNNING, now, _worker_name(), row["job_id"]) for row in rows],
+            )
+        return [dict(row, status=JOB_RUNNING, claimed_by=_worker_name()) for row in rows]
+
+    def requeue_orphaned_jobs(self) -> int:
+        """
+        Queue again the running jobs whose process is gone (ex: the app was killed during an ingestion),
+        without waiting for the running timeout.
+        :return: The number of jobs queued again.
+        """
+        with self.__transaction() as connection:
+            rows = connection.execute("SELECT job_id, claimed_by FROM jobs WHERE status = ?", (JOB_RUNNING,)).fetchall()
+            orphaned = [row["job_id"] for row in rows if not _is_worker_alive(row["claimed_by"])]
+            connection.executemany(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ? AND status = ?",
+                [(JOB_QUEUED, time.time(), job_id, JOB_RUNNING) for job_id in orphaned],
+            )
+        return len(orphaned)
+
+    def complete(self, job_id: str, index_id: str) -> None:
+        """
+        Mark a job as done.
+        :param job_id: The id of the job.
+        :param index_id: The id of the index created by the job.
+        """
+        self.__connection().execute(
+            "UPDATE jobs SET status = ?, index_id = ?, updated_at = ? WHERE job_id = ?",
+            (JOB_DONE, index_id, time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str) -> None:
+        """
+        Mark a job as failed.
+        :param job_id: The id of the job.
+        :param error: Description of the failure.
+        """
+        self.__connection().execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+            (JOB_FAILED, error, time.time(), job_id),
+        )
+
+    def get(self, job_id: str) -> Dict:
+        """
+        Get a job.
+        :param job_id: The id of the job.
+        :return: The job (job_id, document_path, status, index_id, error, created_at, updated_at).
+        """
+        row = self.__connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Ingestion job with id {job_id} does not exist.")
+        return dict(row)
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT, so that concurrent claims never return the same job.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._connection.execute("BEGIN IMMEDIATE")
+        return self._connection
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self._connection.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+
+
+class IngestionWorker:
+    """
+    Background thread claiming queued jobs and running them in batches.
+    On start, the jobs left running by a killed process are queued again. Errors of the queue
+    (ex: database locked) are logged and retried with an exponential backoff, the thread never stops.
+    :param ingest_fn: Indexes a list of documents, returns their index ids (None when failed).
+    """
+
+    def __init__(self,
+                 queue: IngestionJobQueue,
+                 ingest_fn: Callable[[List[Path]], List[Optional[str]]],
+                 batch_size: int,
+                 poll_interval_seconds: float = 1.0,
+                 max_backoff_seconds: float = 60.0):
+        self._queue = queue
+        self._ingest_fn = ingest_fn
+        self._batch_size = batch_size
+        self._poll_interval_seconds = poll_interval_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        #(job id, index id, error) of the ingested jobs not saved in the queue yet
+        self._results: List[Tuple[str, Optional[str], str]] = []
+        self._wake_up = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Start the worker thread (once).
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.__run, name="ingestion-worker", daemon=True)
+                self._thread.start()
+
+    def notify(self) -> None:
+        """
+        Wake the worker up after a job was enqueued in this process.
+        """
+        self._wake_up.set()
+
+    def __run(self) -> None:
+        orphans_requeued = False
+        backoff_seconds = self._poll_interval_seconds
+        while True:
+            try:
+                if not orphans_requeued:
+                    self._queue.requeue_orphaned_jobs()
+                    orphans_requeued = True
+                self.__save_results()
+                if not self.__run_batch():
+                    #Jobs enqueued by other processes are picked up at the next poll
+                    self._wake_up.wait(self._poll_interval_seconds)
+                    self._wake_up.clear()
+                backoff_seconds = self._poll_interval_seconds
+            except Exception:
+                logger.exception("Ingestion worker error, retrying in %.1f s", backoff_seconds)
+                time.sleep(backoff_seconds)
+                backoff_seconds = min(backoff_seconds * 2, self._max_backoff_seconds)
+
+    def __run_batch(self) -> bool:
+        """
+        Claim and ingest a batch of jobs.
+        :return: Whether there was a job to run.
+        """
+        jobs = self._queue.claim(self._batch_size)
+        if not jobs:
+            return False
+
+        try:
+            index_ids = self._ingest_fn([Path(job["document_path"]) for job in jobs])
+        except Exception as error:
+            index_ids = [None] * len(jobs)
+            errors = repr(error)
+        else:
+            errors = "Ingestion failed, see the logs."
+        self._results = [(job["job_id"], index_id, errors) for job, index_id in zip(jobs, index_ids)]
+        self.__save_results()
+        return True
+
+    def __save_results(self) -> None:
+        """
+        Mark the ingested jobs as done or failed (kept for the next try if the queue is not reachable).
+        """
+        while self._results:
+            job_id, index_id, error = self._results[0]
+            if index_id is None:
+                self._queue.fail(job_id, error)
+            else:
+                self._queue.complete(job_id, index_id)
+            self._results.pop(0)
@@ -0,0 +1,263 @@
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from advanced_chatbot.services.storage_utils import save_array_atomic
+
+
+LEXICAL_VOCABULARY_FNAME = "lexical_vocabulary.npy"
+LEXICAL_VOCABULARY_OFFSETS_FNAME = "lexical_vocabulary_offsets.npy"
+LEXICAL_OFFSETS_FNAME = "lexical_offsets.npy"
+LEXICAL_POSTINGS_FNAME = "lexical_postings.npy"
+LEXICAL_FREQUENCIES_FNAME = "lexical_frequencies.npy"
+LEXICAL_DOC_LENGTHS_FNAME = "lexical_doc_lengths.npy"
+LEXICAL_NODE_IDS_FNAME = "lexical_node_ids.npy"
+LEXICAL_NODE_ID_OFFSETS_FNAME = "lexical_node_id_offsets.npy"
+
+#Words, and codes joining words with - _ . / (ex: "AB-1234" gives "ab-1234", "ab" and "1234")
+_TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-_./][^\W_]+)*")
+_PART_PATTERN = re.compile(r"[^\W_]+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase, accent free tokens of a text. A compound token (product code, reference) is kept whole
+    and split into its parts, so that both match.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens += _PART_PATTERN.findall(token)
+    return tokens
+
+
+class PackedStrings:
+    """
+    Strings stored as their concatenated UTF-8 bytes and the offset of every string
+    (string i is data[offsets[i]:offsets[i + 1]]), without the padding of numpy "U" arrays
+    (4 bytes per character, every string as long as the longest one).
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: Sequence[str]) -> "PackedStrings":
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        return cls(data=np.frombuffer(b"".join(encoded), dtype=np.uint8).copy(), offsets=offsets)
+
+    @classmethod
+    def load(cls, data_path: Path, offsets_path: Path) -> "PackedStrings":
+        data = np.load(data_path)
+        if data.dtype.kind == "U":
+            #Lexical indexes persisted as numpy "U" arrays
+            return cls.from_strings(data.tolist())
+        return cls(data=data, offsets=np.load(offsets_path))
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.offsets.nbytes
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> str:
+        return self.encoded(position).decode("utf-8")
+
+    def encoded(self, position: int) -> bytes:
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tobytes()
+
+    def find(self, string: str) -> Optional[int]:
+        """
+        Binary search of a string, the strings must be sorted (UTF-8 byte order is code point order).
+        :return: The position of the string, None if it is not stored.
+        """
+        value = string.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.encoded(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < len(self) and self.encoded(low) == value else None
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index of the nodes of an index, for exact term lookups without a query embedding.
+    Stored in compact arrays: the sorted vocabulary and the node ids (PackedStrings), the postings (node rows) and term frequencies of
+    every term (term t owns postings[offsets[t]:offsets[t + 1]]) and the length of every node.
+    The arrays are persisted as .npy files next to the vector store, postings are memory mapped on load.
+    """
+
+    def __init__(self,
+                 vocabulary: PackedStrings,
+                 offsets: np.ndarray,
+                 postings: np.ndarray,
+                 frequencies: np.ndarray,
+                 doc_lengths: np.ndarray,
+                 node_ids: PackedStrings):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.doc_lengths = doc_lengths
+        self.node_ids = node_ids
+
+    @classmethod
+    def build(cls, texts: Sequence[str], node_ids: Sequence[str]) -> "LexicalIndex":
+        """
+        Index the texts of the nodes.
+        :param texts: The text of every node.
+        :param node_ids: The id of every node.
+        """
+        term_postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[row] = len(tokens)
+            for term, frequency in Counter(tokens).items():
+                term_postings.setdefault(term, []).append((row, frequency))
+
+        vocabulary = sorted(term_postings)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(term_postings[term]) for term in vocabulary])
+        postings = np.empty(int(offsets[-1]), dtype=np.int32)
+        frequencies = np.empty(int(offsets[-1]), dtype=np.uint16)
+        for position, term in enumerate(vocabulary):
+            rows, term_frequencies = zip(*term_postings[term])
+            postings[offsets[position]:offsets[position + 1]] = rows
+            frequencies[offsets[position]:offsets[position + 1]] = np.minimum(term_frequencies, np.iinfo(np.uint16).max)
+        return cls(vocabulary=PackedStrings.from_strings(vocabulary),
+                   offsets=offsets,
+                   postings=postings,
+                   frequencies=frequencies,
+                   doc_lengths=doc_lengths,
+                   node_ids=PackedStrings.from_strings(list(node_ids)))
+
+    @classmethod
+    def exists(cls, persist_dir: Path) -> bool:
+        return (Path(persist_dir) / LEXICAL_VOCABULARY_FNAME).is_file()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: Path) -> "LexicalIndex":
+        persist_dir = Path(persist_dir)
+        return cls(vocabulary=PackedStrings.load(persist_dir / LEXICAL_VOCABULARY_FNAME,
+                                                 persist_dir / LEXICAL_VOCABULARY_OFFSETS_FNAME),
+                   offsets=np.load(persist_dir / LEXICAL_OFFSETS_FNAME),
+                   postings=np.load(persist_dir / LEXICAL_POSTINGS_FNAME, mmap_mode="r"),
+                   frequencies=np.load(persist_dir / LEXICAL_FREQUENCIES_FNAME, mmap_mode="r"),
+                   doc_lengths=np.load(persist_dir / LEXICAL_DOC_LENGTHS_FNAME),
+                   node_ids=PackedStrings.load(persist_dir / LEXICAL_NODE_IDS_FNAME,
+                                               persist_dir / LEXICAL_NODE_ID_OFFSETS_FNAME))
+
+    def persist(self, persist_dir: Path) -> None:
+        persist_dir = Path(persist_dir)
+        for fname, array in [(LEXICAL_VOCABULARY_FNAME, self.vocabulary.data),
+                             (LEXICAL_VOCABULARY_OFFSETS_FNAME, self.vocabulary.offsets),
+                             (LEXICAL_OFFSETS_FNAME, self.offsets),
+                             (LEXICAL_POSTINGS_FNAME, self.postings),
+                             (LEXICAL_FREQUENCIES_FNAME, self.frequencies),
+                             (LEXICAL_DOC_LENGTHS_FNAME, self.doc_lengths),
+                             (LEXICAL_NODE_IDS_FNAME, self.node_ids.data),
+                             (LEXICAL_NODE_ID_OFFSETS_FNAME, self.node_ids.offsets)]:
+            save_array_atomic(persist_dir / fname, array)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vocabulary.nbytes + self.node_ids.nbytes + sum(
+            array.nbytes for array in (self.offsets, self.postings, self.frequencies, self.doc_lengths))
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def term_ids(self, terms: List[str]) -> np.ndarray:
+        """
+        The position of each term in the vocabulary, -1 for the unknown terms.
+        """
+        positions = [self.vocabulary.find(term) for term in terms]
+        return np.array([position if position is not None else -1 for position in positions], dtype=np.int64)
+
+    def document_frequencies(self, term_ids: np.ndarray) -> np.ndarray:
+        return np.where(term_ids >= 0, self.offsets[term_ids + 1] - self.offsets[np.maximum(term_ids, 0)], 0)
+
+
+def lexical_top_k(lexical_indexes: Dict[str, LexicalIndex], query: str, similarity_top_k: int) -> List[Tuple[str, str, float]]:
+    """
+    BM25 search over several lexical indexes, scored with the statistics of all of them
+    (as if their nodes were in a single index).
+    :param lexical_indexes: The lexical indexes by index id.
+    :param query: The query string.
+    :param similarity_top_k: The number of nodes returned.
+    :return: The (index id, node id, score) of the best nodes, by decreasing score.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or not lexical_indexes:
+        return []
+    term_ids = {index_id: lexical_index.term_ids(terms) for index_id, lexical_index in lexical_indexes.items()}
+
+    #1. Collection statistics
+    num_docs = sum(len(lexical_index) for lexical_index in lexical_indexes.values())
+    if not num_docs:
+        return []
+    average_length = sum(int(lexical_index.doc_lengths.sum()) for lexical_index in lexical_indexes.values()) / num_docs
+    average_length = max(average_length, 1.0)
+    document_frequencies = sum(lexical_indexes[index_id].document_frequencies(ids) for index_id, ids in term_ids.items())
+    idfs = [math.log(1 + (num_docs - df + 0.5) / (df + 0.5)) for df in document_frequencies.tolist()]
+
+    #2. BM25 scores of the nodes of each index, accumulated term by term over the postings
+    candidates = []
+    for index_id, lexical_index in lexical_indexes.items():
+        scores = None
+        length_norms = None
+        for term_id, idf in zip(term_ids[index_id].tolist(), idfs):
+            if term_id < 0:
+                continue
+            if scores is None:
+                scores = np.zeros(len(lexical_index), dtype=np.float32)
+                length_norms = BM25_K1 * (1 - BM25_B + BM25_B * lexical_index.doc_lengths / average_length)
+            start, end = lexical_index.offsets[term_id], lexical_index.offsets[term_id + 1]
+            rows = lexical_index.postings[start:end]
+            frequencies = np.asarray(lexical_index.frequencies[start:end], dtype=np.float32)
+            scores[rows] += idf * frequencies * (BM25_K1 + 1) / (frequencies + length_norms[rows])
+        if scores is None:
+            continue
+        k = min(similarity_top_k, int(np.count_nonzero(scores)))
+        if not k:
+            continue
+        top = np.argpartition(-scores, k - 1)[:k]
+        candidates += [(index_id, str(lexical_index.node_ids[row]), float(scores[row])) for row in top]
+
+    return sorted(candidates, key=lambda candidate: -candidate[2])[:similarity_top_k]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[str, str]]], rrf_k: int = 60) -> List[Tuple[str, str, float]]:
+    """
+    Merge several rankings of nodes: a node scores the sum of 1 / (rrf_k + rank) over the rankings.
+    :param rankings: Lists of (index id, node id), best first.
+    :param rrf_k: The rank offset (60 in the original paper), higher values flatten the rank weights.
+    :return: The (index id, node id, score) of every ranked node, by decreasing score.
+    """
+    scores: Dict[Tuple[str, str], float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank)
+    return [(index_id, node_id, score) for (index_id, node_id), score in
+            sorted(scores.items(), key=lambda item: -item[1])]
@@ -0,0 +1,104 @@
+
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+PAGES_FNAME = "pages.bin"
+
+_MAGIC = b"PAGES1\n"
+_HEADER_LENGTH = struct.Struct("<Q")
+
+
+class PageStore:
+    """
+    Parsed pages of a document, persisted next to its index in a single file:
+    a JSON header (byte offset and metadata of every page) followed by the UTF-8 texts.
+    Reading a page is one positioned read, the source document is never opened again.
+    The file is replaced atomically, an open store keeps reading the version it opened.
+    """
+
+    def __init__(self, path: Path, offsets: List[int], metadata: List[Dict], data_start: int):
+        self._path = Path(path)
+        self._offsets = offsets
+        self._metadata = metadata
+        self._data_start = data_start
+        self._positions: Dict[str, int] = {}
+        for position, page_metadata in enumerate(metadata):
+            self._positions.setdefault(page_metadata.get("page_label"), position)
+        self._fd = os.open(self._path, os.O_RDONLY)
+
+    @classmethod
+    def exists(cls, persist_dir: Path) -> bool:
+        return (Path(persist_dir) / PAGES_FNAME).is_file()
+
+    @classmethod
+    def write(cls, persist_dir: Path, pages: List[Dict]) -> None:
+        """
+        Persist the pages of a document.
+        :param persist_dir: The directory of the index.
+        :param pages: The pages in order, as {"text": str, "metadata": dict}.
+        """
+        texts = [page["text"].encode("utf-8") for page in pages]
+        offsets = [0]
+        for text in texts:
+            offsets.append(offsets[-1] + len(text))
+        header = json.dumps({"offsets": offsets, "metadata": [page["metadata"] for page in pages]}).encode("utf-8")
+
+        path = Path(persist_dir) / PAGES_FNAME
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for text in texts:
+                f.write(text)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: Path) -> "PageStore":
+        """
+        Open the pages of an index (only the header is read).
+        """
+        path = Path(persist_dir) / PAGES_FNAME
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} is not a page store.")
+            (header_length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+            header = json.loads(f.read(header_length))
+        return cls(path, header["offsets"], header["metadata"], len(_MAGIC) + _HEADER_LENGTH.size + header_length)
+
+    def __len__(self) -> int:
+        return len(self._metadata)
+
+    def __del__(self):
+        fd = getattr(self, "_fd", None)
+        if fd is not None:
+            os.close(fd)
+
+    @property
+    def page_labels(self) -> List[Optional[str]]:
+        return [metadata.get("page_label") for metadata in self._metadata]
+
+    def find(self, page_label: str) -> Optional[int]:
+        """
+        The position of a page from its label (ex: "1"), None if there is no such page.
+        """
+        return self._positions.get(page_label)
+
+    def get_text(self, position: int) -> str:
+        """
+        The text of the page at a position.
+        """
+        if not 0 <= position < len(self._metadata):
+            raise ValueError(f"Page {position} does not exist, the document has {len(self._metadata)} pages.")
+        start, end = self._offsets[position], self._offsets[position + 1]
+        return os.pread(self._fd, end - start, self._data_start + start).decode("utf-8")
+
+    def get(self, position: int) -> Dict:
+        """
+        The page at a position, as {"text": str, "metadata": dict}.
+        """
+        return {"text": self.get_text(position), "metadata": dict(self._metadata[position])}
@@ -0,0 +1,114 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+#Storage types of the embeddings, from the most to the least precise
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+_INT8_MAX = 127
+#Rows converted at a time by quantized_scores: the float32 buffer of a batch stays in the CPU cache
+_SCORE_BATCH_SIZE = 128
+#float16 bits shifted into a float32 give value * 2**-112 (the bits 28-30 of the sign extension are cleared)
+_FLOAT16_EXPONENT_SHIFT = 2.0 ** 112
+_FLOAT16_WIDENED_MASK = np.int32(~0x70000000)
+
+
+def check_vector_dtype(vector_dtype: str) -> str:
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unsupported vector storage type {vector_dtype}, expected one of {VECTOR_DTYPES}.")
+    return vector_dtype
+
+
+def quantize(matrix: np.ndarray, vector_dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert float embeddings to a storage type.
+    int8 vectors are scaled per vector: row i is approximately codes[i] * scales[i].
+    :param matrix: The (n, dim) float embeddings.
+    :param vector_dtype: "float32", "float16" or "int8".
+    :return: The (n, dim) codes and the (n,) float32 scales (None for the float types).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if check_vector_dtype(vector_dtype) != "int8":
+        return matrix.astype(vector_dtype), None
+    scales = np.abs(matrix).max(axis=1) / _INT8_MAX if len(matrix) else np.zeros(0, dtype=np.float32)
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    codes = np.clip(np.rint(matrix / scales[:, None]), -_INT8_MAX, _INT8_MAX).astype(np.int8)
+    return codes, scales
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Float32 embeddings of quantized codes.
+    :param rows: Only dequantize these rows, all by default.
+    """
+    if rows is not None:
+        codes = codes[rows]
+        scales = scales[rows] if scales is not None else None
+    matrix = np.asarray(codes, dtype=np.float32)
+    return matrix * scales[:, None] if scales is not None else matrix
+
+
+def vector_dtype_of(codes: np.ndarray) -> str:
+    return check_vector_dtype(str(codes.dtype))
+
+
+def widest_vector_dtype(vector_dtypes: List[str]) -> str:
+    """
+    The most precise of several storage types (ex: float16 for float16 and int8).
+    """
+    return min(vector_dtypes, key=VECTOR_DTYPES.index, default="float32")
+
+
+def quantized_scores(codes: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray,
+                     rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Dot products of a float32 query with quantized rows, without a float32 copy of the matrix:
+    the codes are widened by batches of rows into a reused buffer. numpy converts float16 to float32 slowly,
+    so float16 codes are widened with integer operations (exact, the query is scaled up instead).
+    :param rows: Only score these rows, all by default.
+    :return: The score of every (selected) row.
+    """
+    if codes.dtype == np.float32:
+        return (codes[rows] if rows is not None else codes) @ query
+
+    num_rows = len(rows) if rows is not None else len(codes)
+    scores = np.empty(num_rows, dtype=np.float32)
+    if not num_rows:
+        return scores
+    query_scale = 1.0
+    if codes.dtype == np.float16:
+        codes = codes.view(np.int16)
+        #Keep the scaled query below the float32 max
+        query_scale = max(float(np.abs(query).max()), 1.0)
+        query = (query * (_FLOAT16_EXPONENT_SHIFT / query_scale)).astype(np.float32)
+        buffer = np.empty((min(num_rows, _SCORE_BATCH_SIZE), codes.shape[1]), dtype=np.int32)
+    else:
+        buffer = np.empty((min(num_rows, _SCORE_BATCH_SIZE), codes.shape[1]), dtype=np.float32)
+
+    for start in range(0, num_rows, _SCORE_BATCH_SIZE):
+        batch = codes[rows[start:start + _SCORE_BATCH_SIZE]] if rows is not None else codes[start:start + _SCORE_BATCH_SIZE]
+        widened = buffer[:len(batch)]
+        if widened.dtype == np.int32:
+            np.left_shift(batch, 13, out=widened, dtype=np.int32)
+            np.bitwise_and(widened, _FLOAT16_WIDENED_MASK, out=widened)
+            scores[start:start + len(batch)] = widened.view(np.float32) @ query
+        else:
+            np.copyto(widened, batch, casting="unsafe")
+            scores[start:start + len(batch)] = widened @ query
+    if query_scale != 1.0:
+        scores *= query_scale
+    if scales is not None:
+        scores *= scales[rows] if rows is not None else scales
+    return scores
+
+
+def row_norms(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    The L2 norm of every (dequantized) row, computed by batches of rows.
+    """
+    norms = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), _SCORE_BATCH_SIZE):
+        batch = np.asarray(codes[start:start + _SCORE_BATCH_SIZE], dtype=np.float32)
+        norms[start:start + len(batch)] = np.linalg.norm(batch, axis=1)
+    return norms * scales if scales is not None else norms
@@ -1,41 +1,53 @@
 
+from __future__ import annotations
+
+import asyncio
+import hashlib
 import json
-import random
-from typing import Dict, Generator, List, Tuple
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError, as_completed
+from functools import partial
+from typing import TYPE_CHECKING, AsyncGenerator, Callable, Dict, Generator, List, Optional, Tuple
 import uuid
-from llama_index.core import VectorStoreIndex
 from pathlib import Path
-from typing import List
-from llama_index_client import ChatMessage, Document
-from llama_index.core import SimpleDirectoryReader
+import shutil
 
-from advanced_chatbot.config import  (DATA_PATH, DEFAULT_RAG_CHUNK_OVERLAP, DEFAULT_RAG_CHUNK_SIZE,
+from advanced_chatbot.config import  (ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                                     ANSWER_CACHE_TTL_SECONDS, CACHE_BUDGET_SHARES, CACHE_MAX_BYTES, DATA_PATH, DEFAULT_RAG_ANN_NLIST, DEFAULT_RAG_ANN_NPROBE,
+                                     DEFAULT_RAG_CHUNK_OVERLAP, DEFAULT_RAG_CHUNK_SIZE,
                                      DEFAULT_RAG_SIMILARITY_TOP_K, DEFAULT_RAG_TOKEN_LIMIT, DEFAULT_RAG_WINDOW_SIZE, 
-                                     OPENAI_API_KEY, USE_MOCK_MODELS)
-
-from llama_index.core.llms import MockLLM
-from llama_index.core import MockEmbedding
-
-from llama_index.llms.openai import OpenAI
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.core.node_parser import (
-    SentenceSplitter,
-    SentenceWindowNodeParser,
-)
-from llama_index.core import StorageContext, load_index_from_storage
-from llama_index.core.retrievers import QueryFusionRetriever
-from llama_index.core.chat_engine import ContextChatEngine
-from llama_index.core.memory.chat_memory_buffer import (
-    ChatMemoryBuffer,
-)
-from llama_index.core.schema import NodeWithScore
-from llama_index.core.postprocessor import MetadataReplacementPostProcessor
-from llama_index.core.chat_engine.types import (
-    StreamingAgentChatResponse,
-)
-from llama_index.core.llms import ChatMessage, MessageRole
-from llama_index.core import ChatPromptTemplate
-import shutil
+                                     DEFAULT_RETRIEVAL_MODE, EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_MAX_TOKENS,
+                                     EMBEDDING_MAX_IN_FLIGHT, EMBEDDING_REQUESTS_PER_MINUTE, EMBEDDING_TOKENS_PER_MINUTE,
+                                     HYBRID_RETRIEVAL_CANDIDATES, HYBRID_RRF_K, INGESTION_PARSE_TIMEOUT_SECONDS, INGESTION_MAX_WORKERS, OPENAI_API_KEY, OPENAI_MAX_CONNECTIONS,
+                                     OPENAI_MAX_KEEPALIVE_CONNECTIONS, PROFILE_SUMMARY_MAX_CHARACTERS,
+                                     QUERY_EMBEDDING_MAX_BATCH_SIZE, QUERY_EMBEDDING_MAX_WAIT_MS,
+                                     TRACING_JSONL, TRACING_LOG_SPANS, TRACING_PROFILE_SAMPLE_RATE, USE_MOCK_MODELS,
+                                     VECTOR_RESCORE_OVERSAMPLING, VECTOR_STORAGE_DTYPE)
+
+from advanced_chatbot.services.answer_cache import AnswerCache
+from advanced_chatbot.services.document_profile import compute_document_profile, select_summary_content
+from advanced_chatbot.services.index_cache import IndexCache
+from advanced_chatbot.services.index_catalog import IndexCatalog
+from advanced_chatbot.services.index_registry import IndexRegistry, compute_fingerprint
+from advanced_chatbot.services.ingestion_queue import JOB_DONE, JOB_FAILED, IngestionJobQueue, IngestionWorker
+from advanced_chatbot.services.lexical_index import LexicalIndex
+from advanced_chatbot.services.page_store import PageStore
+from advanced_chatbot.services.sentence_windows import WINDOW_METADATA_KEY, SentenceWindows, strip_windows
+from advanced_chatbot.services.single_flight import SingleFlight
+from advanced_chatbot.services.tracing import HistogramSink, JsonlSink, LogSink, tracer
+
+#llama_index (and the services built on it) is imported on first use: importing this module stays cheap,
+#the cost is paid when the RagService singleton is first used
+if TYPE_CHECKING:
+    from llama_index.core import Document, VectorStoreIndex
+    from llama_index.core.llms import ChatMessage
+    from llama_index.core.schema import BaseNode, NodeWithScore
 
 
 DEFAULT_SYSTEM_PROMPT= """
@@ -70,15 +82,73 @@ SUMMARIZATION_USER_PROMPT = """
 """
 
 
-LANGUAGE_DETECTION_SYSTEM_PROMPT = """
-You are a language detection tool. Given a text, you should detect the language of the text.
-If french, respon with 'fr', if english respond with 'en'. etc. 
-Even though , a text comprises multiple languages, you should respond with the dominant language.
-In the short version of the language.
-Don't always with nothing but that short version of the language.
-"""
+logger = logging.getLogger(__name__)
 
 RAG_STORAGE_PATH = DATA_PATH / "rag_storage"
+RAG_REGISTRY_PATH = RAG_STORAGE_PATH / "index_registry.json"
+INDEX_CATALOG_PATH = RAG_STORAGE_PATH / "index_catalog.sqlite3"
+SINGLE_FLIGHT_LOCKS_PATH = RAG_STORAGE_PATH / "locks"
+EMBEDDING_CACHE_PATH = DATA_PATH / "embedding_cache" / "embeddings.sqlite3"
+INGESTION_JOBS_PATH = DATA_PATH / "ingestion_jobs" / "jobs.sqlite3"
+TRACES_PATH = DATA_PATH / "traces"
+
+#The tracer is global: its sinks are added once per process, shared by the services
+_TRACING_LOCK = threading.Lock()
+_trace_histogram: Optional[HistogramSink] = None
+
+
+def read_document(document_path: Path)-> List[Document]:
+    """
+    Read a document and return a list of pages.
+    :param document_path: Path to the document( Absolute path of a pdf or docx file.)
+    :return: List[Document] : A list of Document objects.
+    """
+    file_extension = document_path.suffix
+    
+    if file_extension not in [".pdf", ".docx"]:
+        raise ValueError("The document must be a pdf or a docx file.")
+    
+    from llama_index.core import SimpleDirectoryReader
+    reader = SimpleDirectoryReader(input_files = [document_path])
+    return reader.load_data()
+
+
+
+def compute_node_hash(node: BaseNode, window: Optional[str] = None)-> str:
+    """
+    Hash of what a node contributes to an index: its text, its sentence window and its page
+    (the file metadata, ex: modification date, is left out).
+    :param window: The window of the node when it is not in its metadata (compact sentence windows).
+    """
+    metadata = node.metadata
+    window = window if window is not None else metadata.get(WINDOW_METADATA_KEY, "")
+    content = "\x1f".join([node.get_content(), str(window), str(metadata.get("page_label", ""))])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+
+def parse_document_pages_and_nodes(document_path: Path)-> Tuple[List[Dict], List[BaseNode]]:
+    """
+    Read a document and split it into sentence window nodes (not embedded yet).
+    Module level function so that documents can be parsed in worker processes.
+    :param document_path: Path to the document( Absolute path of a pdf or docx file.)
+    :return: The pages of the document (as {"text", "metadata"}, see PageStore) and its nodes.
+    """
+    from llama_index.core.node_parser import SentenceSplitter, SentenceWindowNodeParser
+    
+    sentence_splitter = SentenceSplitter.from_defaults(
+        chunk_size=DEFAULT_RAG_CHUNK_SIZE,
+        chunk_overlap=DEFAULT_RAG_CHUNK_OVERLAP
+    )
+    text_plitter_fn = lambda x: sentence_splitter.split_text(x)
+    parser = SentenceWindowNodeParser.from_defaults(
+        sentence_splitter=text_plitter_fn,
+        window_size=DEFAULT_RAG_WINDOW_SIZE
+    )
+    documents = read_document(document_path)
+    pages = [{"text": document.text, "metadata": document.metadata} for document in documents]
+    return pages, parser.get_nodes_from_documents(documents)
+
 
 
 class _RagService:
@@ -86,9 +156,28 @@ class _RagService:
     Service implement retrieval augmented generatoin primitives.
     """
     
-    def __init__(self):
+    def __init__(self, cache_max_bytes: int = CACHE_MAX_BYTES):
         self.__init_llm_and_embedding()
         RAG_STORAGE_PATH.mkdir(parents=True, exist_ok=True)
+        self._registry = IndexRegistry(RAG_REGISTRY_PATH)
+        self._catalog = IndexCatalog(INDEX_CATALOG_PATH)
+        if not self._catalog.is_built():
+            self._catalog.rebuild(RAG_STORAGE_PATH)
+        #The caches share the memory budget, each one gets its share (CACHE_BUDGET_SHARES)
+        self._index_cache = IndexCache(max_bytes=int(cache_max_bytes * CACHE_BUDGET_SHARES["indexes"]))
+        self._embedding_block_cache = IndexCache(max_bytes=int(cache_max_bytes * CACHE_BUDGET_SHARES["embedding_blocks"]))
+        self._sentence_windows_cache = IndexCache(max_bytes=int(cache_max_bytes * CACHE_BUDGET_SHARES["sentence_windows"]))
+        self._lexical_index_cache = IndexCache(max_bytes=int(cache_max_bytes * CACHE_BUDGET_SHARES["lexical_indexes"]))
+        #Identical ingestions and LLM calls running at the same time (threads or processes) are done once
+        self._single_flight = SingleFlight(SINGLE_FLIGHT_LOCKS_PATH)
+        self.__init_tracing()
+        self._answer_cache = AnswerCache(similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                                         ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                                         max_entries=ANSWER_CACHE_MAX_ENTRIES)
+        self._ingestion_queue = IngestionJobQueue(INGESTION_JOBS_PATH)
+        self._ingestion_worker = IngestionWorker(queue=self._ingestion_queue,
+                                                 ingest_fn=self.create_vector_store_indexes,
+                                                 batch_size=INGESTION_MAX_WORKERS)
         
         
         
@@ -96,16 +185,93 @@ class _RagService:
         """
         Initialize the language model and the embedding.
         """
+        from llama_index.core import MockEmbedding
+        from llama_index.core.llms import MockLLM
+        from advanced_chatbot.services.embedding_cache import CachedEmbedding, EmbeddingCache
+        from advanced_chatbot.services.embedding_scheduler import (EmbeddingScheduler, QueryEmbeddingBatcher,
+                                                                   ScheduledEmbedding, make_openai_async_batch_fn,
+                                                                   make_openai_batch_fn)
         
         if USE_MOCK_MODELS:
             self._llm = MockLLM(max_tokens=256)
-            self._embedding = MockEmbedding(embed_dim=1536)
+            embedding = MockEmbedding(embed_dim=1536)
+            embed_batch_fn = embedding.get_text_embedding_batch
+            aembed_batch_fn = embedding.aget_text_embedding_batch
+            self._embedding_model_name = "mock-1536"
         else:
-            self._llm = OpenAI(api_key=OPENAI_API_KEY,model="gpt-3.5-turbo")
-            self._embedding = OpenAIEmbedding(api_key=OPENAI_API_KEY, model="text-embedding-3-small")
+            import httpx
+            from llama_index.embeddings.openai import OpenAIEmbedding
+            from llama_index.llms.openai import OpenAI
+            #Connection pools shared by every LLM and embedding request (sync API and async API)
+            limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                  max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS)
+            http_client, async_http_client = httpx.Client(limits=limits), httpx.AsyncClient(limits=limits)
+            self._llm = OpenAI(api_key=OPENAI_API_KEY,model="gpt-3.5-turbo",
+                               http_client=http_client, async_http_client=async_http_client)
+            embedding = OpenAIEmbedding(api_key=OPENAI_API_KEY, model="text-embedding-3-small",
+                                        http_client=http_client, async_http_client=async_http_client)
+            embed_batch_fn = make_openai_batch_fn(api_key=OPENAI_API_KEY, model="text-embedding-3-small",
+                                                  http_client=http_client)
+            aembed_batch_fn = make_openai_async_batch_fn(api_key=OPENAI_API_KEY, model="text-embedding-3-small",
+                                                         http_client=async_http_client)
+            self._embedding_model_name = "text-embedding-3-small"
+        
+        #Text embeddings are sent as concurrent token-bounded batches, under the API rate limits
+        #(from worker threads for the sync API, on the event loop for the async API)
+        scheduler = EmbeddingScheduler(embed_batch_fn=embed_batch_fn,
+                                       aembed_batch_fn=aembed_batch_fn,
+                                       max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS,
+                                       max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+                                       max_in_flight=EMBEDDING_MAX_IN_FLIGHT,
+                                       requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+                                       tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE)
+        
+        #Query embeddings of concurrent chats are micro-batched (sent through the scheduler, under the same rate limits)
+        self._query_batcher = None
+        if QUERY_EMBEDDING_MAX_WAIT_MS > 0:
+            self._query_batcher = QueryEmbeddingBatcher(embed_batch_fn=scheduler.embed,
+                                                        aembed_batch_fn=scheduler.aembed,
+                                                        max_wait_ms=QUERY_EMBEDDING_MAX_WAIT_MS,
+                                                        max_batch_size=QUERY_EMBEDDING_MAX_BATCH_SIZE,
+                                                        max_in_flight=EMBEDDING_MAX_IN_FLIGHT)
+        
+        #Chunks already embedded (re-uploads, shared pages) are served from the on-disk cache
+        self._embedding = CachedEmbedding(backend=ScheduledEmbedding(backend=embedding, scheduler=scheduler,
+                                                                     query_batcher=self._query_batcher),
+                                          cache=EmbeddingCache(EMBEDDING_CACHE_PATH),
+                                          model_name=self._embedding_model_name)
         
 
         
+    def __init_tracing(self):
+        """
+        Send the spans to the sinks enabled in the config (once per process, a second service would duplicate
+        the spans).
+        """
+        global _trace_histogram
+        with _TRACING_LOCK:
+            if _trace_histogram is None:
+                _trace_histogram = HistogramSink()
+                tracer.add_sink(_trace_histogram)
+                if TRACING_LOG_SPANS:
+                    tracer.add_sink(LogSink())
+                if TRACING_JSONL:
+                    tracer.add_sink(JsonlSink(TRACES_PATH / "spans.jsonl"))
+                if TRACING_PROFILE_SAMPLE_RATE > 0:
+                    tracer.configure_profiling(TRACING_PROFILE_SAMPLE_RATE, TRACES_PATH / "profiles")
+        self._trace_histogram = _trace_histogram
+    
+    
+    
+    def trace_stats(self)-> Dict[str, Dict]:
+        """
+        Get the latency percentiles (ms) and counter totals of every traced stage
+        (chat, load_indexes, retrieve, postprocess, context, first_token, generation, ingest, parse, embed, build_index...).
+        """
+        return self._trace_histogram.stats()
+    
+    
+    
     def parse_document(self, document_path: Path)-> List[Document]:
         """
         Read a document and return a list of pages.
@@ -114,13 +280,7 @@ class _RagService:
         :return: List[Document] : A list of Document objects.
         
         """
-        file_extension = document_path.suffix
-        
-        if file_extension not in [".pdf", ".docx"]:
-            raise ValueError("The document must be a pdf or a docx file.")
-        
-        reader = SimpleDirectoryReader(input_files = [document_path])
-        return reader.load_data()
+        return read_document(document_path)
     
     
     
@@ -134,60 +294,494 @@ class _RagService:
     
     
     
-    def create_vector_store_index(self,  document_path: Path, persist=True)->Tuple[str, VectorStoreIndex]:
+    def __get_index_size(self, index_id: str)-> int:
+        """
+        Size in bytes of the persisted files of an index, used as the cost of a cached index.
+        :param index_id: The id of the index.
+        """
+        return sum(f.stat().st_size for f in self.__get_index_persist_dir(index_id).iterdir() if f.is_file())
+    
+    
+    
+    def __get_rag_config(self)-> Dict:
+        """
+        Get the config that determines the content of an index.
+        Changing any of these values invalidates the indexes previously registered.
+        """
+        return {
+            "chunk_size": DEFAULT_RAG_CHUNK_SIZE,
+            "chunk_overlap": DEFAULT_RAG_CHUNK_OVERLAP,
+            "window_size": DEFAULT_RAG_WINDOW_SIZE,
+            "embedding_model": self._embedding_model_name,
+        }
+    
+    
+    
+    def __build_ann_index(self, index_id: str, index: VectorStoreIndex)-> None:
+        """
+        Switch an existing index to ANN mode.
+        :param index_id: The id of the index.
+        :param index: The loaded index.
+        """
+        ivf = index.vector_store.build_ann_index(nlist=DEFAULT_RAG_ANN_NLIST or None)
+        ivf.persist(self.__get_index_persist_dir(index_id))
+        
+        #The loaded index was switched in place, it stays cached
+        index_config = self.load_index_config(index_id)
+        index_config["ann"] = {"nlist": ivf.nlist}
+        self.__save_index_config(index_id, index_config)
+        self._embedding_block_cache.clear()
+    
+    
+    
+    def __supports_ann_index(self, index: VectorStoreIndex)-> bool:
+        """
+        Whether an IVF index can be built for an index: the legacy indexes (SimpleVectorStore) have no ANN mode,
+        and an index without nodes (ex: a scanned pdf) has nothing to cluster.
+        """
+        from advanced_chatbot.services.vector_store import MmapVectorStore
+        
+        vector_store = index.vector_store
+        return isinstance(vector_store, MmapVectorStore) and len(vector_store.node_ids) > 0
+    
+    
+    
+    def find_vector_store_index(self, document_path: Path)-> Optional[str]:
+        """
+        Find the index already built from a document with the current rag config.
+        :param document_path: Path to the document( Absolute path of a pdf or docx file.)
+        :return: The id of the index or None if the document has not been indexed yet.
+        """
+        content_hash = self._registry.content_hash(document_path)
+        fingerprint = compute_fingerprint(content_hash, self.__get_rag_config())
+        index_id = self._registry.lookup(fingerprint)
+        
+        if index_id is not None and not (self.__get_index_persist_dir(index_id) / "index_config.json").exists():
+            #The index directory was removed behind our back
+            self._registry.unregister(index_id)
+            return None
+        return index_id
+    
+    
+    
+    def create_vector_store_index(self,  document_path: Path, persist=True, use_ann=False)->Tuple[str, VectorStoreIndex]:
         
         """
         Create a vector store index using a given document.
+        If the document has already been indexed with the same config, the existing index is returned.
         :param document_path: Path to the document( Absolute path of a pdf or docx file.)
         ex: document_path = "/home/user/toto.pdf"
         :param persist: Whether to persist the index or not.
+        :param use_ann: Build an IVF index for approximate search (large documents),
+        tuned by DEFAULT_RAG_ANN_NLIST and DEFAULT_RAG_ANN_NPROBE.
+        The embeddings are stored as VECTOR_STORAGE_DTYPE (float32, float16 or int8).
+        Concurrent calls for the same document (threads or processes) build the index once.
         :return : Tuple[Dict, VectorStoreIndex] : A tuple containing the index config and the index object.
         
         """
-        #1.Read the document
-        sentence_splitter = SentenceSplitter.from_defaults(
-            chunk_size=DEFAULT_RAG_CHUNK_SIZE,
-            chunk_overlap=DEFAULT_RAG_CHUNK_OVERLAP
-        )
-        text_plitter_fn = lambda x: sentence_splitter.split_text(x)
-        parser = SentenceWindowNodeParser.from_defaults(
-            sentence_splitter=text_plitter_fn,
-            window_size=DEFAULT_RAG_WINDOW_SIZE
-        )
-        
-        #2. Parse nodes.
-        nodes = parser.get_nodes_from_documents(self.parse_document(document_path))
-        
-        #3. Generate index UUID
-        index_id = str(uuid.uuid4()).split("-")[0]  
-        
-        if persist: 
-            persist_dir = self.__get_index_persist_dir(index_id)
-            persist_dir.mkdir(parents=True, exist_ok=True)
-            storage_context = StorageContext.from_defaults()
-        else:
-            storage_context = None
+        if not persist:
+            return self.__create_vector_store_index(document_path, persist, use_ann)
+        
+        index_id, index = self._single_flight.do(self.__ingestion_key(document_path),
+                                                 lambda: self.__create_vector_store_index(document_path, persist, use_ann))
+        if use_ann and self.__supports_ann_index(index) and index.vector_store.ann_index is None:
+            #The index was built by a concurrent call without ANN
+            return self.create_vector_store_index(document_path, persist, use_ann)
+        return index_id, index
+    
+    
+    
+    def __create_vector_store_index(self, document_path: Path, persist: bool, use_ann: bool)-> Tuple[str, VectorStoreIndex]:
+        with tracer.span("ingest", document=str(document_path)) as span:
+            #0. Reuse the index of an already indexed document
+            if persist:
+                existing = self.__load_existing_index(document_path, use_ann)
+                if existing is not None:
+                    span.count("already_indexed")
+                    return existing
+            
+            #1. Read the document and parse nodes.
+            with tracer.span("parse") as parse_span:
+                pages, nodes = parse_document_pages_and_nodes(document_path)
+                parse_span.count("nodes", len(nodes))
+            
+            #2. Embed the nodes, then build the index
+            self.__embed_nodes(nodes, parent_span=span)
+            return self.__build_vector_store_index(document_path, pages, nodes, persist=persist, use_ann=use_ann)
+    
+    
+    
+    async def acreate_vector_store_index(self, document_path: Path, persist=True, use_ann=False)-> Tuple[str, VectorStoreIndex]:
+        """
+        Async version of create_vector_store_index: the nodes are embedded with the async embedding API,
+        parsing and disk I/O run in worker threads.
+        """
+        if not persist:
+            return await self.__acreate_vector_store_index(document_path, persist, use_ann)
         
+        key = await asyncio.to_thread(self.__ingestion_key, document_path)
+        index_id, index = await self._single_flight.ado(key, lambda: self.__acreate_vector_store_index(document_path, persist, use_ann))
+        if use_ann and self.__supports_ann_index(index) and index.vector_store.ann_index is None:
+            return await self.acreate_vector_store_index(document_path, persist, use_ann)
+        return index_id, index
+    
+    
+    
+    async def __acreate_vector_store_index(self, document_path: Path, persist: bool, use_ann: bool)-> Tuple[str, VectorStoreIndex]:
+        #0. Reuse the index of an already indexed document
+        if persist and await asyncio.to_thread(self.find_vector_store_index, document_path) is not None:
+            return await asyncio.to_thread(self.__create_vector_store_index, document_path, persist, use_ann)
         
-        index_config = {
-            "index_id": index_id,
-            "document_path": str(document_path),
-        }
+        #1. Read the document and parse nodes.
+        pages, nodes = await asyncio.to_thread(parse_document_pages_and_nodes, document_path)
         
-        #4. Create the index
-        index = VectorStoreIndex(
-            nodes=
-            nodes,
-            storage_context=storage_context,
-            embed_model=self._embedding,
-            show_progress=True,
-        )
-        
-        if persist:
-            storage_context.persist(persist_dir=persist_dir)
-            #Save the index config in the persist directory
-            with open(self.__get_index_persist_dir(index_id) / "index_config.json", "w") as f:
-                json.dump(index_config, f)
+        #2. Embed the nodes, then build the index
+        await self.__aembed_nodes(nodes)
+        return await asyncio.to_thread(self.__build_vector_store_index, document_path, pages, nodes, persist, use_ann)
+    
+    
+    
+    def __load_existing_index(self, document_path: Path, use_ann: bool)-> Optional[Tuple[str, VectorStoreIndex]]:
+        """
+        Load the index already built from a document (switched to ANN mode if :use_ann), None if there is none.
+        """
+        existing_index_id = self.find_vector_store_index(document_path)
+        if existing_index_id is None:
+            return None
+        index = self.load_vector_store_index(existing_index_id)
+        if use_ann and not self.__supports_ann_index(index):
+            logger.info("Index %s kept in exact mode: legacy vector store or no nodes", existing_index_id)
+        elif use_ann and index.vector_store.ann_index is None:
+            self.__build_ann_index(existing_index_id, index)
+        return existing_index_id, index
+    
+    
+    
+    def __ingestion_key(self, document_path: Path)-> str:
+        """
+        Single flight key of the ingestion of a document (same content and rag config, same key).
+        """
+        content_hash = self._registry.content_hash(document_path)
+        return "create_vector_store_index:" + compute_fingerprint(content_hash, self.__get_rag_config())
+    
+    
+    
+    def single_flight_stats(self)-> Dict[str, int]:
+        """
+        Get the number of deduplicated calls (ingestions, summaries, translations) of this process.
+        """
+        return self._single_flight.stats()
+    
+    
+    
+    def create_vector_store_indexes(self,
+                                    document_paths: List[Path],
+                                    progress_callback: Optional[Callable[[Path, str], None]] = None,
+                                    use_ann=False)-> List[Optional[str]]:
+        """
+        Create the vector store indexes of several documents.
+        The documents are parsed in a process pool, then the nodes of every document are embedded
+        concurrently through the shared embedding scheduler and each index is persisted.
+        Documents already indexed are not parsed again, documents with the same content are indexed once,
+        and a document being indexed by a concurrent call (create_vector_store_index) gets the same index.
+        :param document_paths: Paths to the documents (pdf or docx files).
+        :param progress_callback: Called in the calling thread as progress_callback(document_path, stage)
+        with stage "parsed", "indexed" or "failed".
+        :param use_ann: Build the indexes in ANN mode (see create_vector_store_index).
+        :return: The index id of every document (None when its ingestion failed), in the same order.
+        """
+        with tracer.span("ingest_batch", documents=len(document_paths)) as batch_span:
+            return self.__create_vector_store_indexes(document_paths, progress_callback, use_ann, batch_span)
+    
+    
+    
+    def __create_vector_store_indexes(self,
+                                      document_paths: List[Path],
+                                      progress_callback: Optional[Callable[[Path, str], None]],
+                                      use_ann: bool,
+                                      batch_span)-> List[Optional[str]]:
+        notify = progress_callback or (lambda document_path, stage: None)
+        index_ids: List[Optional[str]] = [None] * len(document_paths)
+        
+        #1. Skip the documents already indexed, and the copies of a document of the batch (same ingestion key)
+        to_parse, keys, first_positions, duplicates = {}, {}, {}, {}
+        for position, document_path in enumerate(document_paths):
+            try:
+                keys[position] = self.__ingestion_key(document_path)
+                if keys[position] in first_positions:
+                    duplicates[position] = first_positions[keys[position]]
+                    batch_span.count("deduplicated")
+                    continue
+                first_positions[keys[position]] = position
+                index_ids[position] = self.find_vector_store_index(document_path)
+            except Exception:
+                logger.exception("Failed to read %s", document_path)
+                batch_span.count("failed")
+                notify(document_path, "failed")
+                continue
+            if index_ids[position] is None:
+                to_parse[position] = document_path
+            else:
+                batch_span.count("already_indexed")
+                notify(document_path, "indexed")
+        if not to_parse:
+            return self.__resolve_duplicates(document_paths, index_ids, duplicates, notify)
+        
+        #2. Parse the documents in worker processes (spawned: forking a process whose other threads hold
+        #locks, ex: a concurrent ingestion or the embedding scheduler, can leave the child stuck)
+        parsed = {}
+        num_workers = min(INGESTION_MAX_WORKERS, len(to_parse))
+        executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"))
+        with tracer.span("parse") as parse_span:
+            futures = {executor.submit(parse_document_pages_and_nodes, document_path): position
+                       for position, document_path in to_parse.items()}
+            pending = set(futures)
+            try:
+                for future in as_completed(futures, timeout=INGESTION_PARSE_TIMEOUT_SECONDS * math.ceil(len(futures) / num_workers)):
+                    pending.discard(future)
+                    position = futures[future]
+                    try:
+                        parsed[position] = future.result()
+                        parse_span.count("nodes", len(parsed[position][1]))
+                        notify(document_paths[position], "parsed")
+                    except Exception:
+                        logger.exception("Failed to parse %s", document_paths[position])
+                        batch_span.count("failed")
+                        notify(document_paths[position], "failed")
+            except TimeoutError:
+                for future in pending:
+                    logger.error("Timed out parsing %s", document_paths[futures[future]])
+                    batch_span.count("failed")
+                    notify(document_paths[futures[future]], "failed")
+            finally:
+                self.__shutdown_process_pool(executor, kill=bool(pending))
+        
+        #3. Embed the nodes of all the documents at the same time, then build each index.
+        #Each document goes through the single flight of create_vector_store_index: a concurrent ingestion
+        #of the same document (thread or process) and the batch build a single index
+        with ThreadPoolExecutor(max_workers=min(INGESTION_MAX_WORKERS, max(len(parsed), 1))) as executor:
+            futures = {executor.submit(self._single_flight.do, keys[position],
+                                       partial(self.__index_parsed_document, document_paths[position], pages, nodes,
+                                               use_ann, batch_span)): position
+                       for position, (pages, nodes) in parsed.items()}
+            for future in as_completed(futures):
+                position = futures[future]
+                document_path = document_paths[position]
+                try:
+                    index_ids[position], _ = future.result()
+                    notify(document_path, "indexed")
+                except Exception:
+                    logger.exception("Failed to index %s", document_path)
+                    batch_span.count("failed")
+                    notify(document_path, "failed")
+        
+        return self.__resolve_duplicates(document_paths, index_ids, duplicates, notify)
+    
+    
+    
+    def __index_parsed_document(self,
+                                document_path: Path,
+                                pages: List[Document],
+                                nodes: List[BaseNode],
+                                use_ann: bool,
+                                batch_span)-> Tuple[str, VectorStoreIndex]:
+        """
+        Embed the parsed nodes of a document and build its index, unless a concurrent call indexed it
+        since the batch looked for it.
+        """
+        existing = self.__load_existing_index(document_path, use_ann)
+        if existing is not None:
+            batch_span.count("already_indexed")
+            return existing
+        self.__embed_nodes(nodes, batch_span)
+        return self.__build_vector_store_index(document_path, pages, nodes, persist=True, use_ann=use_ann)
+    
+    
+    
+    def __resolve_duplicates(self,
+                             document_paths: List[Path],
+                             index_ids: List[Optional[str]],
+                             duplicates: Dict[int, int],
+                             notify: Callable[[Path, str], None])-> List[Optional[str]]:
+        """
+        Give the copies of a document of the batch the index of the first one.
+        """
+        for position, first_position in duplicates.items():
+            index_ids[position] = index_ids[first_position]
+            notify(document_paths[position], "indexed" if index_ids[position] is not None else "failed")
+        return index_ids
+    
+    
+    
+    def __shutdown_process_pool(self, executor: ProcessPoolExecutor, kill: bool)-> None:
+        """
+        Shut a process pool down, killing its worker processes when some are stuck (a stuck worker
+        would block the shutdown forever).
+        """
+        if not kill:
+            executor.shutdown(wait=True)
+            return
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+    
+    
+    
+    def enqueue_ingestion(self, document_path: Path)-> str:
+        """
+        Index a document in the background.
+        :param document_path: Path to the document( Absolute path of a pdf or docx file.)
+        :return: The id of the ingestion job (the pending job if the document is already queued).
+        """
+        job_id = self._ingestion_queue.enqueue(document_path)
+        self._ingestion_worker.start()
+        self._ingestion_worker.notify()
+        return job_id
+    
+    
+    
+    def get_ingestion_job(self, job_id: str)-> Dict:
+        """
+        Get the status of an ingestion job.
+        :param job_id: The id of the job.
+        :return: The job, its status is "queued", "running", "done" (index_id is set) or "failed" (error is set).
+        """
+        #Pick up the jobs left in the queue by a previous run
+        self._ingestion_worker.start()
+        return self._ingestion_queue.get(job_id)
+    
+    
+    
+    def wait_for_ingestion(self, job_id: str, timeout: Optional[float] = None, poll_interval: float = 0.2)-> Dict:
+        """
+        Wait for an ingestion job to be done or failed.
+        :param job_id: The id of the job.
+        :param timeout: Maximum time to wait in seconds, None to wait forever.
+        :return: The finished job.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get_ingestion_job(job_id)
+            if job["status"] in (JOB_DONE, JOB_FAILED):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Ingestion job {job_id} is still {job['status']}.")
+            time.sleep(poll_interval)
+    
+    
+    
+    def __embed_nodes(self, nodes: List[BaseNode], parent_span=None)-> None:
+        """
+        Compute the embedding of the nodes that do not have one yet (in place).
+        :param nodes: The nodes to embed.
+        :param parent_span: The tracing span of the caller (the nodes can be embedded in a worker thread).
+        """
+        from llama_index.core.schema import MetadataMode
+        
+        nodes = [node for node in nodes if node.embedding is None]
+        with tracer.span("embed", parent=parent_span) as span:
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            for node, embedding in zip(nodes, self._embedding.get_text_embedding_batch(texts)):
+                node.embedding = embedding
+            span.count("nodes", len(nodes))
+    
+    
+    
+    async def __aembed_nodes(self, nodes: List[BaseNode])-> None:
+        """
+        Async version of __embed_nodes.
+        """
+        from llama_index.core.schema import MetadataMode
+        
+        nodes = [node for node in nodes if node.embedding is None]
+        span = tracer.start_span("embed")
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        for node, embedding in zip(nodes, await self._embedding.aget_text_embedding_batch(texts)):
+            node.embedding = embedding
+        span.count("nodes", len(nodes))
+        span.end()
+    
+    
+    
+    def __build_vector_store_index(self,
+                                   document_path: Path,
+                                   pages: List[Dict],
+                                   nodes: List[BaseNode],
+                                   persist=True,
+                                   use_ann=False)-> Tuple[str, VectorStoreIndex]:
+        """
+        Create the index of the parsed nodes of a document.
+        :param document_path: Path to the document.
+        :param pages: The parsed pages of the document, persisted with the index.
+        :param nodes: The nodes of the document, the ones without embedding are embedded.
+        :param persist: Whether to persist the index or not.
+        :param use_ann: Build an IVF index for approximate search.
+        :return: The index id and the index.
+        """
+        from llama_index.core import StorageContext, VectorStoreIndex
+        from advanced_chatbot.services.vector_store import MmapVectorStore
+        
+        with tracer.span("build_index") as span:
+            #1. Generate index UUID
+            index_id = str(uuid.uuid4()).split("-")[0]  
+        
+            if persist: 
+                persist_dir = self.__get_index_persist_dir(index_id)
+                persist_dir.mkdir(parents=True, exist_ok=True)
+            vector_store = MmapVectorStore(ann_nprobe=DEFAULT_RAG_ANN_NPROBE,
+                                           vector_dtype=VECTOR_STORAGE_DTYPE,
+                                           keep_full_precision=VECTOR_RESCORE_OVERSAMPLING > 0,
+                                           rescore_oversampling=VECTOR_RESCORE_OVERSAMPLING)
+            storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        
+        
+            rag_config = self.__get_rag_config()
+            content_hash = self._registry.content_hash(document_path)
+            index_config = {
+                "index_id": index_id,
+                "created_at": time.time(),
+                "document_path": str(document_path),
+                "content_hash": content_hash,
+                "fingerprint": compute_fingerprint(content_hash, rag_config),
+                "rag_config": rag_config,
+                "vector_storage": {"dtype": vector_store.vector_dtype,
+                                   "full_precision": vector_store.full_precision_embeddings is not None},
+                "profile": compute_document_profile(pages, len(nodes)),
+            }
+        
+            #2. Create the index (a persisted index keeps its sentence windows apart from the nodes)
+            if persist:
+                sentence_windows = SentenceWindows.build(nodes, rag_config["window_size"])
+                strip_windows(nodes)
+                lexical_index = LexicalIndex.build([node.get_content() for node in nodes], [node.node_id for node in nodes])
+            index = VectorStoreIndex(
+                nodes=
+                nodes,
+                storage_context=storage_context,
+                embed_model=self._embedding,
+                show_progress=True,
+            )
+        
+            if use_ann and self.__supports_ann_index(index):
+                ivf = index.vector_store.build_ann_index(nlist=DEFAULT_RAG_ANN_NLIST or None)
+                index_config["ann"] = {"nlist": ivf.nlist}
+        
+            if persist:
+                storage_context.persist(persist_dir=persist_dir)
+                PageStore.write(persist_dir, pages)
+                sentence_windows.persist(persist_dir)
+                self._sentence_windows_cache.put(index_id, sentence_windows, sentence_windows.nbytes)
+                lexical_index.persist(persist_dir)
+                self._lexical_index_cache.put(index_id, lexical_index, lexical_index.nbytes)
+                #Save the index config in the persist directory
+                with open(self.__get_index_persist_dir(index_id) / "index_config.json", "w") as f:
+                    json.dump(index_config, f)
+                self._registry.register(index_config["fingerprint"], index_id)
+                self._catalog.upsert(index_config)
+                self._index_cache.put(index_id, index, self.__get_index_size(index_id))
+                span.count("bytes_written", self.__get_index_size(index_id))
+            span.count("nodes", len(nodes))
         
         return index_id, index
         
@@ -203,9 +797,122 @@ class _RagService:
             raise ValueError(f"Index with id {index_id} does not exist.")
     
         #Delete the index directory
+        self._registry.unregister(index_id)
+        self._catalog.remove(index_id)
+        self._index_cache.invalidate(index_id)
+        self._sentence_windows_cache.invalidate(index_id)
+        self._lexical_index_cache.invalidate(index_id)
+        self._embedding_block_cache.clear()
+        self._answer_cache.invalidate(lambda key: index_id in key[0])
         shutil.rmtree(self.__get_index_persist_dir(index_id), ignore_errors=True)
         
     
+    def update_vector_store_index(self, index_id: str, new_document_path: Optional[Path] = None)-> Dict[str, int]:
+        """
+        Update an index after its document was modified, keeping the same index id.
+        The pages whose nodes did not change are left as they are. In the modified pages, only the new
+        or changed nodes are embedded and inserted, the nodes that disappeared are deleted.
+        :param index_id: The id of the index to update.
+        :param new_document_path: Path to the new version of the document, defaults to the indexed document path.
+        :return: The number of pages changed and of nodes added, deleted and kept.
+        """
+        index_config = self.load_index_config(index_id)
+        if index_config.get("rag_config") != self.__get_rag_config():
+            raise ValueError(f"Index with id {index_id} was built with another rag config, it must be re-created.")
+        document_path = Path(new_document_path or index_config["document_path"])
+        
+        with tracer.span("update_index") as span:
+            #1. Parse the new version (the cached index is reloaded: it is modified in place)
+            parsed_pages, new_nodes = parse_document_pages_and_nodes(document_path)
+            self._index_cache.invalidate(index_id)
+            index = self.load_vector_store_index(index_id)
+            old_nodes = list(index.docstore.docs.values())
+            old_windows = {}
+            sentence_windows = self.__get_sentence_windows(index_id)
+            if sentence_windows is not None:
+                old_windows = sentence_windows.all_windows({node.node_id: node.get_content() for node in old_nodes})
+            
+            #2. Diff page by page, then node by node in the changed pages
+            old_pages, new_pages = defaultdict(list), defaultdict(list)
+            for node in old_nodes:
+                old_pages[node.metadata.get("page_label")].append((compute_node_hash(node, old_windows.get(node.node_id)), node))
+            for node in new_nodes:
+                new_pages[node.metadata.get("page_label")].append((compute_node_hash(node), node))
+            
+            #Node id in the index of every new node (the id of the old node when it is kept)
+            nodes_to_add, node_ids_to_delete, pages_changed, kept_ids = [], [], 0, {}
+            for page_label in list(old_pages) + [page_label for page_label in new_pages if page_label not in old_pages]:
+                old_page, new_page = old_pages.get(page_label, []), new_pages.get(page_label, [])
+                if [node_hash for node_hash, _ in old_page] == [node_hash for node_hash, _ in new_page]:
+                    kept_ids.update((new_node.node_id, old_node.node_id) for (_, new_node), (_, old_node) in zip(new_page, old_page))
+                    continue
+                pages_changed += 1
+                indexed = defaultdict(list)
+                for node_hash, node in old_page:
+                    indexed[node_hash].append(node)
+                for node_hash, node in new_page:
+                    if indexed[node_hash]:
+                        #Identical node already indexed
+                        kept_ids[node.node_id] = indexed[node_hash].pop().node_id
+                    else:
+                        nodes_to_add.append(node)
+                node_ids_to_delete += [node.node_id for nodes in indexed.values() for node in nodes]
+            
+            #3. Apply the diff
+            new_sentence_windows = SentenceWindows.build(new_nodes, index_config["rag_config"]["window_size"],
+                                                         node_ids=[kept_ids.get(node.node_id, node.node_id) for node in new_nodes])
+            strip_windows(nodes_to_add)
+            self.__embed_nodes(nodes_to_add, span)
+            if node_ids_to_delete:
+                index.delete_nodes(node_ids_to_delete, delete_from_docstore=True)
+                for node_id in node_ids_to_delete:
+                    index.index_struct.delete(node_id)
+                index.storage_context.index_store.add_index_struct(index.index_struct)
+            if nodes_to_add:
+                index.insert_nodes(nodes_to_add)
+            if "ann" in index_config and (nodes_to_add or node_ids_to_delete) and self.__supports_ann_index(index):
+                #The IVF index is dropped when the vectors change (an index left without nodes is searched exactly)
+                ivf = index.vector_store.build_ann_index(nlist=DEFAULT_RAG_ANN_NLIST or None)
+                index_config["ann"] = {"nlist": ivf.nlist}
+            
+            #4. Persist under the same index id and register the new version of the document
+            persist_dir = self.__get_index_persist_dir(index_id)
+            index.storage_context.persist(persist_dir=persist_dir)
+            PageStore.write(persist_dir, parsed_pages)
+            new_sentence_windows.persist(persist_dir)
+            lexical_index = self.__build_lexical_index(index)
+            lexical_index.persist(persist_dir)
+            content_hash = self._registry.content_hash(document_path)
+            index_config.update({
+                "document_path": str(document_path),
+                "content_hash": content_hash,
+                "fingerprint": compute_fingerprint(content_hash, index_config["rag_config"]),
+                "profile": compute_document_profile(parsed_pages, len(index.docstore.docs)),
+            })
+            with open(persist_dir / "index_config.json", "w") as f:
+                json.dump(index_config, f)
+            self._registry.unregister(index_id)
+            self._registry.register(index_config["fingerprint"], index_id)
+            self._catalog.upsert(index_config)
+            
+            self._index_cache.put(index_id, index, self.__get_index_size(index_id))
+            self._sentence_windows_cache.put(index_id, new_sentence_windows, new_sentence_windows.nbytes)
+            self._lexical_index_cache.put(index_id, lexical_index, lexical_index.nbytes)
+            self._embedding_block_cache.clear()
+            self._answer_cache.invalidate(lambda key: index_id in key[0])
+            
+            diff = {
+                "pages_changed": pages_changed,
+                "nodes_added": len(nodes_to_add),
+                "nodes_deleted": len(node_ids_to_delete),
+                "nodes_kept": len(old_nodes) - len(node_ids_to_delete),
+            }
+            for name, value in diff.items():
+                span.count(name, value)
+            return diff
+    
+    
+    
     def update_index_config(self, index_id:str, new_config:Dict)-> None:
         """
         Update the index config with new values.
@@ -218,8 +925,21 @@ class _RagService:
         if not index_dir.exists():
             raise ValueError(f"Index with id {index_id} does not exist.")
         
-        with open(index_dir / "index_config.json", "w") as f:
-            json.dump(new_config, f)
+        self.__save_index_config(index_id, new_config)
+        self._index_cache.invalidate(index_id)
+    
+    
+    
+    def __save_index_config(self, index_id: str, index_config: Dict)-> None:
+        """
+        Write the config of an index (through a temporary file) and its catalog entry, the loaded index stays cached.
+        """
+        config_path = self.__get_index_persist_dir(index_id) / "index_config.json"
+        tmp_path = config_path.with_name(f"index_config.json.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index_config, f, default=str)
+        os.replace(tmp_path, config_path)
+        self._catalog.upsert(index_config)
         
     
     def load_index_config(self, index_id:str)-> Dict:
@@ -242,12 +962,101 @@ class _RagService:
     def load_vector_store_index(self, index_id: str)-> VectorStoreIndex:
         """
         Load a vector store index from a given path.
+        Loaded indexes are kept in an in-memory LRU cache.
         :param index_id: The id of the index to load.
         :return: Tuple[Dict, VectorStoreIndex] : A tuple containing the index config and the index object.
         """
-        storage_context = StorageContext.from_defaults(persist_dir=self.__get_index_persist_dir(index_id))
-        return load_index_from_storage(storage_context=storage_context,
-                                       embed_model=self._embedding)
+        from llama_index.core import StorageContext, load_index_from_storage
+        from advanced_chatbot.services.vector_store import MmapVectorStore
+        
+        with tracer.span("load_index") as span:
+            index = self._index_cache.get(index_id)
+            if index is not None:
+                span.count("cache_hits")
+                return index
+            
+            persist_dir = self.__get_index_persist_dir(index_id)
+            if MmapVectorStore.exists(persist_dir):
+                storage_context = StorageContext.from_defaults(persist_dir=persist_dir,
+                                                               vector_store=MmapVectorStore.from_persist_dir(
+                                                                   persist_dir,
+                                                                   ann_nprobe=DEFAULT_RAG_ANN_NPROBE,
+                                                                   rescore_oversampling=VECTOR_RESCORE_OVERSAMPLING))
+            else:
+                #Indexes created before the binary vector store was introduced
+                storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
+            index = load_index_from_storage(storage_context=storage_context,
+                                            embed_model=self._embedding)
+            index_size = self.__get_index_size(index_id)
+            self._index_cache.put(index_id, index, index_size)
+            span.count("bytes_loaded", index_size)
+            return index
+    
+    
+    
+    def __get_sentence_windows(self, index_id: str)-> Optional[SentenceWindows]:
+        """
+        Get the compact sentence windows of an index, None for the indexes keeping the windows in the node metadata.
+        """
+        sentence_windows = self._sentence_windows_cache.get(index_id)
+        if sentence_windows is None:
+            persist_dir = self.__get_index_persist_dir(index_id)
+            if not SentenceWindows.exists(persist_dir):
+                return None
+            window_size = self.load_index_config(index_id)["rag_config"]["window_size"]
+            sentence_windows = SentenceWindows.from_persist_dir(persist_dir, window_size)
+            self._sentence_windows_cache.put(index_id, sentence_windows, sentence_windows.nbytes)
+        return sentence_windows
+    
+    
+    
+    def __get_lexical_index(self, index_id: str)-> LexicalIndex:
+        """
+        Get the lexical (BM25) index of an index. The lexical index of an index created before the
+        lexical indexes were saved is built from its nodes and saved.
+        """
+        lexical_index = self._lexical_index_cache.get(index_id)
+        if lexical_index is None:
+            persist_dir = self.__get_index_persist_dir(index_id)
+            if LexicalIndex.exists(persist_dir):
+                lexical_index = LexicalIndex.from_persist_dir(persist_dir)
+            else:
+                lexical_index = self.__build_lexical_index(self.load_vector_store_index(index_id))
+                lexical_index.persist(persist_dir)
+            self._lexical_index_cache.put(index_id, lexical_index, lexical_index.nbytes)
+        return lexical_index
+    
+    
+    
+    def __build_lexical_index(self, index: VectorStoreIndex)-> LexicalIndex:
+        nodes = list(index.docstore.docs.values())
+        return LexicalIndex.build([node.get_content() for node in nodes], [node.node_id for node in nodes])
+    
+    
+    
+    def index_cache_stats(self)-> Dict[str, int]:
+        """
+        Get the hit/miss counters of the cache of loaded indexes.
+        """
+        return self._index_cache.stats()
+    
+    
+    
+    def answer_cache_stats(self)-> Dict[str, float]:
+        """
+        Get the hit/miss counters and the hit rate of the answer cache.
+        """
+        return self._answer_cache.stats()
+    
+    
+    
+    def query_embedding_batch_stats(self)-> Dict[str, float]:
+        """
+        Get the batch counters and batch sizes of the query embedding micro-batching (empty if disabled).
+        The wait of each query and the latency of each batch are in trace_stats
+        ("query_embedding_wait", "query_embedding_batch").
+        """
+        return self._query_batcher.stats() if self._query_batcher is not None else {}
                                        
     
     
@@ -257,6 +1066,8 @@ class _RagService:
                       conversation_history: List[ChatMessage],
                       index_ids : List[str],
                       system_prompt:str = DEFAULT_SYSTEM_PROMPT,    
+                      use_answer_cache: Optional[bool] = None,
+                      retrieval_mode: Optional[str] = None,
                       )-> Tuple[Generator[str,None,None], List[NodeWithScore]]:
         """
         Generate a response to a given question.
@@ -269,17 +1080,134 @@ class _RagService:
         :param document_list: A list of document paths to search for the answer.
         The index of document index to search for the answer.
         
+        :param use_answer_cache: Reuse the answer of a similar question asked on the same indexes with the same
+        system prompt (defaults to ANSWER_CACHE_ENABLED). Only the first question of a conversation is cached,
+        the next answers depend on the conversation.
+        
+        :param retrieval_mode: "dense" (embeddings), "lexical" (BM25, no query embedding: for exact terms such as
+        product codes or names) or "hybrid" (reciprocal rank fusion of both), defaults to DEFAULT_RETRIEVAL_MODE.
         """
         
+        retrieval_mode = retrieval_mode or DEFAULT_RETRIEVAL_MODE
+        chat_span = tracer.start_span("chat", indexes=len(index_ids), retrieval_mode=retrieval_mode)
+        
+        #0. Answer cache
+        if use_answer_cache is None:
+            use_answer_cache = ANSWER_CACHE_ENABLED
+        use_answer_cache = use_answer_cache and all(message.content == query for message in conversation_history)
+        query_embeddings = {}
+        if use_answer_cache:
+            cache_key = (tuple(sorted(index_ids)), system_prompt, retrieval_mode)
+            query_embeddings[query] = self._embedding.get_query_embedding(query)
+            cached = self._answer_cache.get(cache_key, query_embeddings[query])
+            if cached is not None:
+                answer, source_nodes = cached
+                chat_span.count("answer_cache_hits")
+                chat_span.stop_profile()
+                return self.__trace_answer(self.__replay_answer(answer), chat_span), source_nodes
+        
         #1. Load the indexes
-        index_list  = [self.load_vector_store_index(index_id) for index_id in index_ids]
+        with tracer.span("load_indexes", parent=chat_span):
+            indexes = {index_id: self.load_vector_store_index(index_id) for index_id in index_ids}
+            chat_engine = self.__build_chat_engine(indexes, conversation_history, system_prompt, query_embeddings,
+                                                   retrieval_mode)
+        
+        #2. Retrieval, postprocessing, memory and start of the LLM stream
+        with tracer.span("context", parent=chat_span) as context_span:
+            response = chat_engine.stream_chat(query)
+            context_span.count("tokens_in", self.__count_prompt_tokens(system_prompt, query, response.source_nodes))
+        
+        response_generator = response.response_gen
+        source_nodes = response.source_nodes
+        if use_answer_cache:
+            response_generator = self.__cache_answer(response_generator, cache_key, query_embeddings[query], source_nodes)
         
+        #The answer stream may be consumed in another thread or never: the profile stops before it is returned
+        chat_span.stop_profile()
+        return self.__trace_answer(response_generator, chat_span), source_nodes
+    
+    
+    
+    async def acomplete_chat(self,
+                             query: str,
+                             conversation_history: List[ChatMessage],
+                             index_ids : List[str],
+                             system_prompt:str = DEFAULT_SYSTEM_PROMPT,
+                             use_answer_cache: Optional[bool] = None,
+                             retrieval_mode: Optional[str] = None,
+                             )-> Tuple[AsyncGenerator[str, None], List[NodeWithScore]]:
+        """
+        Async version of complete_chat, the answer is an async token generator.
+        The query embedding and the LLM stream use the async APIs (shared connection pool), the indexes
+        are loaded in a worker thread: many chats can run concurrently on a single event loop.
+        The async methods must always run on the same event loop (the async connection pool is bound to it).
+        """
+        retrieval_mode = retrieval_mode or DEFAULT_RETRIEVAL_MODE
+        chat_span = tracer.start_span("chat", indexes=len(index_ids), retrieval_mode=retrieval_mode)
+        
+        #0. Answer cache
+        if use_answer_cache is None:
+            use_answer_cache = ANSWER_CACHE_ENABLED
+        use_answer_cache = use_answer_cache and all(message.content == query for message in conversation_history)
+        query_embeddings = {}
+        if use_answer_cache:
+            cache_key = (tuple(sorted(index_ids)), system_prompt, retrieval_mode)
+            query_embeddings[query] = await self._embedding.aget_query_embedding(query)
+            cached = self._answer_cache.get(cache_key, query_embeddings[query])
+            if cached is not None:
+                answer, source_nodes = cached
+                chat_span.count("answer_cache_hits")
+                chat_span.stop_profile()
+                return self.__atrace_answer(self.__areplay_answer(answer), chat_span), source_nodes
+        
+        #1. Load the indexes (spans are not nested with tracer.span: coroutines share the thread)
+        load_span = tracer.start_span("load_indexes", parent=chat_span)
+        indexes = await asyncio.to_thread(lambda: {index_id: self.load_vector_store_index(index_id) for index_id in index_ids})
+        chat_engine = await asyncio.to_thread(self.__build_chat_engine, indexes, conversation_history, system_prompt,
+                                              query_embeddings, retrieval_mode)
+        load_span.end()
+        
+        #2. Retrieval, postprocessing, memory and start of the LLM stream
+        context_span = tracer.start_span("context", parent=chat_span)
+        response = await chat_engine.astream_chat(query)
+        context_span.count("tokens_in", self.__count_prompt_tokens(system_prompt, query, response.source_nodes))
+        context_span.end()
+        
+        response_generator = response.async_response_gen()
+        source_nodes = response.source_nodes
+        if use_answer_cache:
+            response_generator = self.__acache_answer(response_generator, cache_key, query_embeddings[query], source_nodes)
+        
+        #The answer stream may be consumed in another thread or never: the profile stops before it is returned
+        chat_span.stop_profile()
+        return self.__atrace_answer(response_generator, chat_span), source_nodes
+    
+    
+    
+    def __build_chat_engine(self, indexes: Dict[str, VectorStoreIndex], conversation_history: List[ChatMessage],
+                            system_prompt: str, query_embeddings: Dict[str, List[float]], retrieval_mode: str):
+        """
+        Build the chat engine answering over a set of loaded indexes.
+        """
+        from llama_index.core.chat_engine import ContextChatEngine
+        from llama_index.core.memory.chat_memory_buffer import ChatMemoryBuffer
+        from advanced_chatbot.services.retrievers import StackedVectorRetriever, TracedMetadataReplacementPostProcessor
         
-        #2.Retriever 
-        retriever = QueryFusionRetriever(
-            retrievers=[index.as_retriever(similarity_top_k=DEFAULT_RAG_SIMILARITY_TOP_K) for index in index_list],
-            num_queries=1,
+        #Retriever (single similarity search over the stacked embeddings of all the indexes)
+        retriever = StackedVectorRetriever(
+            indexes=indexes,
+            embed_model=self._embedding,
             similarity_top_k=DEFAULT_RAG_SIMILARITY_TOP_K,
+            block_cache=self._embedding_block_cache,
+            ann_nprobe=DEFAULT_RAG_ANN_NPROBE,
+            query_embeddings=query_embeddings,
+            rescore_oversampling=VECTOR_RESCORE_OVERSAMPLING,
+            sentence_windows={index_id: self.__get_sentence_windows(index_id) for index_id in indexes},
+            retrieval_mode=retrieval_mode,
+            lexical_indexes={index_id: self.__get_lexical_index(index_id) for index_id in indexes}
+            if retrieval_mode != "dense" else None,
+            hybrid_candidates=HYBRID_RETRIEVAL_CANDIDATES,
+            rrf_k=HYBRID_RRF_K,
         )
         
         
@@ -289,21 +1217,109 @@ class _RagService:
         
         
         
-        chat_engine = ContextChatEngine.from_defaults(
+        return ContextChatEngine.from_defaults(
             retriever=retriever,
             memory=memory,
             llm=self._llm,
             node_postprocessors = [
-                MetadataReplacementPostProcessor(target_metadata_key="window")
+                TracedMetadataReplacementPostProcessor(target_metadata_key="window")
             ],
             system_prompt=system_prompt)
+    
+    
+    
+    def __count_prompt_tokens(self, system_prompt: str, query: str, source_nodes: List[NodeWithScore])-> int:
+        """
+        Estimate the number of tokens sent to the LLM (system prompt, context and query, without the history).
+        """
+        from llama_index.core.schema import MetadataMode
+        from llama_index.core.utils import get_tokenizer
         
-        response :StreamingAgentChatResponse = chat_engine.stream_chat(query)
-        
-        response_generator = response.response_gen
-        source_nodes = response.source_nodes
-        
-        return response_generator, source_nodes
+        tokenizer = get_tokenizer()
+        texts = [system_prompt, query] + [node.node.get_content(metadata_mode=MetadataMode.LLM) for node in source_nodes]
+        return sum(len(tokenizer(text)) for text in texts)
+    
+    
+    
+    def __trace_answer(self, response_generator, chat_span)-> Generator[str, None, None]:
+        """
+        Record the time to first token, the generation time and the output tokens, then end the chat span.
+        """
+        from llama_index.core.utils import get_tokenizer
+        
+        tokenizer = get_tokenizer()
+        tokens_out = 0
+        first_token_at = None
+        try:
+            for token in response_generator:
+                if first_token_at is None:
+                    first_token_at = chat_span.elapsed()
+                    tracer.record("first_token", first_token_at, parent=chat_span)
+                tokens_out += len(tokenizer(token))
+                yield token
+        finally:
+            if first_token_at is not None:
+                tracer.record("generation", chat_span.elapsed() - first_token_at, parent=chat_span, tokens_out=tokens_out)
+            chat_span.count("tokens_out", tokens_out)
+            chat_span.end()
+    
+    
+    
+    def __replay_answer(self, answer: str)-> Generator[str, None, None]:
+        yield answer
+    
+    
+    
+    def __cache_answer(self, response_generator, cache_key, query_embedding, source_nodes)-> Generator[str, None, None]:
+        """
+        Stream the answer and cache it once complete (not cached if the stream is interrupted).
+        """
+        tokens = []
+        for token in response_generator:
+            tokens.append(token)
+            yield token
+        self._answer_cache.put(cache_key, query_embedding, "".join(tokens), source_nodes)
+    
+    
+    
+    async def __atrace_answer(self, response_generator, chat_span)-> AsyncGenerator[str, None]:
+        """
+        Async version of __trace_answer.
+        """
+        from llama_index.core.utils import get_tokenizer
+        
+        tokenizer = get_tokenizer()
+        tokens_out = 0
+        first_token_at = None
+        try:
+            async for token in response_generator:
+                if first_token_at is None:
+                    first_token_at = chat_span.elapsed()
+                    tracer.record("first_token", first_token_at, parent=chat_span)
+                tokens_out += len(tokenizer(token))
+                yield token
+        finally:
+            if first_token_at is not None:
+                tracer.record("generation", chat_span.elapsed() - first_token_at, parent=chat_span, tokens_out=tokens_out)
+            chat_span.count("tokens_out", tokens_out)
+            chat_span.end()
+    
+    
+    
+    async def __areplay_answer(self, answer: str)-> AsyncGenerator[str, None]:
+        yield answer
+    
+    
+    
+    async def __acache_answer(self, response_generator, cache_key, query_embedding, source_nodes)-> AsyncGenerator[str, None]:
+        """
+        Async version of __cache_answer.
+        """
+        tokens = []
+        async for token in response_generator:
+            tokens.append(token)
+            yield token
+        self._answer_cache.put(cache_key, query_embedding, "".join(tokens), source_nodes)
 
         
         
@@ -311,54 +1327,144 @@ class _RagService:
         
         
 
-    def list_vector_store_index(self)-> List[dict]:
+    def list_vector_store_index(self,
+                                document_path: Optional[Path] = None,
+                                content_hash: Optional[str] = None,
+                                language: Optional[str] = None,
+                                created_after: Optional[float] = None,
+                                created_before: Optional[float] = None,
+                                limit: Optional[int] = None,
+                                offset: int = 0)-> List[dict]:
         """
-        List all the vector store indexes
+        List the vector store indexes (read from the index catalog, oldest first).
+        :param document_path: Only the indexes of this document.
+        :param content_hash: Only the indexes of documents with this sha256.
+        :param language: Only the indexes of documents in this language (ex: "fr").
+        :param created_after: Only the indexes created at or after this timestamp.
+        :param created_before: Only the indexes created before this timestamp.
+        :param limit: Page size, all the matching indexes by default.
+        :param offset: Number of matching indexes skipped.
         :return A list of vector _index configs
         """
-        
-        index_configs = []
-        for index_dir in RAG_STORAGE_PATH.iterdir():
-            with open(index_dir / "index_config.json", "r") as f:
-                index_config = json.load(f)
-                index_configs.append(index_config)
-        return index_configs
+        return self._catalog.list(document_path=document_path, content_hash=content_hash, language=language,
+                                  created_after=created_after, created_before=created_before,
+                                  limit=limit, offset=offset)
+    
+    
+    
+    def rebuild_index_catalog(self)-> int:
+        """
+        Rescan the storage directory and rebuild the index catalog (ex: after indexes were copied or removed by hand).
+        :return: The number of indexes in the catalog.
+        """
+        return self._catalog.rebuild(RAG_STORAGE_PATH)
         
     
  
     
     
     
+    def get_document_page(self, index_id: str, page_label: str = "1")-> str:
+        """
+        Get the text of a page of an indexed document, without reading the document itself.
+        :param index_id: The id of the index of the document.
+        :param page_label: The label of the page (ex: "1" for the first page).
+        :return: The text of the page.
+        """
+        page_store = self.__get_page_store(index_id)
+        position = page_store.find(page_label)
+        if position is None and page_label == "1" and len(page_store) == 1:
+            #A docx document is read as a single page without label
+            position = 0
+        if position is None:
+            raise ValueError(f"Page {page_label} does not exist in the document of index {index_id}.")
+        return page_store.get_text(position)
+    
+    
+    
+    def __get_page_store(self, index_id: str)-> PageStore:
+        """
+        Open the pages of an index. The pages of an index created before the pages were persisted
+        are parsed once from its document (which must still exist) and saved with the index.
+        """
+        persist_dir = self.__get_index_persist_dir(index_id)
+        if not PageStore.exists(persist_dir):
+            document_path = self.load_index_config(index_id)["document_path"]
+            if not document_path.exists():
+                raise ValueError(f"The pages of index {index_id} are not saved and its document {document_path} does not exist anymore.")
+            documents = read_document(document_path)
+            PageStore.write(persist_dir, [{"text": document.text, "metadata": document.metadata} for document in documents])
+        return PageStore.from_persist_dir(persist_dir)
+    
+    
+    
     def translate_and_summarize_first_page_fr(self, index_id:str)-> str:
         """
         Translate a document to french.
+        The result is saved in the profile of the document, concurrent calls for the same index make a single LLM call.
         :param document_content: The content of the document to translate.
         :return: The translated document.
         """
-        #1. Load the file path of the document
-        index_dir = self.__get_index_persist_dir(index_id)
-        with open(index_dir / "index_config.json", "r") as f:
-            index_config = json.load(f)
-            document_path = index_config["document_path"]
-        
-        
-        #2. Load the document
-        document_list = self.parse_document(document_path)
-        #First page
-        first_page_document = [k for k in document_list if k.page_label == '1']
-        first_page_content = first_page_document[0].text
+        cached = self.get_document_profile(index_id).get("first_page_summary_fr")
+        if cached is not None:
+            return cached
+        return self._single_flight.do(f"translate_and_summarize_first_page_fr:{index_id}",
+                                      lambda: self.__translate_and_summarize_first_page_fr(index_id))
+    
+    
+    
+    def __translate_and_summarize_first_page_fr(self, index_id: str)-> str:
+        #0. Saved by a previous call (ex: in another process)
+        cached = self.get_document_profile(index_id).get("first_page_summary_fr")
+        if cached is not None:
+            return cached
         
-        #3. Translate the document to french
-        chat_messages=  ChatPromptTemplate(
-            message_templates=[ChatMessage(role=MessageRole.SYSTEM,content=TRANSLATION_SYSTEM_PROMPT),
-                ChatMessage(role=MessageRole.USER,content=first_page_content)]
-        )
+        #1. Read the first page from the pages persisted with the index
+        first_page_content = self.get_document_page(index_id, page_label="1")
         
+        #2. Translate the document to french
         first_page_fr = self._llm.predict(
-            prompt=chat_messages,
+            prompt=self.__translation_prompt(first_page_content),
             source_text= first_page_content
         )
-        return self.summarize_content(first_page_fr)
+        summary = self.summarize_content(first_page_fr)
+        self.__save_profile_value(index_id, "first_page_summary_fr", summary)
+        return summary
+    
+    
+    
+    async def atranslate_and_summarize_first_page_fr(self, index_id:str)-> str:
+        """
+        Async version of translate_and_summarize_first_page_fr.
+        """
+        cached = (await asyncio.to_thread(self.get_document_profile, index_id)).get("first_page_summary_fr")
+        if cached is not None:
+            return cached
+        return await self._single_flight.ado(f"translate_and_summarize_first_page_fr:{index_id}",
+                                             lambda: self.__atranslate_and_summarize_first_page_fr(index_id))
+    
+    
+    
+    async def __atranslate_and_summarize_first_page_fr(self, index_id: str)-> str:
+        cached = (await asyncio.to_thread(self.get_document_profile, index_id)).get("first_page_summary_fr")
+        if cached is not None:
+            return cached
+        first_page_content = await asyncio.to_thread(self.get_document_page, index_id, "1")
+        first_page_fr = await self._llm.apredict(prompt=self.__translation_prompt(first_page_content),
+                                                 source_text=first_page_content)
+        summary = await self.asummarize_content(first_page_fr)
+        await asyncio.to_thread(self.__save_profile_value, index_id, "first_page_summary_fr", summary)
+        return summary
+    
+    
+    
+    def __translation_prompt(self, source_text: str):
+        from llama_index.core import ChatPromptTemplate
+        from llama_index.core.llms import ChatMessage, MessageRole
+        return ChatPromptTemplate(
+            message_templates=[ChatMessage(role=MessageRole.SYSTEM,content=TRANSLATION_SYSTEM_PROMPT),
+                ChatMessage(role=MessageRole.USER,content=source_text)]
+        )
         
     
 
@@ -370,39 +1476,112 @@ class _RagService:
         :param prompt: The prompt to translate.
         :return: The translated prompt.
         """
-        
-        
-        chat_messages = ChatPromptTemplate(
+        return self._llm.predict(prompt=self.__summarization_prompt(), source_text=input_content)
+    
+    
+    
+    async def asummarize_content(self, input_content:str)-> str:
+        """
+        Async version of summarize_content.
+        """
+        return await self._llm.apredict(prompt=self.__summarization_prompt(), source_text=input_content)
+    
+    
+    
+    def __summarization_prompt(self):
+        from llama_index.core import ChatPromptTemplate
+        from llama_index.core.llms import ChatMessage, MessageRole
+        return ChatPromptTemplate(
             message_templates=
             [ChatMessage(role=MessageRole.SYSTEM, content=SUMMARIZATION_SYSTEM_PROMPT),
              ChatMessage(role=MessageRole.USER, content=SUMMARIZATION_USER_PROMPT)]
         )
         
-        return self._llm.predict(prompt=chat_messages, source_text=input_content)
-        
         
     
         
+    def get_document_profile(self, index_id: str)-> Dict:
+        """
+        Get the profile of an indexed document, computed at ingestion (read from the index config).
+        The profile of an index created before the profiles were saved is computed once and saved.
+        :param index_id: The id of the index.
+        :return: The language, the page, node, token and character counts and the summary (None until
+        summarize_document_index is called).
+        """
+        index_config = self.load_index_config(index_id)
+        if "profile" not in index_config:
+            page_store = self.__get_page_store(index_id)
+            pages = [page_store.get(position) for position in range(len(page_store))]
+            num_nodes = len(self.load_vector_store_index(index_id).docstore.docs)
+            index_config["profile"] = compute_document_profile(pages, num_nodes)
+            self.__save_index_config(index_id, index_config)
+        return index_config["profile"]
+    
+    
+    
     def summarize_document_index(self, index_id)->str:
         """
         Summarize the content of a vector store index. 
+        The summary is generated on the first call from evenly spaced pages of the document, then saved in its profile.
+        Concurrent calls for the same index (threads or processes) make a single LLM call.
         :param index_id: The id of the index to summarize.
         """
         
-        #1. First load the index
-        index = self.load_vector_store_index(index_id)
-        
-        #2. Retriever (Dummy to get sources nodes)
-        query = "__"
-        nodes = index.as_retriever(similarity_top_k=50).retrieve(query)
+        #1. Summary already generated
+        profile = self.get_document_profile(index_id)
+        if profile.get("summary") is not None:
+            return profile["summary"]
         
-        #3. Randomly select 10 sources
-        source_nodes = random.sample(nodes, 20)
-        
-        #4. Content to use for summarization
-        content = "\n".join([node.get_text() for node in source_nodes])
-        
-        return self.summarize_content(content)
+        #2. Summarize evenly spaced pages and save the summary in the profile
+        return self._single_flight.do(f"summarize_document_index:{index_id}", lambda: self.__summarize_document_index(index_id))
+    
+    
+    
+    def __summarize_document_index(self, index_id: str)-> str:
+        #Saved by a previous call (ex: in another process)
+        profile = self.get_document_profile(index_id)
+        if profile.get("summary") is not None:
+            return profile["summary"]
+        summary = self.summarize_content(self.__summary_content(index_id))
+        self.__save_profile_value(index_id, "summary", summary)
+        return summary
+    
+    
+    
+    async def asummarize_document_index(self, index_id: str)-> str:
+        """
+        Async version of summarize_document_index.
+        """
+        profile = await asyncio.to_thread(self.get_document_profile, index_id)
+        if profile.get("summary") is not None:
+            return profile["summary"]
+        return await self._single_flight.ado(f"summarize_document_index:{index_id}",
+                                             lambda: self.__asummarize_document_index(index_id))
+    
+    
+    
+    async def __asummarize_document_index(self, index_id: str)-> str:
+        profile = await asyncio.to_thread(self.get_document_profile, index_id)
+        if profile.get("summary") is not None:
+            return profile["summary"]
+        summary = await self.asummarize_content(await asyncio.to_thread(self.__summary_content, index_id))
+        await asyncio.to_thread(self.__save_profile_value, index_id, "summary", summary)
+        return summary
+    
+    
+    
+    def __summary_content(self, index_id: str)-> str:
+        page_store = self.__get_page_store(index_id)
+        page_texts = [page_store.get_text(position) for position in range(len(page_store))]
+        return select_summary_content(page_texts, PROFILE_SUMMARY_MAX_CHARACTERS)
+    
+    
+    
+    def __save_profile_value(self, index_id: str, name: str, value)-> None:
+        index_config = self.load_index_config(index_id)
+        #The profile does not change the loaded index: it is not evicted from the cache
+        index_config["profile"] = dict(index_config["profile"], **{name: value})
+        self.__save_index_config(index_id, index_config)
     
     
     
@@ -410,32 +1589,40 @@ class _RagService:
     def detect_document_language(self, index_id:str)-> str:
         """
         :param index_id: The id of the index to detect the language of.
-        :return: The language of the document.
+        :return: The language of the document (ex: "fr", "en"), detected at ingestion.
         """
-        
-        #Load the index
-        index = self.load_vector_store_index(index_id)
-        
-        #Retriever (Dummy to get sources nodes)
-        query = "__"
-        nodes = index.as_retriever(similarity_top_k=50).retrieve(query)
-        
-        
-        #Randomly select 10 sources
-        source_nodes = random.sample(nodes, 5)
-        
-        #Content to use for language detection
-        content = "\n".join([node.get_text() for node in source_nodes])
-        
-        chat_messages = ChatPromptTemplate(
-            [ChatMessage(role=MessageRole.SYSTEM, content=LANGUAGE_DETECTION_SYSTEM_PROMPT),
-             ChatMessage(role=MessageRole.USER, content=content)]
-        )
-        
-        language = self._llm.predict(prompt=chat_messages, source_text=content)
-        return language
+        return self.get_document_profile(index_id)["language"]
+    
+    
+    
+    async def adetect_document_language(self, index_id:str)-> str:
+        """
+        Async version of detect_document_language.
+        """
+        return (await asyncio.to_thread(self.get_document_profile, index_id))["language"]
         
         
     
-RagService = _RagService() #Singleton instance of the RagService class
+class _LazyRagService:
+    """
+    Proxy of the RagService singleton, the models and caches are built on first use.
+    """
+    
+    def __init__(self):
+        self._instance: Optional[_RagService] = None
+        self._lock = threading.Lock()
+    
+    def __get_instance(self)-> _RagService:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = _RagService()
+        return self._instance
+    
+    def __getattr__(self, name: str):
+        return getattr(self.__get_instance(), name)
+    
+    
+    
+RagService = _LazyRagService() #Singleton instance of the RagService class (built on first access)
     
\ No newline at end of file
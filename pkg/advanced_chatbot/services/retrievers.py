@@ -0,0 +1,298 @@
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.postprocessor import MetadataReplacementPostProcessor
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from advanced_chatbot.services.ann import IVFIndex
+from advanced_chatbot.services.index_cache import IndexCache
+from advanced_chatbot.services.lexical_index import LexicalIndex, lexical_top_k, reciprocal_rank_fusion
+from advanced_chatbot.services.quantization import quantize, quantized_scores, widest_vector_dtype
+from advanced_chatbot.services.sentence_windows import ORIGINAL_TEXT_METADATA_KEY, WINDOW_METADATA_KEY, SentenceWindows
+from advanced_chatbot.services.tracing import tracer
+from advanced_chatbot.services.vector_store import MmapVectorStore
+
+
+class EmbeddingBlock:
+    """
+    Row-normalized embeddings of several indexes stacked in a single matrix.
+    Row i of :matrix is the node :node_ids[i] of the index :index_ids[owners[i]].
+    When some indexes are in ANN mode, their IVF lists are merged in :ivf and only the probed
+    lists are scored, the rows of the exact indexes (:exact_rows) are always scored.
+    The matrix is stored with the most precise storage type of the indexes (float32, float16 or
+    int8 with the per row :scales) and scored without a float32 copy (see quantized_scores).
+    When every index has float32 embeddings on disk (:full_precision, memory mapped), the best quantized
+    candidates can be rescored exactly.
+    """
+
+    def __init__(self,
+                 index_ids: List[str],
+                 matrix: np.ndarray,
+                 owners: np.ndarray,
+                 node_ids: np.ndarray,
+                 ivf: Optional[IVFIndex] = None,
+                 exact_rows: Optional[np.ndarray] = None,
+                 num_ann_indexes: int = 0,
+                 scales: Optional[np.ndarray] = None,
+                 full_precision: Optional[List[np.ndarray]] = None,
+                 row_offsets: Optional[np.ndarray] = None):
+        self.index_ids = index_ids
+        self.matrix = matrix
+        self.owners = owners
+        self.node_ids = node_ids
+        self.ivf = ivf
+        self.exact_rows = exact_rows if exact_rows is not None else np.zeros(0, dtype=np.int32)
+        self.num_ann_indexes = num_ann_indexes
+        self.scales = scales
+        self.full_precision = full_precision
+        self.row_offsets = row_offsets
+
+    @classmethod
+    def from_indexes(cls, indexes: Dict[str, VectorStoreIndex]) -> "EmbeddingBlock":
+        """
+        Stack and normalize the embeddings of a set of indexes.
+        :param indexes: The indexes by index id.
+        """
+        index_ids = list(indexes)
+        vector_dtype = widest_vector_dtype([getattr(indexes[index_id].vector_store, "vector_dtype", "float32")
+                                            for index_id in index_ids])
+        matrices, scales, owners, node_ids = [], [], [], []
+        ivfs, exact_rows, row_offset = [], [], 0
+        full_precision, row_offsets = [], []
+        for position, index_id in enumerate(index_ids):
+            ids, matrix = _get_index_embeddings(indexes[index_id])
+            #Normalized then quantized index by index: a single float32 copy of one index at a time
+            matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12) if len(matrix) else matrix
+            codes, index_scales = quantize(matrix, vector_dtype)
+            matrices.append(codes)
+            scales.append(index_scales)
+            full_precision.append(getattr(indexes[index_id].vector_store, "full_precision_embeddings", None))
+            row_offsets.append(row_offset)
+            owners.append(np.full(len(ids), position, dtype=np.int32))
+            node_ids.append(ids)
+
+            ivf = getattr(indexes[index_id].vector_store, "ann_index", None)
+            if ivf is not None:
+                ivfs.append((ivf, row_offset))
+            else:
+                exact_rows.append(np.arange(row_offset, row_offset + len(ids), dtype=np.int32))
+            row_offset += len(ids)
+
+        #An index without nodes (ex: a scanned pdf) has a (0, 0) matrix
+        dim = max((matrix.shape[1] for matrix in matrices), default=0)
+        matrices = [matrix if len(matrix) else np.zeros((0, dim), dtype=vector_dtype) for matrix in matrices]
+        matrix = np.concatenate(matrices) if matrices else np.zeros((0, 0), dtype=vector_dtype)
+        return cls(index_ids=index_ids,
+                   matrix=np.ascontiguousarray(matrix, dtype=vector_dtype),
+                   owners=np.concatenate(owners) if owners else np.zeros(0, dtype=np.int32),
+                   node_ids=np.concatenate(node_ids) if node_ids else np.array([], dtype="U"),
+                   ivf=IVFIndex.merge(ivfs) if ivfs else None,
+                   exact_rows=np.concatenate(exact_rows) if exact_rows else None,
+                   num_ann_indexes=len(ivfs),
+                   scales=np.concatenate(scales) if vector_dtype == "int8" and scales else None,
+                   full_precision=full_precision if vector_dtype != "float32" and all(
+                       embeddings is not None for embeddings in full_precision) else None,
+                   row_offsets=np.asarray(row_offsets, dtype=np.int64))
+
+    @property
+    def nbytes(self) -> int:
+        ivf_bytes = self.ivf.centroids.nbytes + self.ivf.list_rows.nbytes if self.ivf is not None else 0
+        scales_bytes = self.scales.nbytes if self.scales is not None else 0
+        return self.matrix.nbytes + scales_bytes + self.owners.nbytes + self.node_ids.nbytes + self.exact_rows.nbytes + ivf_bytes
+
+    def top_k(self,
+              query_embedding: List[float],
+              similarity_top_k: int,
+              ann_nprobe: int = 8,
+              rescore_oversampling: int = 0) -> List[Tuple[int, float]]:
+        """
+        Cosine similarity search over every stacked index in one matrix-vector product.
+        :param ann_nprobe: The number of IVF lists scanned per index in ANN mode.
+        :param rescore_oversampling: For quantized indexes, rescore the similarity_top_k * rescore_oversampling
+        best rows with the float32 embeddings (when every index kept them), 0 disables rescoring.
+        :return: The (row, score) of the best rows, by decreasing score.
+        """
+        if not len(self.matrix):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        if self.ivf is None:
+            rows = None
+        else:
+            rows = np.concatenate([self.ivf.candidates(query, ann_nprobe * self.num_ann_indexes), self.exact_rows])
+        scores = quantized_scores(self.matrix, self.scales, query, rows)
+
+        rescore = rescore_oversampling > 0 and self.full_precision is not None
+        k = min(similarity_top_k * (rescore_oversampling if rescore else 1), len(scores))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        if rescore:
+            scores[top] = self.__exact_scores(top if rows is None else rows[top], query)
+            top = top[np.argsort(-scores[top])[:similarity_top_k]]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def __exact_scores(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of the query with the float32 embeddings of some rows (only these rows are read).
+        """
+        scores = np.empty(len(rows), dtype=np.float32)
+        owners = self.owners[rows]
+        for owner in np.unique(owners):
+            selected = np.flatnonzero(owners == owner)
+            local_rows = rows[selected] - self.row_offsets[owner]
+            order = np.argsort(local_rows)
+            vectors = np.empty((len(local_rows), self.matrix.shape[1]), dtype=np.float32)
+            #Sorted reads of the memory mapped matrix
+            vectors[order] = self.full_precision[owner][local_rows[order]]
+            scores[selected] = (vectors @ query) / np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)
+        return scores
+
+
+def _get_index_embeddings(index: VectorStoreIndex) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the node ids and the embedding matrix of an index.
+    """
+    vector_store = index.vector_store
+    if isinstance(vector_store, MmapVectorStore):
+        vector_ids, matrix = vector_store.node_ids, np.asarray(vector_store.embeddings, dtype=np.float32)
+    else:
+        #JSON SimpleVectorStore of the indexes created before MmapVectorStore
+        embedding_dict = vector_store.data.embedding_dict
+        vector_ids = np.array(list(embedding_dict))
+        matrix = np.asarray(list(embedding_dict.values()), dtype=np.float32)
+
+    nodes_dict = index.index_struct.nodes_dict
+    node_ids = np.array([nodes_dict.get(vector_id, vector_id) for vector_id in vector_ids.tolist()])
+    return node_ids, matrix
+
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+
+
+class StackedVectorRetriever(BaseRetriever):
+    """
+    Retrieve the top k nodes across several vector store indexes in a single pass.
+    The embeddings of the indexes are stacked in one normalized block, cached per set of indexes.
+    :param query_embeddings: Embeddings already computed for some query strings, by query string.
+    :param rescore_oversampling: Rescoring of quantized embeddings (see EmbeddingBlock.top_k).
+    :param sentence_windows: The compact sentence windows of the indexes, by index id: the window
+    metadata of the retrieved nodes is rebuilt from them.
+    :param retrieval_mode: "dense" (embeddings), "lexical" (BM25 over :lexical_indexes, the query is not embedded)
+    or "hybrid" (reciprocal rank fusion of the :hybrid_candidates best dense and lexical nodes).
+    :param lexical_indexes: The lexical indexes by index id (lexical and hybrid modes).
+    """
+
+    def __init__(self,
+                 indexes: Dict[str, VectorStoreIndex],
+                 embed_model: BaseEmbedding,
+                 similarity_top_k: int,
+                 block_cache: IndexCache,
+                 ann_nprobe: int = 8,
+                 query_embeddings: Optional[Dict[str, List[float]]] = None,
+                 rescore_oversampling: int = 0,
+                 sentence_windows: Optional[Dict[str, SentenceWindows]] = None,
+                 retrieval_mode: str = "dense",
+                 lexical_indexes: Optional[Dict[str, LexicalIndex]] = None,
+                 hybrid_candidates: int = 20,
+                 rrf_k: int = 60,
+                 **kwargs: Any):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unsupported retrieval mode {retrieval_mode}, expected one of {RETRIEVAL_MODES}.")
+        if retrieval_mode != "dense" and lexical_indexes is None:
+            raise ValueError(f"The {retrieval_mode} retrieval mode needs the lexical indexes.")
+        self._retrieval_mode = retrieval_mode
+        self._lexical_indexes = lexical_indexes or {}
+        self._hybrid_candidates = hybrid_candidates
+        self._rrf_k = rrf_k
+        self._indexes = indexes
+        self._query_embeddings = query_embeddings or {}
+        self._ann_nprobe = ann_nprobe
+        self._rescore_oversampling = rescore_oversampling
+        self._sentence_windows = sentence_windows or {}
+        self._embed_model = embed_model
+        self._similarity_top_k = similarity_top_k
+        self._block_cache = block_cache
+        super().__init__(**kwargs)
+
+    def get_embedding_block(self) -> EmbeddingBlock:
+        """
+        Get the stacked embeddings of the indexes, building them on a cache miss.
+        """
+        key = tuple(sorted(self._indexes))
+        block = self._block_cache.get(key)
+        if block is None:
+            block = EmbeddingBlock.from_indexes({index_id: self._indexes[index_id] for index_id in key})
+            self._block_cache.put(key, block, block.nbytes)
+        return block
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        #Embed the query with the async API, the search itself is CPU bound
+        if query_bundle.embedding is None and self._retrieval_mode != "lexical":
+            query_bundle.embedding = self._query_embeddings.get(query_bundle.query_str)
+            if query_bundle.embedding is None:
+                query_bundle.embedding = await self._embed_model.aget_agg_embedding_from_queries(query_bundle.embedding_strs)
+        return self._retrieve(query_bundle)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None and self._retrieval_mode != "lexical":
+            query_bundle.embedding = self._query_embeddings.get(query_bundle.query_str)
+            if query_bundle.embedding is None:
+                query_bundle.embedding = self._embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+
+        with tracer.span("retrieve", mode=self._retrieval_mode) as span:
+            #1. Best (index id, node id, score) of the retrieval mode
+            if self._retrieval_mode == "dense":
+                ranked = self.__dense_top_k(query_bundle.embedding, self._similarity_top_k, span)
+            elif self._retrieval_mode == "lexical":
+                ranked = lexical_top_k(self._lexical_indexes, query_bundle.query_str, self._similarity_top_k)
+            else:
+                dense = self.__dense_top_k(query_bundle.embedding, self._hybrid_candidates, span)
+                lexical = lexical_top_k(self._lexical_indexes, query_bundle.query_str, self._hybrid_candidates)
+                span.count("lexical_candidates", len(lexical))
+                ranked = reciprocal_rank_fusion([[(index_id, node_id) for index_id, node_id, _ in dense],
+                                                 [(index_id, node_id) for index_id, node_id, _ in lexical]],
+                                                self._rrf_k)[:self._similarity_top_k]
+
+            #2. Nodes, with their sentence window
+            results = [NodeWithScore(node=self.__get_node(index_id, node_id, span), score=score)
+                       for index_id, node_id, score in ranked]
+            span.count("nodes_retrieved", len(results))
+        return results
+
+    def __dense_top_k(self, query_embedding: List[float], similarity_top_k: int, span) -> List[Tuple[str, str, float]]:
+        block = self.get_embedding_block()
+        span.count("rows", len(block.matrix))
+        return [(block.index_ids[block.owners[row]], str(block.node_ids[row]), score)
+                for row, score in block.top_k(query_embedding, similarity_top_k, self._ann_nprobe, self._rescore_oversampling)]
+
+    def __get_node(self, index_id: str, node_id: str, span):
+        index = self._indexes[index_id]
+        node = index.docstore.get_node(node_id)
+        windows = self._sentence_windows.get(index_id)
+        if windows is not None and WINDOW_METADATA_KEY not in node.metadata:
+            window = windows.window(node.node_id, index.docstore)
+            if window is not None:
+                node.metadata[WINDOW_METADATA_KEY] = window
+                node.metadata[ORIGINAL_TEXT_METADATA_KEY] = node.get_content()
+                span.count("windows_rebuilt")
+        return node
+
+
+class TracedMetadataReplacementPostProcessor(MetadataReplacementPostProcessor):
+    """
+    MetadataReplacementPostProcessor timed by the tracer.
+    """
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        with tracer.span("postprocess") as span:
+            span.count("nodes", len(nodes))
+            return super()._postprocess_nodes(nodes, query_bundle)
@@ -0,0 +1,117 @@
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+
+from advanced_chatbot.services.storage_utils import save_array_atomic
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import BaseNode
+    from llama_index.core.storage.docstore.types import BaseDocumentStore
+
+
+WINDOW_NODE_IDS_FNAME = "window_node_ids.npy"
+WINDOW_GROUP_OFFSETS_FNAME = "window_group_offsets.npy"
+
+#Metadata keys set by SentenceWindowNodeParser
+WINDOW_METADATA_KEY = "window"
+ORIGINAL_TEXT_METADATA_KEY = "original_text"
+
+
+class SentenceWindows:
+    """
+    Compact storage of the sentence windows of an index.
+    SentenceWindowNodeParser copies the 2 * window_size + 1 surrounding sentences in the metadata of
+    every node; instead, the node ids are kept in document order (grouped by source page, like the parser)
+    and the window of a node is rebuilt from the text of its neighbours when it is retrieved.
+    """
+
+    def __init__(self, node_ids: np.ndarray, group_offsets: np.ndarray, window_size: int):
+        self.node_ids = node_ids
+        self.group_offsets = group_offsets
+        self.window_size = window_size
+        self._positions: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def build(cls, nodes: List["BaseNode"], window_size: int, node_ids: Optional[List[str]] = None) -> "SentenceWindows":
+        """
+        Record the order of parsed nodes.
+        :param nodes: The nodes in the order of the parser (the windows never cross source pages).
+        :param window_size: The window size of the parser.
+        :param node_ids: The ids under which the nodes are indexed, defaults to their own ids.
+        """
+        group_offsets = [0]
+        for position in range(1, len(nodes)):
+            if nodes[position].ref_doc_id != nodes[position - 1].ref_doc_id:
+                group_offsets.append(position)
+        group_offsets.append(len(nodes))
+        node_ids = node_ids if node_ids is not None else [node.node_id for node in nodes]
+        return cls(node_ids=np.array(node_ids),
+                   group_offsets=np.asarray(group_offsets, dtype=np.int64),
+                   window_size=window_size)
+
+    @classmethod
+    def exists(cls, persist_dir: Path) -> bool:
+        return (Path(persist_dir) / WINDOW_NODE_IDS_FNAME).is_file()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: Path, window_size: int) -> "SentenceWindows":
+        persist_dir = Path(persist_dir)
+        return cls(node_ids=np.load(persist_dir / WINDOW_NODE_IDS_FNAME),
+                   group_offsets=np.load(persist_dir / WINDOW_GROUP_OFFSETS_FNAME),
+                   window_size=window_size)
+
+    def persist(self, persist_dir: Path) -> None:
+        persist_dir = Path(persist_dir)
+        save_array_atomic(persist_dir / WINDOW_NODE_IDS_FNAME, self.node_ids)
+        save_array_atomic(persist_dir / WINDOW_GROUP_OFFSETS_FNAME, self.group_offsets)
+
+    @property
+    def nbytes(self) -> int:
+        return self.node_ids.nbytes + self.group_offsets.nbytes
+
+    def window(self, node_id: str, docstore: "BaseDocumentStore") -> Optional[str]:
+        """
+        Rebuild the window of a node from the text of its neighbours, as the parser does.
+        :param node_id: The id of the node.
+        :param docstore: The docstore of the index.
+        :return: The window, None if the node is unknown.
+        """
+        bounds = self.__bounds(node_id)
+        if bounds is None:
+            return None
+        return " ".join(docstore.get_node(str(neighbour_id)).get_content() for neighbour_id in self.node_ids[bounds[0]:bounds[1]])
+
+    def all_windows(self, texts: Dict[str, str]) -> Dict[str, str]:
+        """
+        Rebuild the window of every node.
+        :param texts: The text of every node, by node id.
+        :return: The windows by node id.
+        """
+        ordered_texts = [texts[str(node_id)] for node_id in self.node_ids]
+        windows = {}
+        for group in range(len(self.group_offsets) - 1):
+            start, end = int(self.group_offsets[group]), int(self.group_offsets[group + 1])
+            for position in range(start, end):
+                low, high = max(start, position - self.window_size), min(end, position + self.window_size + 1)
+                windows[str(self.node_ids[position])] = " ".join(ordered_texts[low:high])
+        return windows
+
+    def __bounds(self, node_id: str):
+        if self._positions is None:
+            self._positions = {str(node_id): position for position, node_id in enumerate(self.node_ids)}
+        position = self._positions.get(node_id)
+        if position is None:
+            return None
+        group = int(np.searchsorted(self.group_offsets, position, side="right")) - 1
+        start, end = int(self.group_offsets[group]), int(self.group_offsets[group + 1])
+        return max(start, position - self.window_size), min(end, position + self.window_size + 1)
+
+
+def strip_windows(nodes: List["BaseNode"]) -> None:
+    """
+    Remove the window and original text copied by the parser in the metadata of the nodes (in place).
+    """
+    for node in nodes:
+        node.metadata.pop(WINDOW_METADATA_KEY, None)
+        node.metadata.pop(ORIGINAL_TEXT_METADATA_KEY, None)
@@ -0,0 +1,139 @@
+
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+try:
+    import fcntl
+except ImportError:
+    #No file locks (Windows): calls are only deduplicated between the threads of a process
+    fcntl = None
+
+
+T = TypeVar("T")
+
+
+class FileLock:
+    """
+    Exclusive lock between processes on a lock file (fcntl.flock), released when the file is closed.
+    """
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        """
+        Block until the lock is held.
+        :return: Whether another process held the lock (the caller waited for it).
+        """
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is None:
+            return False
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class SingleFlight:
+    """
+    Run a single call at a time per key (ex: ingestion of a file, summary of an index).
+    Threads calling :do with a key already in flight wait for the result (or the exception) of the
+    running call instead of repeating it. Between processes, the leader of each process takes a file lock
+    in :lock_dir: the leaders of the other processes wait for it, then run the call, which must first look
+    for the result persisted by the previous leader (ex: an index found in the registry, a saved summary).
+    The lock files (one per key hash) are never removed: removing a lock file while it is held breaks the lock.
+    """
+
+    def __init__(self, lock_dir: Path):
+        self._lock_dir = Path(lock_dir)
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._stats = {"leaders": 0, "followers": 0, "waited_for_process": 0}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Number of calls run (leaders), of calls served by a running call of the same process (followers),
+        and of leaders that waited for another process.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        Run :fn, unless a call with the same key is in flight: then wait for its result.
+        """
+        future, leader = self.__join(key)
+        if not leader:
+            return future.result()
+
+        file_lock = self.__file_lock(key)
+        try:
+            self.__count_waited(file_lock.acquire())
+            result = fn()
+        except BaseException as error:
+            self.__finish(key, future, error=error)
+            raise
+        finally:
+            file_lock.release()
+        self.__finish(key, future, result=result)
+        return result
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Async version of :do, the waits do not block the event loop (sync and async calls share their flights).
+        """
+        future, leader = self.__join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        file_lock = self.__file_lock(key)
+        try:
+            self.__count_waited(await asyncio.to_thread(file_lock.acquire))
+            result = await fn()
+        except BaseException as error:
+            self.__finish(key, future, error=error)
+            raise
+        finally:
+            file_lock.release()
+        self.__finish(key, future, result=result)
+        return result
+
+    def __join(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats["followers"] += 1
+                return future, False
+            future = self._in_flight[key] = Future()
+            self._stats["leaders"] += 1
+            return future, True
+
+    def __file_lock(self, key: str) -> FileLock:
+        return FileLock(self._lock_dir / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.lock")
+
+    def __count_waited(self, waited: bool) -> None:
+        if waited:
+            with self._lock:
+                self._stats["waited_for_process"] += 1
+
+    def __finish(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            del self._in_flight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
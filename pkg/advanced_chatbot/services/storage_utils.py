@@ -0,0 +1,18 @@
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def save_array_atomic(path: Path, array: np.ndarray) -> None:
+    """
+    Write a .npy file through a temporary file and a rename.
+    Processes that already mapped the previous file keep reading the old pages.
+    :param path: The destination .npy file.
+    :param array: The array to save.
+    """
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.asarray(array))
+    os.replace(tmp_path, path)
@@ -0,0 +1,268 @@
+
+import cProfile
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """
+    A timed stage of a traced operation, with counters (ex: nodes retrieved, bytes loaded).
+    Spans of the same operation share a trace id, nested spans know their parent.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.parent = parent
+        self.attributes = attributes
+        self.counters: Dict[str, float] = {}
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._thread_id = threading.get_ident()
+
+    def count(self, name: str, value: float = 1) -> None:
+        """
+        Add a value to a counter of the span.
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: Any) -> None:
+        """
+        Set an attribute of the span.
+        """
+        self.attributes[name] = value
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def end(self) -> None:
+        """
+        Stop the span and send it to the sinks (only the first call counts).
+        """
+        if self.duration is not None:
+            return
+        self.duration = self.elapsed()
+        self.tracer._finish(self)
+
+    def stop_profile(self) -> None:
+        """
+        Stop profiling the span before it ends (ex: a span ended by a stream returned to the caller).
+        """
+        if self._profile is not None:
+            self.tracer._stop_profile(self)
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "duration_ms": self.duration * 1000 if self.duration is not None else None,
+            "counters": self.counters,
+            "attributes": self.attributes,
+            "timestamp": time.time(),
+        }
+
+
+class LogSink:
+    """
+    Log every finished span.
+    """
+
+    def __init__(self, level: int = logging.INFO, logger_name: str = __name__):
+        self._level = level
+        self._logger = logging.getLogger(logger_name)
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        self._logger.log(self._level, "%s %.1fms %s", record["span"], record["duration_ms"], record["counters"])
+
+
+class JsonlSink:
+    """
+    Append every finished span as a JSON line to a file.
+    """
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            with open(self._path, "a") as f:
+                f.write(line)
+
+
+class HistogramSink:
+    """
+    In-memory latency distribution and counter totals per span name.
+    Only the last :max_samples durations of each span are kept.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+        self._durations: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self._max_samples))
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._counters: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._durations[record["span"]].append(record["duration_ms"])
+            self._counts[record["span"]] += 1
+            for name, value in record["counters"].items():
+                self._counters[record["span"]][name] += value
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the latency percentiles (ms) and counter totals of every span.
+        :return: {span name: {count, p50_ms, p95_ms, p99_ms, max_ms, counters}}
+        """
+        with self._lock:
+            stats = {}
+            for name, durations in self._durations.items():
+                samples = sorted(durations)
+                stats[name] = {
+                    "count": self._counts[name],
+                    "p50_ms": _percentile(samples, 50),
+                    "p95_ms": _percentile(samples, 95),
+                    "p99_ms": _percentile(samples, 99),
+                    "max_ms": samples[-1],
+                    "counters": dict(self._counters[name]),
+                }
+            return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._counters.clear()
+
+
+def _percentile(samples: List[float], percent: float) -> float:
+    return samples[min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))]
+
+
+class Tracer:
+    """
+    Record span timings and counters, and send the finished spans to the sinks.
+    Spans opened with :span are nested per thread. A sample of the root spans can be profiled with cProfile.
+    """
+
+    def __init__(self):
+        self._sinks: List[Any] = []
+        self._local = threading.local()
+        self._profile_sample_rate = 0.0
+        self._profile_dir: Optional[Path] = None
+
+    def add_sink(self, sink: Any) -> None:
+        """
+        Send the finished spans to a sink (any object with an emit(record) method).
+        """
+        self._sinks = self._sinks + [sink]
+
+    def remove_sink(self, sink: Any) -> None:
+        self._sinks = [s for s in self._sinks if s is not sink]
+
+    def configure_profiling(self, sample_rate: float, output_dir: Optional[Path] = None) -> None:
+        """
+        Profile a fraction of the root spans with cProfile.
+        :param sample_rate: The fraction of root spans profiled (0 disables profiling).
+        :param output_dir: Where the .prof files (one per profiled span, see pstats) are written.
+        """
+        if sample_rate > 0 and output_dir is None:
+            raise ValueError("An output directory is required to profile spans.")
+        self._profile_sample_rate = sample_rate
+        self._profile_dir = Path(output_dir) if output_dir is not None else None
+        if self._profile_dir is not None:
+            self._profile_dir.mkdir(parents=True, exist_ok=True)
+
+    def current_span(self) -> Optional[Span]:
+        """
+        The innermost span opened with :span in this thread.
+        """
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+        """
+        Start a span that is ended explicitly (ex: a span ending when a response stream is consumed).
+        :param parent: The parent span, defaults to the current span of the thread.
+        """
+        parent = parent if parent is not None else self.current_span()
+        trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        span = Span(self, name, trace_id, parent, attributes)
+        if parent is None and self._profile_sample_rate > 0 and random.random() < self._profile_sample_rate:
+            span._profile = cProfile.Profile()
+            try:
+                span._profile.enable()
+            except ValueError:
+                #Another profiler is already active
+                span._profile = None
+        return span
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes: Any) -> Iterator[Span]:
+        """
+        Time a block of code, the span is the current span of the thread inside the block.
+        """
+        span = self.start_span(name, parent=parent, **attributes)
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span.end()
+
+    def record(self, name: str, duration: float, parent: Optional[Span] = None, **counters: float) -> None:
+        """
+        Record a span measured elsewhere (ex: time to first token).
+        :param duration: The duration in seconds.
+        """
+        span = Span(self, name, parent.trace_id if parent is not None else uuid.uuid4().hex[:16], parent, {})
+        span.counters.update(counters)
+        span.duration = duration
+        self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        if span._profile is not None:
+            self._stop_profile(span)
+        if not self._sinks:
+            return
+        record = span.to_record()
+        for sink in self._sinks:
+            try:
+                sink.emit(record)
+            except Exception:
+                logger.exception("Tracing sink %r failed", sink)
+
+    def _stop_profile(self, span: Span) -> None:
+        profile, span._profile = span._profile, None
+        #A profiler can only be stopped by the thread that started it
+        if span._thread_id != threading.get_ident():
+            logger.warning("Profile of span %s dropped: ended in another thread", span.name)
+            return
+        profile.disable()
+        path = self._profile_dir / f"{span.name}-{span.trace_id}.prof"
+        profile.dump_stats(path)
+        span.set("profile", str(path))
+
+
+#Tracer shared by the services, sinks are added by the application (ex: tracer.add_sink(LogSink()))
+tracer = Tracer()
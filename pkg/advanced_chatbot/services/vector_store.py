@@ -0,0 +1,315 @@
+
+from pathlib import Path
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from advanced_chatbot.services.ann import IVFIndex
+from advanced_chatbot.services.quantization import (check_vector_dtype, dequantize, quantize, quantized_scores,
+                                                    row_norms, vector_dtype_of)
+from advanced_chatbot.services.storage_utils import save_array_atomic
+
+
+MMAP_VECTORS_FNAME = "vectors.npy"
+MMAP_NODE_IDS_FNAME = "vector_node_ids.npy"
+MMAP_REF_DOC_IDS_FNAME = "vector_ref_doc_ids.npy"
+MMAP_SCALES_FNAME = "vector_scales.npy"
+MMAP_FULL_PRECISION_FNAME = "vectors_float32.npy"
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """
+    Vector store keeping the embeddings in a contiguous matrix.
+    Persisted as raw .npy files, the matrix is memory mapped on load: opening an index
+    does not parse anything and the pages are shared by every process reading it.
+    Node ids and ref doc ids are kept in compact side arrays (one row per vector).
+    When an IVF index is built (ANN mode), queries only score the rows of the closest lists.
+    The embeddings can be stored as float16 or int8 (:vector_dtype), queries then score the quantized
+    vectors (see quantized_scores). With :keep_full_precision, the float32 embeddings are also persisted (and memory mapped)
+    to rescore the top_k * :rescore_oversampling best candidates exactly.
+    """
+
+    stores_text: bool = False
+    is_embedding_query: bool = True
+
+    _embeddings: np.ndarray = PrivateAttr()
+    _node_ids: np.ndarray = PrivateAttr()
+    _ref_doc_ids: np.ndarray = PrivateAttr()
+    _norms: Optional[np.ndarray] = PrivateAttr(default=None)
+    _ivf: Optional[IVFIndex] = PrivateAttr(default=None)
+    _ann_nprobe: int = PrivateAttr()
+    _vector_dtype: str = PrivateAttr()
+    _scales: Optional[np.ndarray] = PrivateAttr(default=None)
+    _full_precision: Optional[np.ndarray] = PrivateAttr(default=None)
+    _rescore_oversampling: int = PrivateAttr()
+
+    def __init__(self,
+                 embeddings: Optional[np.ndarray] = None,
+                 node_ids: Optional[np.ndarray] = None,
+                 ref_doc_ids: Optional[np.ndarray] = None,
+                 ivf: Optional[IVFIndex] = None,
+                 ann_nprobe: int = 8,
+                 vector_dtype: str = "float32",
+                 scales: Optional[np.ndarray] = None,
+                 keep_full_precision: bool = False,
+                 full_precision: Optional[np.ndarray] = None,
+                 rescore_oversampling: int = 0,
+                 **kwargs: Any):
+        super().__init__(**kwargs)
+        self._ivf = ivf
+        self._ann_nprobe = ann_nprobe
+        self._rescore_oversampling = rescore_oversampling
+        self._vector_dtype = vector_dtype_of(embeddings) if embeddings is not None else check_vector_dtype(vector_dtype)
+        self._embeddings = embeddings if embeddings is not None else np.zeros((0, 0), dtype=self._vector_dtype)
+        self._scales = scales if scales is not None or self._vector_dtype != "int8" else np.zeros(0, dtype=np.float32)
+        if full_precision is None and keep_full_precision and self._vector_dtype != "float32":
+            full_precision = np.zeros((0, 0), dtype=np.float32)
+        self._full_precision = full_precision
+        self._node_ids = node_ids if node_ids is not None else np.array([], dtype="U")
+        self._ref_doc_ids = ref_doc_ids if ref_doc_ids is not None else np.array([], dtype="U")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @classmethod
+    def exists(cls, persist_dir: Path) -> bool:
+        """
+        Whether a directory contains a persisted memory mapped vector store.
+        """
+        return (Path(persist_dir) / MMAP_VECTORS_FNAME).is_file()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: Path, ann_nprobe: int = 8, rescore_oversampling: int = 0) -> "MmapVectorStore":
+        """
+        Open a persisted vector store without copying the embeddings in memory.
+        The storage type of the embeddings is the one of the persisted matrix.
+        :param persist_dir: The directory of the index.
+        :param ann_nprobe: The number of IVF lists scanned per query, if the store has an IVF index.
+        :param rescore_oversampling: Rescore top_k * rescore_oversampling candidates, if the store kept
+        its float32 embeddings (0 disables rescoring).
+        """
+        persist_dir = Path(persist_dir)
+        scales_path, full_precision_path = persist_dir / MMAP_SCALES_FNAME, persist_dir / MMAP_FULL_PRECISION_FNAME
+        return cls(
+            embeddings=np.load(persist_dir / MMAP_VECTORS_FNAME, mmap_mode="r"),
+            node_ids=np.load(persist_dir / MMAP_NODE_IDS_FNAME),
+            ref_doc_ids=np.load(persist_dir / MMAP_REF_DOC_IDS_FNAME),
+            ivf=IVFIndex.from_persist_dir(persist_dir) if IVFIndex.exists(persist_dir) else None,
+            ann_nprobe=ann_nprobe,
+            scales=np.load(scales_path) if scales_path.is_file() else None,
+            full_precision=np.load(full_precision_path, mmap_mode="r") if full_precision_path.is_file() else None,
+            rescore_oversampling=rescore_oversampling,
+        )
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """
+        The (num_nodes, dim) float32 embedding matrix (dequantized, or the full precision one if it was kept).
+        """
+        if self._vector_dtype == "float32":
+            return self._embeddings
+        if self._full_precision is not None and len(self._full_precision) == len(self._node_ids):
+            return self._full_precision
+        return dequantize(self._embeddings, self._scales)
+
+    @property
+    def vector_dtype(self) -> str:
+        """
+        The storage type of the embeddings ("float32", "float16" or "int8").
+        """
+        return self._vector_dtype
+
+    @property
+    def codes(self) -> np.ndarray:
+        """
+        The stored (num_nodes, dim) embedding matrix, quantized unless the storage type is float32.
+        """
+        return self._embeddings
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        """
+        The scale of every int8 vector (None for the float types).
+        """
+        return self._scales
+
+    @property
+    def full_precision_embeddings(self) -> Optional[np.ndarray]:
+        """
+        The float32 embeddings used for rescoring: the embeddings themselves in float32,
+        the kept full precision copy of quantized embeddings, None otherwise.
+        """
+        if self._vector_dtype == "float32":
+            return self._embeddings
+        return self._full_precision if self._full_precision is not None and len(self._full_precision) == len(self._node_ids) else None
+
+    @property
+    def node_ids(self) -> np.ndarray:
+        """
+        The node id of every row of the embedding matrix.
+        """
+        return self._node_ids
+
+    @property
+    def ann_index(self) -> Optional[IVFIndex]:
+        """
+        The IVF index used for approximate search, None in exact mode.
+        """
+        return self._ivf
+
+    @property
+    def ann_nprobe(self) -> int:
+        return self._ann_nprobe
+
+    def build_ann_index(self, nlist: Optional[int] = None) -> IVFIndex:
+        """
+        Build the IVF index of the current embeddings and switch the store to approximate search.
+        It is dropped when nodes are added or deleted.
+        :param nlist: The number of IVF lists, defaults to sqrt(number of nodes).
+        """
+        self._ivf = IVFIndex.build(self.embeddings, nlist=nlist)
+        return self._ivf
+
+    @property
+    def norms(self) -> np.ndarray:
+        """
+        The L2 norm of every row of the embedding matrix (computed once).
+        """
+        if self._norms is None:
+            self._norms = row_norms(self._embeddings, self._scales) if len(self._node_ids) else np.zeros(0, dtype=np.float32)
+        return self._norms
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """
+        Add nodes (with their embedding) to the store.
+        """
+        if not nodes:
+            return []
+
+        new_embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        new_codes, new_scales = quantize(new_embeddings, self._vector_dtype)
+        if self._full_precision is not None:
+            self._full_precision = np.concatenate([self._full_precision, new_embeddings]) if len(self._node_ids) else new_embeddings
+        if len(self._node_ids):
+            new_codes = np.concatenate([self._embeddings, new_codes])
+            new_scales = np.concatenate([self._scales, new_scales]) if new_scales is not None else None
+        node_ids = [node.node_id for node in nodes]
+        ref_doc_ids = [node.ref_doc_id or "" for node in nodes]
+
+        self._embeddings = new_codes
+        self._scales = new_scales
+        self._node_ids = np.concatenate([self._node_ids, np.array(node_ids)])
+        self._ref_doc_ids = np.concatenate([self._ref_doc_ids, np.array(ref_doc_ids)])
+        self._norms = None
+        self._ivf = None
+        return node_ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """
+        Delete the nodes of a source document.
+        """
+        self.__keep_rows(self._ref_doc_ids != ref_doc_id)
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Any = None, **delete_kwargs: Any) -> None:
+        """
+        Delete nodes by id.
+        """
+        if filters is not None:
+            raise ValueError("Metadata filters are not supported by MmapVectorStore.")
+        if node_ids:
+            self.__keep_rows(~np.isin(self._node_ids, node_ids))
+
+    def clear(self) -> None:
+        """
+        Delete every node of the store.
+        """
+        self.__keep_rows(np.zeros(len(self._node_ids), dtype=bool))
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """
+        Cosine similarity search, approximate when the store has an IVF index.
+        Quantized embeddings are scored as they are, then the best candidates are rescored
+        with the float32 embeddings when they were kept.
+        """
+        if query.filters is not None:
+            raise ValueError("Metadata filters are not supported by MmapVectorStore.")
+        if query.query_embedding is None or not len(self._node_ids):
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        rows = np.arange(len(self._node_ids))
+        if query.node_ids is not None:
+            rows = rows[np.isin(self._node_ids, query.node_ids)]
+        elif self._ivf is not None:
+            rows = np.sort(self._ivf.candidates(query_embedding / max(float(np.linalg.norm(query_embedding)), 1e-12),
+                                                self._ann_nprobe))
+        if query.doc_ids is not None:
+            rows = rows[np.isin(self._ref_doc_ids[rows], query.doc_ids)]
+        if not len(rows):
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        norms = self.norms
+        if len(rows) == len(self._node_ids):
+            scores = quantized_scores(self._embeddings, self._scales, query_embedding)
+        else:
+            scores = quantized_scores(self._embeddings, self._scales, query_embedding, rows)
+            norms = norms[rows]
+        scores = scores / np.maximum(norms * np.linalg.norm(query_embedding), 1e-12)
+
+        full_precision = self.full_precision_embeddings
+        rescore = self._vector_dtype != "float32" and self._rescore_oversampling > 0 and full_precision is not None
+        top_k = min(query.similarity_top_k * (self._rescore_oversampling if rescore else 1), len(rows))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        if rescore:
+            #Exact scores of the candidates, only their rows of the float32 matrix are read
+            candidates = np.asarray(full_precision[rows[top]], dtype=np.float32)
+            scores[top] = (candidates @ query_embedding) / np.maximum(
+                np.linalg.norm(candidates, axis=1) * np.linalg.norm(query_embedding), 1e-12)
+            top = top[np.argsort(-scores[top])[:query.similarity_top_k]]
+        top = top[np.argsort(-scores[top])]
+        return VectorStoreQueryResult(
+            similarities=scores[top].tolist(),
+            ids=self._node_ids[rows[top]].tolist(),
+        )
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        """
+        Persist the store as .npy files in the directory of :persist_path.
+        """
+        persist_dir = Path(persist_path).parent
+        persist_dir.mkdir(parents=True, exist_ok=True)
+        save_array_atomic(persist_dir / MMAP_VECTORS_FNAME, np.ascontiguousarray(self._embeddings, dtype=self._vector_dtype))
+        for fname, array in [(MMAP_SCALES_FNAME, self._scales), (MMAP_FULL_PRECISION_FNAME, self._full_precision)]:
+            if array is not None:
+                save_array_atomic(persist_dir / fname, np.ascontiguousarray(array, dtype=np.float32))
+            else:
+                (persist_dir / fname).unlink(missing_ok=True)
+        save_array_atomic(persist_dir / MMAP_NODE_IDS_FNAME, self._node_ids)
+        save_array_atomic(persist_dir / MMAP_REF_DOC_IDS_FNAME, self._ref_doc_ids)
+        if self._ivf is not None:
+            self._ivf.persist(persist_dir)
+        else:
+            IVFIndex.remove(persist_dir)
+
+    def __keep_rows(self, mask: np.ndarray) -> None:
+        self._embeddings = self._embeddings[mask]
+        if self._scales is not None:
+            self._scales = self._scales[mask]
+        if self._full_precision is not None and len(self._full_precision) == len(mask):
+            self._full_precision = self._full_precision[mask]
+        self._node_ids = self._node_ids[mask]
+        self._ref_doc_ids = self._ref_doc_ids[mask]
+        self._norms = None
+        self._ivf = None
@@ -1,8 +1,7 @@
 import streamlit as st
-import uuid
 import os  # Import os module
 from dotenv import load_dotenv
-from controller import handle_file_upload, load_history, save_history, add_message, list_data_files, get_file_paths, get_bot_response
+from controller import handle_file_upload, list_conversations, load_conversation, create_conversation, add_message, list_data_files, get_file_paths, stream_bot_response, get_document_status
 
 # Load environment variables from .env.local
 load_dotenv(dotenv_path=".env.local")
@@ -71,9 +70,8 @@ if "documents" not in st.session_state:
     st.session_state.documents = []
 if "summaries" not in st.session_state:
     st.session_state.summaries = []
+# Messages of the conversations loaded in this session, by conversation id
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = load_history()
-if not isinstance(st.session_state.chat_history, dict):
     st.session_state.chat_history = {}
 if "uploaded" not in st.session_state:
     st.session_state.uploaded = False
@@ -86,10 +84,9 @@ if "selected_files" not in st.session_state:
 
 # Ensure there is a current conversation
 if st.session_state.current_conversation is None:
-    new_conversation_id = str(uuid.uuid4())
+    new_conversation_id = create_conversation()
     st.session_state.chat_history[new_conversation_id] = []
     st.session_state.current_conversation = new_conversation_id
-    save_history(st.session_state.chat_history)
 
 # Sidebar Layout
 st.sidebar.title("AI Assistant")
@@ -101,17 +98,17 @@ st.session_state.system_prompt = st.sidebar.text_area("Set System Prompt", value
 # Conversation History at the top
 st.sidebar.header("Conversation History")
 if st.sidebar.button("Create New Conversation", key="create_new_conv", help="Click to start a new conversation"):
-    new_conversation_id = str(uuid.uuid4())
+    new_conversation_id = create_conversation()
     st.session_state.chat_history[new_conversation_id] = []
     st.session_state.current_conversation = new_conversation_id
-    save_history(st.session_state.chat_history)
     st.rerun()
 
-if isinstance(st.session_state.chat_history, dict):
-    for conv_id in st.session_state.chat_history.keys():
-        if st.sidebar.button(f"Load Conversation {conv_id}"):
-            st.session_state.current_conversation = conv_id
-            st.rerun()
+for conv_id in list_conversations():
+    if st.sidebar.button(f"Load Conversation {conv_id}"):
+        st.session_state.current_conversation = conv_id
+        # Reload, the conversation may have been continued in another session
+        st.session_state.chat_history[conv_id] = load_conversation(conv_id)
+        st.rerun()
 
 # Documents at the bottom
 st.sidebar.header("Your documents:")
@@ -123,7 +120,9 @@ if st.session_state.documents:
         checkbox_key = f"checkbox_{index}"
         if checkbox_key not in st.session_state:
             st.session_state[checkbox_key] = doc["use_in_rag"]
-        use_in_rag = st.sidebar.checkbox(doc["name"], value=st.session_state[checkbox_key], key=checkbox_key)
+        status = get_document_status(doc)
+        label = doc["name"] if status == "done" else f"{doc['name']} ({status})"
+        use_in_rag = st.sidebar.checkbox(label, value=st.session_state[checkbox_key], key=checkbox_key)
         doc["use_in_rag"] = use_in_rag
         if use_in_rag and doc["path"] not in st.session_state.selected_files:
             st.session_state.selected_files.append(doc["path"])
@@ -148,27 +147,28 @@ else:
 st.markdown("<h2 class='chat-header'>Welcome to the AI Assistant</h2>", unsafe_allow_html=True)
 st.markdown("<p class='chat-header'>You can upload documents or ask me something...</p>", unsafe_allow_html=True)
 
-def add_user_message():
-    user_input = st.session_state.user_input
-    if user_input:
-        add_message("user", user_input)
-        
-        # Get bot response using selected files and system prompt
-        bot_response = get_bot_response(user_input, st.session_state.selected_files, st.session_state.system_prompt)
-        
-        add_message("bot", bot_response)
-        st.session_state.user_input = ""
+def render_message(role: str, content: str, container=st):
+    css_class = "user" if role == "user" else "bot"
+    container.markdown(f"<div class='chat-bubble {css_class}'>{content}</div>", unsafe_allow_html=True)
 
 if st.session_state.current_conversation is not None:
+    if st.session_state.current_conversation not in st.session_state.chat_history:
+        st.session_state.chat_history[st.session_state.current_conversation] = load_conversation(st.session_state.current_conversation)
     for chat in st.session_state.chat_history[st.session_state.current_conversation]:
-        if chat["role"] == "user":
-            st.markdown(f"<div class='chat-bubble user'>{chat['content']}</div>", unsafe_allow_html=True)
-        else:
-            st.markdown(f"<div class='chat-bubble bot'>{chat['content']}</div>", unsafe_allow_html=True)
+        render_message(chat["role"], chat["content"])
 
-    st.text_input("Type your request...", key="user_input", on_change=add_user_message, placeholder="Type your request here...")
+    user_input = st.chat_input("Type your request here...")
+    if user_input:
+        add_message("user", user_input)
+        render_message("user", user_input)
+
+        # Render the bot response as the tokens arrive, it is saved to the history once complete
+        bot_placeholder = st.empty()
+        bot_response = ""
+        for token in stream_bot_response(user_input, st.session_state.selected_files, st.session_state.system_prompt):
+            bot_response += token
+            render_message("bot", bot_response, container=bot_placeholder)
+
+        add_message("bot", bot_response)
 else:
     st.write("Please create or load a conversation to start chatting.")
-
-if st.button("Save Chat History"):
-    save_history(st.session_state.chat_history)
@@ -0,0 +1,111 @@
+"""
+Recall@k / latency benchmark of the IVF (ANN) mode against exact search.
+
+Run from the pkg folder:
+
+    python benchmarks/ann_recall.py --num-vectors 20000 --nlist 0 64 256 --nprobe 1 4 8 16
+    python benchmarks/ann_recall.py --index-ids 1a2b3c4d 5e6f7a8b
+
+Without --index-ids, the vectors are synthetic (clustered gaussians, like sentence embeddings).
+With --index-ids, the embeddings of the given indexes are used and queries are sampled from them.
+The report is printed as JSON.
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from advanced_chatbot.services.ann import IVFIndex
+
+
+def synthetic_embeddings(num_vectors: int, dim: int, num_clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, num_clusters, num_vectors)] + 0.5 * rng.standard_normal((num_vectors, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def index_embeddings(index_ids: List[str]) -> np.ndarray:
+    from advanced_chatbot.services.rag_service import RagService
+
+    matrices = [np.asarray(RagService.load_vector_store_index(index_id).vector_store.embeddings) for index_id in index_ids]
+    matrix = np.concatenate(matrices).astype(np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def exact_top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = matrix @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def run(matrix: np.ndarray, queries: np.ndarray, k: int, nlists: List[int], nprobes: List[int]) -> Dict:
+    truth, exact_latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(set(exact_top_k(matrix, query, k).tolist()))
+        exact_latencies.append(time.perf_counter() - start)
+
+    report = {
+        "num_vectors": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "num_queries": int(len(queries)),
+        "k": k,
+        "exact_ms_per_query": 1000 * float(np.mean(exact_latencies)),
+        "ann": [],
+    }
+    for nlist in nlists:
+        start = time.perf_counter()
+        ivf = IVFIndex.build(matrix, nlist=nlist or None)
+        build_seconds = time.perf_counter() - start
+
+        for nprobe in nprobes:
+            recalls, latencies = [], []
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                rows = ivf.candidates(query, nprobe)
+                top = rows[exact_top_k(matrix[rows], query, min(k, len(rows)))]
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(expected & set(top.tolist())) / k)
+
+            report["ann"].append({
+                "nlist": ivf.nlist,
+                "nprobe": nprobe,
+                "build_seconds": build_seconds,
+                f"recall@{k}": float(np.mean(recalls)),
+                "ms_per_query": 1000 * float(np.mean(latencies)),
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-ids", nargs="*", default=None, help="Benchmark the embeddings of these indexes.")
+    parser.add_argument("--num-vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--num-clusters", type=int, default=200)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--nlist", type=int, nargs="+", default=[0], help="0 means sqrt(num vectors).")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.index_ids:
+        matrix = index_embeddings(args.index_ids)
+    else:
+        matrix = synthetic_embeddings(args.num_vectors, args.dim, args.num_clusters, args.seed)
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = matrix[rng.choice(len(matrix), min(args.num_queries, len(matrix)), replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(json.dumps(run(matrix, queries, args.k, args.nlist, args.nprobe), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Ingestion embedding throughput of the EmbeddingScheduler against the local stand-in server.
+
+Starts an EmbeddingStubServer (injected latency and 429s), embeds synthetic 128-token chunks
+through the same OpenAI batch function as RagService with several concurrency settings, and
+prints the wall-clock time, requests and 429 counts as JSON:
+
+    python benchmarks/embedding_scheduler.py --num-texts 2000 --latency-ms 300 --in-flight 1 4 8
+"""
+
+import argparse
+import json
+import random
+import time
+
+from advanced_chatbot.services.embedding_scheduler import EmbeddingScheduler, make_openai_batch_fn
+from embedding_stub_server import EmbeddingStubServer
+
+
+WORDS = "the building energy renovation heat pump emission tertiary sector housing design user".split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-texts", type=int, default=2000)
+    parser.add_argument("--words-per-text", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.05)
+    parser.add_argument("--server-requests-per-minute", type=int, default=None)
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-batch-tokens", type=int, default=16000)
+    parser.add_argument("--requests-per-minute", type=int, default=3000)
+    parser.add_argument("--tokens-per-minute", type=int, default=1000000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    texts = [" ".join(rng.choice(WORDS) for _ in range(args.words_per_text)) + f" {i}" for i in range(args.num_texts)]
+
+    report = []
+    for max_in_flight in args.in_flight:
+        server = EmbeddingStubServer(latency_ms=args.latency_ms,
+                                     rate_limit_probability=args.rate_limit_probability,
+                                     requests_per_minute=args.server_requests_per_minute,
+                                     retry_after_seconds=0.2).start()
+        scheduler = EmbeddingScheduler(embed_batch_fn=make_openai_batch_fn(api_key="stub", model="stub", api_base=server.api_base),
+                                       max_batch_tokens=args.max_batch_tokens,
+                                       max_batch_size=512,
+                                       max_in_flight=max_in_flight,
+                                       requests_per_minute=args.requests_per_minute,
+                                       tokens_per_minute=args.tokens_per_minute)
+        start = time.perf_counter()
+        embeddings = scheduler.embed(texts)
+        seconds = time.perf_counter() - start
+        server.shutdown()
+
+        assert len(embeddings) == len(texts)
+        report.append({
+            "max_in_flight": max_in_flight,
+            "seconds": seconds,
+            "texts_per_second": len(texts) / seconds,
+            "scheduler": scheduler.stats(),
+            "server": server.stats,
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Local stand-in for the OpenAI embeddings endpoint (POST /v1/embeddings).
+
+Answers with deterministic pseudo-random vectors after an injected latency, and rejects
+requests with HTTP 429 (with a Retry-After header) at random or above a requests per minute
+limit. Used to test the EmbeddingScheduler without calling the real API:
+
+    python benchmarks/embedding_stub_server.py --port 8765 --latency-ms 300 --rate-limit-probability 0.1
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import numpy as np
+
+
+class EmbeddingStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self,
+                 port: int = 0,
+                 dim: int = 1536,
+                 latency_ms: float = 200,
+                 rate_limit_probability: float = 0.0,
+                 requests_per_minute: Optional[int] = None,
+                 retry_after_seconds: float = 0.5):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.rate_limit_probability = rate_limit_probability
+        self.requests_per_minute = requests_per_minute
+        self.retry_after_seconds = retry_after_seconds
+        self.lock = threading.Lock()
+        self.accepted = deque()
+        self.stats = {"requests": 0, "rate_limited": 0, "texts": 0}
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "EmbeddingStubServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def is_rate_limited(self) -> bool:
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            while self.accepted and now - self.accepted[0] > 60:
+                self.accepted.popleft()
+            limited = random.random() < self.rate_limit_probability or (
+                self.requests_per_minute is not None and len(self.accepted) >= self.requests_per_minute)
+            if limited:
+                self.stats["rate_limited"] += 1
+            else:
+                self.accepted.append(now)
+            return limited
+
+    def embed(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: EmbeddingStubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.server.latency_ms / 1000)
+
+        if self.server.is_rate_limited():
+            self.__send(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                        headers={"retry-after": str(self.server.retry_after_seconds)})
+            return
+
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        with self.server.lock:
+            self.server.stats["texts"] += len(texts)
+        data = []
+        for position, text in enumerate(texts):
+            vector = self.server.embed(text)
+            embedding = base64.b64encode(vector.tobytes()).decode() if body.get("encoding_format") == "base64" else vector.tolist()
+            data.append({"object": "embedding", "index": position, "embedding": embedding})
+        num_tokens = sum(len(text.split()) for text in texts)
+        self.__send(200, {"object": "list", "data": data, "model": body["model"],
+                          "usage": {"prompt_tokens": num_tokens, "total_tokens": num_tokens}})
+
+    def __send(self, status: int, payload: dict, headers: Optional[dict] = None):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--requests-per-minute", type=int, default=None)
+    args = parser.parse_args()
+
+    server = EmbeddingStubServer(port=args.port, dim=args.dim, latency_ms=args.latency_ms,
+                                 rate_limit_probability=args.rate_limit_probability,
+                                 requests_per_minute=args.requests_per_minute)
+    print(f"Serving embeddings on {server.api_base}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Import-time budget check: cold start of the app and of the worker processes.
+
+Imports each module in a fresh interpreter (best of --repeats runs), checks that it stays under
+the budget and that the heavy dependencies (llama_index, openai) are not imported yet. Prints the
+timings as JSON and exits with status 1 when a module is over budget. Run from the pkg folder:
+
+    python benchmarks/import_time.py --budget-ms 400
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+MODULES = [
+    "advanced_chatbot",
+    "advanced_chatbot.config",
+    "advanced_chatbot.services.rag_service",
+    "advanced_chatbot.services.history_store",
+]
+
+HEAVY_PACKAGES = ["llama_index", "openai", "tiktoken", "nltk"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"seconds": elapsed, "heavy_imports": heavy}}))
+"""
+
+
+def measure(module: str, env: dict) -> dict:
+    result = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_PACKAGES)],
+                            capture_output=True, text=True, env=env, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=400)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("DATA_PATH", tempfile.mkdtemp(prefix="import_bench_"))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                      env.get("PYTHONPATH")]))
+
+    report, over_budget = {}, False
+    for module in args.modules:
+        runs = [measure(module, env) for _ in range(args.repeats)]
+        milliseconds = 1000 * min(run["seconds"] for run in runs)
+        heavy_imports = runs[0]["heavy_imports"]
+        ok = milliseconds <= args.budget_ms and not heavy_imports
+        over_budget = over_budget or not ok
+        report[module] = {"ms": milliseconds, "heavy_imports": heavy_imports, "ok": ok}
+
+    print(json.dumps({"budget_ms": args.budget_ms, "modules": report}, indent=2))
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
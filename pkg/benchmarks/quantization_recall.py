@@ -0,0 +1,99 @@
+"""
+Memory / recall@k / latency benchmark of the quantized embedding storage (float16, int8) against float32.
+
+Run from the pkg folder:
+
+    python benchmarks/quantization_recall.py --num-vectors 20000 --rescore 0 2 4
+    python benchmarks/quantization_recall.py --index-ids 1a2b3c4d 5e6f7a8b
+
+Without --index-ids, the vectors are synthetic (clustered gaussians, like sentence embeddings).
+With --index-ids, the embeddings of the given indexes are used (build them from the sample documents
+with the real embedding model: the mock embedding gives the same vector to every text) and queries
+are sampled from them. The searches go through MmapVectorStore.query, the report is printed as JSON.
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from advanced_chatbot.services.quantization import quantize
+from ann_recall import exact_top_k, index_embeddings, synthetic_embeddings
+
+
+def run(matrix: np.ndarray, queries: np.ndarray, k: int, vector_dtypes: List[str], rescores: List[int]) -> Dict:
+    from llama_index.core.vector_stores.types import VectorStoreQuery
+    from advanced_chatbot.services.vector_store import MmapVectorStore
+
+    truth = [set(exact_top_k(matrix, query, k).tolist()) for query in queries]
+    node_ids = np.array([str(row) for row in range(len(matrix))])
+    ref_doc_ids = np.array([""] * len(matrix))
+    #Memory held by a float32 store (embeddings and row norms)
+    float32_bytes = matrix.astype(np.float32).nbytes + len(matrix) * np.dtype(np.float32).itemsize
+
+    report = {
+        "num_vectors": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "num_queries": int(len(queries)),
+        "k": k,
+        "float32_bytes": float32_bytes,
+        "quantized": [],
+    }
+    for vector_dtype in vector_dtypes:
+        codes, scales = quantize(matrix, vector_dtype)
+        stored_bytes = codes.nbytes + (scales.nbytes if scales is not None else 0)
+        for rescore in (rescores if vector_dtype != "float32" else [0]):
+            store = MmapVectorStore(embeddings=codes, node_ids=node_ids, ref_doc_ids=ref_doc_ids, scales=scales,
+                                    full_precision=matrix if rescore else None, rescore_oversampling=rescore)
+            #Memory held by the loaded store: codes, scales and row norms (the float32 rescoring matrix stays on disk)
+            resident_bytes = store.codes.nbytes + store.norms.nbytes + (store.scales.nbytes if store.scales is not None else 0)
+            recalls, latencies = [], []
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                result = store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=k))
+                latencies.append(time.perf_counter() - start)
+                recalls.append(len(expected & {int(node_id) for node_id in result.ids}) / k)
+
+            report["quantized"].append({
+                "dtype": vector_dtype,
+                "rescore_oversampling": rescore,
+                "stored_bytes": stored_bytes,
+                "resident_bytes": resident_bytes,
+                "memory_reduction": float32_bytes / resident_bytes,
+                f"recall@{k}": float(np.mean(recalls)),
+                "ms_per_query": 1000 * float(np.mean(latencies)),
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-ids", nargs="*", default=None, help="Benchmark the embeddings of these indexes.")
+    parser.add_argument("--num-vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--num-clusters", type=int, default=200)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--dtype", nargs="+", default=["float32", "float16", "int8"], choices=["float32", "float16", "int8"])
+    parser.add_argument("--rescore", type=int, nargs="+", default=[0, 2, 4],
+                        help="Rescore oversampling factors of the quantized types, 0 means no rescoring.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.index_ids:
+        matrix = index_embeddings(args.index_ids)
+    else:
+        matrix = synthetic_embeddings(args.num_vectors, args.dim, args.num_clusters, args.seed)
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = matrix[rng.choice(len(matrix), min(args.num_queries, len(matrix)), replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(json.dumps(run(matrix, queries, args.k, args.dtype, args.rescore), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+End-to-end benchmark of RagService with the mock models (USE_MOCK_MODELS), to compare commits.
+
+Measures create_vector_store_index, load_vector_store_index (cold and cached), complete_chat
+over 1..N indexes, list_vector_store_index and the chat history store, and prints p50/p95
+latencies, throughputs and the peak RSS as JSON. Run from the pkg folder:
+
+    python benchmarks/rag_suite.py --num-documents 4 --pages 20 --output bench.json
+    python benchmarks/rag_suite.py --documents advanced_chatbot/data/*.pdf
+
+By default everything (indexes, embedding cache, documents) goes to a fresh temporary DATA_PATH,
+so that no cache of a previous run is reused. Pass --data-path to benchmark an existing folder.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+
+QUERIES = [
+    "What is the role of a UX designer?",
+    "How can the energy consumption of buildings be reduced?",
+    "What does the finance law say about public budgets?",
+    "Summarize the main recommendations.",
+]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """
+    Count, p50/p95/mean latency (ms) and throughput (operations per second) of a list of durations in seconds.
+    """
+    if not latencies:
+        return {"count": 0}
+    samples = np.asarray(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "mean_ms": float(samples.mean()),
+        "throughput_per_s": float(len(latencies) / max(sum(latencies), 1e-12)),
+    }
+
+
+def peak_rss_bytes() -> Dict[str, int]:
+    """
+    Peak resident set size of this process and of its (finished) children, ex: the parsing workers.
+    """
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return ""
+
+
+def bench_ingestion(service, documents: List[Path]) -> Dict:
+    latencies, num_nodes, index_ids = [], 0, []
+    for document_path in documents:
+        start = time.perf_counter()
+        index_id, index = service.create_vector_store_index(document_path)
+        latencies.append(time.perf_counter() - start)
+        num_nodes += len(index.docstore.docs)
+        index_ids.append(index_id)
+    report = summarize(latencies)
+    report["nodes"] = num_nodes
+    report["nodes_per_s"] = num_nodes / max(sum(latencies), 1e-12)
+    report["document_bytes"] = sum(Path(document_path).stat().st_size for document_path in documents)
+    return {"report": report, "index_ids": index_ids}
+
+
+def bench_load(cold_service, service, index_ids: List[str], repeats: int) -> Dict:
+    cold, cached = [], []
+    for _ in range(repeats):
+        for index_id in index_ids:
+            start = time.perf_counter()
+            cold_service.load_vector_store_index(index_id)
+            cold.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            service.load_vector_store_index(index_id)
+            cached.append(time.perf_counter() - start)
+    return {"cold": summarize(cold), "cached": summarize(cached)}
+
+
+def bench_chat(service, index_ids: List[str], max_indexes: int, repeats: int) -> Dict:
+    from llama_index.core.llms import ChatMessage
+
+    report = {}
+    for num_indexes in range(1, min(max_indexes, len(index_ids)) + 1):
+        total, first_token = [], []
+        for repeat in range(repeats):
+            query = QUERIES[repeat % len(QUERIES)]
+            start = time.perf_counter()
+            response_gen, _ = service.complete_chat(query, [ChatMessage(role="user", content=query)],
+                                                    index_ids[:num_indexes], use_answer_cache=False)
+            for position, _token in enumerate(response_gen):
+                if position == 0:
+                    first_token.append(time.perf_counter() - start)
+            total.append(time.perf_counter() - start)
+        report[f"{num_indexes}_indexes"] = {"total": summarize(total), "first_token": summarize(first_token)}
+    return report
+
+
+def bench_list(service, repeats: int) -> Dict:
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        num_indexes = len(service.list_vector_store_index())
+        latencies.append(time.perf_counter() - start)
+    report = summarize(latencies)
+    report["indexes"] = num_indexes
+    return report
+
+
+def bench_history(history_path: Path, num_conversations: int, messages_per_conversation: int) -> Dict:
+    from advanced_chatbot.services.history_store import ChatHistoryStore
+
+    store = ChatHistoryStore(history_path)
+    appends, loads = [], []
+    conversation_ids = [store.create_conversation() for _ in range(num_conversations)]
+    for position in range(messages_per_conversation):
+        for conversation_id in conversation_ids:
+            message = {"role": "user" if position % 2 == 0 else "bot", "content": QUERIES[position % len(QUERIES)] * 4}
+            start = time.perf_counter()
+            store.append_message(conversation_id, message)
+            appends.append(time.perf_counter() - start)
+    for conversation_id in conversation_ids:
+        start = time.perf_counter()
+        store.load_conversation(conversation_id)
+        loads.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    store.list_conversations()
+    return {"append": summarize(appends), "load_conversation": summarize(loads),
+            "list_conversations_ms": 1000 * (time.perf_counter() - start)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", nargs="*", type=Path, default=None, help="Use these documents instead of synthetic ones.")
+    parser.add_argument("--num-documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--format", nargs="+", default=["pdf"], choices=["pdf", "docx"],
+                        help="Formats of the synthetic documents, docx needs docx2txt (pip install docx2txt).")
+    parser.add_argument("--max-indexes", type=int, default=4, help="complete_chat is measured with 1..N indexes.")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--history-conversations", type=int, default=20)
+    parser.add_argument("--history-messages", type=int, default=50)
+    parser.add_argument("--data-path", type=Path, default=None)
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report to a file.")
+    args = parser.parse_args()
+
+    #The config reads DATA_PATH at import time
+    data_path = args.data_path or Path(tempfile.mkdtemp(prefix="rag_bench_"))
+    os.environ["DATA_PATH"] = str(data_path)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+
+    from advanced_chatbot.config import USE_MOCK_MODELS
+    from advanced_chatbot.services.rag_service import RagService, _RagService
+    from synthetic_documents import generate_documents
+
+    documents = args.documents or generate_documents(data_path / "benchmark_documents", args.num_documents,
+                                                     args.pages, args.format)
+    #Same storage, no cache: every load reads the persisted index
+    cold_service = _RagService(cache_max_bytes=0)
+
+    report = {
+        "commit": git_commit(),
+        "mock_models": USE_MOCK_MODELS,
+        "config": {"documents": [str(path) for path in documents], "pages": None if args.documents else args.pages,
+                   "repeats": args.repeats},
+    }
+    ingestion = bench_ingestion(RagService, documents)
+    report["create_vector_store_index"] = ingestion["report"]
+    report["load_vector_store_index"] = bench_load(cold_service, RagService, ingestion["index_ids"], args.repeats)
+    report["complete_chat"] = bench_chat(RagService, ingestion["index_ids"], args.max_indexes, args.repeats)
+    report["list_vector_store_index"] = bench_list(RagService, args.repeats)
+    report["history"] = bench_history(data_path / "benchmark_history" / "history.sqlite3",
+                                      args.history_conversations, args.history_messages)
+    report["peak_rss_bytes"] = peak_rss_bytes()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
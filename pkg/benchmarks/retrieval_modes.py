@@ -0,0 +1,120 @@
+"""
+Retrieval latency of the dense, lexical (BM25) and hybrid retrieval modes.
+
+Indexes synthetic documents with the mock models (or the given documents), then times
+StackedVectorRetriever.retrieve in every mode, query embedding included. The dense and hybrid
+query embeddings go to the local stand-in embedding server (benchmarks/embedding_stub_server.py)
+with an injected latency, to account for the network round trip; the lexical mode does not embed
+the query. The BM25 search alone is timed too (lexical_search). Prints p50/p95 latencies as JSON. Run from the pkg folder:
+
+    python benchmarks/retrieval_modes.py --num-documents 4 --pages 20 --latency-ms 50
+    python benchmarks/retrieval_modes.py --documents advanced_chatbot/data/*.pdf
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from embedding_stub_server import EmbeddingStubServer
+from rag_suite import summarize
+
+
+def sample_queries(texts: List[str], num_queries: int, seed: int) -> List[str]:
+    """
+    Exact term queries (a long word of a node) and short phrases (the start of a node).
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        words = rng.choice(texts).split()
+        if not words:
+            continue
+        if rng.random() < 0.5:
+            queries.append(max(words, key=len))
+        else:
+            queries.append(" ".join(words[:8]))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", nargs="*", type=Path, default=None, help="Index these documents.")
+    parser.add_argument("--num-documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Latency of the stand-in embedding server.")
+    parser.add_argument("--data-path", type=Path, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    #The config reads DATA_PATH at import time
+    data_path = args.data_path or Path(tempfile.mkdtemp(prefix="rag_bench_"))
+    os.environ["DATA_PATH"] = str(data_path)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+
+    from llama_index.embeddings.openai import OpenAIEmbedding
+    from advanced_chatbot.config import DEFAULT_RAG_SIMILARITY_TOP_K, HYBRID_RETRIEVAL_CANDIDATES, HYBRID_RRF_K
+    from advanced_chatbot.services.index_cache import IndexCache
+    from advanced_chatbot.services.lexical_index import LexicalIndex, lexical_top_k
+    from advanced_chatbot.services.rag_service import RAG_STORAGE_PATH, RagService
+    from advanced_chatbot.services.retrievers import RETRIEVAL_MODES, StackedVectorRetriever
+    from synthetic_documents import generate_documents
+
+    documents = args.documents or generate_documents(data_path / "benchmark_documents", args.num_documents,
+                                                     args.pages, ["pdf"], args.seed)
+    index_ids = [RagService.create_vector_store_index(Path(document))[0] for document in documents]
+    indexes = {index_id: RagService.load_vector_store_index(index_id) for index_id in index_ids}
+    lexical_indexes = {index_id: LexicalIndex.from_persist_dir(RAG_STORAGE_PATH / index_id) for index_id in index_ids}
+    texts = [node.get_content() for index in indexes.values() for node in index.docstore.docs.values()]
+    queries = sample_queries(texts, args.num_queries, args.seed)
+
+    server = EmbeddingStubServer(latency_ms=args.latency_ms).start()
+    try:
+        embed_model = OpenAIEmbedding(api_key="stub", api_base=server.api_base, model="text-embedding-3-small")
+        report = {
+            "documents": len(documents),
+            "nodes": len(texts),
+            "queries": len(queries),
+            "embedding_latency_ms": args.latency_ms,
+            "lexical_index_bytes": sum(lexical_index.nbytes for lexical_index in lexical_indexes.values()),
+            "modes": {},
+        }
+        block_cache = IndexCache(max_bytes=1024 ** 3)
+        for mode in RETRIEVAL_MODES:
+            retriever = StackedVectorRetriever(indexes=indexes,
+                                               embed_model=embed_model,
+                                               similarity_top_k=DEFAULT_RAG_SIMILARITY_TOP_K,
+                                               block_cache=block_cache,
+                                               lexical_indexes=lexical_indexes,
+                                               retrieval_mode=mode,
+                                               hybrid_candidates=HYBRID_RETRIEVAL_CANDIDATES,
+                                               rrf_k=HYBRID_RRF_K)
+            #Warm up: stacked embedding block, memory mapped pages
+            retriever.retrieve(queries[0])
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                retriever.retrieve(query)
+                latencies.append(time.perf_counter() - start)
+            report["modes"][mode] = summarize(latencies)
+
+        #The BM25 search alone, without the retriever (node loading, callbacks, tracing)
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            lexical_top_k(lexical_indexes, query, DEFAULT_RAG_SIMILARITY_TOP_K)
+            latencies.append(time.perf_counter() - start)
+        report["lexical_search"] = summarize(latencies)
+    finally:
+        server.shutdown()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Synthetic PDF and DOCX documents of configurable size, written without any extra dependency.
+
+    python benchmarks/synthetic_documents.py /tmp/docs --num-documents 4 --pages 20 --format pdf docx
+"""
+
+import argparse
+import random
+import zipfile
+from pathlib import Path
+from typing import List
+from xml.sax.saxutils import escape
+
+
+WORDS = ("the building energy renovation heat pump emission tertiary sector housing design user experience "
+         "interface research prototype budget law finance article state public report carbon").split()
+
+LINES_PER_PAGE = 45
+
+
+def synthetic_sentences(num_sentences: int, seed: int) -> List[str]:
+    """
+    Random sentences (8 to 20 words), the seed makes every document unique.
+    """
+    rng = random.Random(seed)
+    sentences = []
+    for i in range(num_sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+        sentences.append(" ".join(words).capitalize() + f" {seed}-{i}.")
+    return sentences
+
+
+def write_pdf(path: Path, pages: List[List[str]]) -> None:
+    """
+    Write a PDF with one text line per sentence (Helvetica, standard 14 font).
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for lines in pages:
+        text = " ".join("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") '" for line in lines)
+        content = f"BT /F1 9 Tf 40 810 Td 17 TL {text} ET"
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {len(objects)} 0 R "
+                       f"/Resources << /Font << /F1 3 0 R >> >> >>")
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(pages)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    Path(path).write_bytes(bytes(output))
+
+
+def write_docx(path: Path, paragraphs: List[str]) -> None:
+    """
+    Write a minimal DOCX (one paragraph per sentence).
+    """
+    body = "".join(f"<w:p><w:r><w:t>{escape(paragraph)}</w:t></w:r></w:p>" for paragraph in paragraphs)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml",
+                      '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                      '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                      '<Default Extension="xml" ContentType="application/xml"/>'
+                      '<Override PartName="/word/document.xml" '
+                      'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                      '</Types>')
+        docx.writestr("_rels/.rels",
+                      '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                      '<Relationship Id="rId1" '
+                      'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+                      'Target="word/document.xml"/></Relationships>')
+        docx.writestr("word/document.xml",
+                      '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                      f'<w:body>{body}</w:body></w:document>')
+
+
+def generate_documents(output_dir: Path, num_documents: int, pages: int, formats: List[str], seed: int = 0) -> List[Path]:
+    """
+    Generate unique synthetic documents.
+    :param pages: The size of each document in pages (LINES_PER_PAGE sentences per page, also for DOCX).
+    :param formats: The formats to cycle through ("pdf", "docx").
+    :return: The paths of the documents.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for number in range(num_documents):
+        document_format = formats[number % len(formats)]
+        sentences = synthetic_sentences(pages * LINES_PER_PAGE, seed=seed * 100003 + number)
+        path = output_dir / f"synthetic_{seed}_{number}_{pages}p.{document_format}"
+        if document_format == "pdf":
+            write_pdf(path, [sentences[start:start + LINES_PER_PAGE] for start in range(0, len(sentences), LINES_PER_PAGE)])
+        elif document_format == "docx":
+            write_docx(path, sentences)
+        else:
+            raise ValueError(f"Unsupported format {document_format}.")
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--num-documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--format", nargs="+", default=["pdf"], choices=["pdf", "docx"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for path in generate_documents(args.output_dir, args.num_documents, args.pages, args.format, args.seed):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,10 @@
-import json
 import uuid
-import os
-import time
-from typing import List, Dict
+from typing import Dict, Iterator, List
 import streamlit as st
 from pathlib import Path
+from advanced_chatbot.services.history_store import ChatHistoryStore
 from advanced_chatbot.services.rag_service import RagService
 from advanced_chatbot.config import DATA_PATH
-from llama_index_client import ChatMessage
 
 def handle_file_upload() -> List[Dict]:
     """
@@ -23,41 +20,51 @@ def handle_file_upload() -> List[Dict]:
         num_files = len(uploaded_files)
         for i, uploaded_file in enumerate(uploaded_files):
             file_path = DATA_PATH / uploaded_file.name
+            progress_window.text(f"Uploading {uploaded_file.name}...")
             with open(file_path, "wb") as f:
                 f.write(uploaded_file.getbuffer())
+            # Indexing runs in the background, the chat only uses the documents once they are ready
+            job_id = RagService.enqueue_ingestion(file_path)
             documents.append({
                 "id": str(uuid.uuid4()),  # Generate unique ID for each document
                 "name": uploaded_file.name,
                 "path": str(file_path),
+                "job_id": job_id,
                 "use_in_rag": True
             })
-            progress_window.text(f"Uploading {uploaded_file.name}...")
             progress_bar.progress((i + 1) / num_files)
-            time.sleep(1)  # Simulate upload time
 
         progress_window.empty()
         progress_bar.empty()
     return documents
 
-def load_history(file_path='chat_history.json') -> Dict:
+# Chat history, appended message by message and shared by every session
+HISTORY_STORE_PATH = DATA_PATH / "chat_history" / "chat_history.sqlite3"
+history_store = ChatHistoryStore(HISTORY_STORE_PATH)
+# Conversations saved by the previous versions (whole history rewritten in a JSON file)
+history_store.import_json(Path('chat_history.json'))
+
+def list_conversations() -> List[str]:
+    """
+    List the ids of the saved conversations, oldest first (the messages are not loaded).
+    """
+    return [conversation["conversation_id"] for conversation in history_store.list_conversations()]
+
+def load_conversation(conversation_id: str) -> List[Dict]:
     """
-    Load conversation history from JSON file.
+    Load the messages of a conversation.
     """
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as file:
-            return json.load(file)
-    return {}
+    return history_store.load_conversation(conversation_id)
 
-def save_history(history: Dict, file_path='chat_history.json'):
+def create_conversation() -> str:
     """
-    Save conversation history to JSON file.
+    Create a new empty conversation and return its id.
     """
-    with open(file_path, 'w') as file:
-        json.dump(history, file)
+    return history_store.create_conversation()
 
 def add_message(role: str, content: str):
     """
-    Add message to session state and update JSON file.
+    Add message to session state and append it to the conversation history.
     """
     message = {
         "id": str(uuid.uuid4()),  # Generate unique ID
@@ -66,7 +73,7 @@ def add_message(role: str, content: str):
     }
     if st.session_state.current_conversation is not None:
         st.session_state.chat_history[st.session_state.current_conversation].append(message)
-        save_history(st.session_state.chat_history)
+        history_store.append_message(st.session_state.current_conversation, message)
 
 def list_data_files() -> List[str]:
     """
@@ -85,27 +92,40 @@ def get_file_paths(selected_files: List[str]) -> List[str]:
             file_paths.append(str(file_path))
     return file_paths
 
-def create_index_for_files(files: List[str]) -> List[str]:
+def get_document_status(document: Dict) -> str:
+    """
+    Get the ingestion status of an uploaded document (queued, running, done or failed).
+    """
+    return RagService.get_ingestion_job(document["job_id"])["status"]
+
+def get_ready_index_ids(files: List[str]) -> List[str]:
     """
-    Create indexes for the selected files.
+    Get the indexes of the selected files that are ready.
+    Files that are not indexed yet are queued for background ingestion.
     """
     index_ids = []
     for file in files:
-        index_id, _ = RagService.create_vector_store_index(Path(file))
-        index_ids.append(index_id)
+        index_id = RagService.find_vector_store_index(Path(file))
+        if index_id is None:
+            RagService.enqueue_ingestion(Path(file))
+        else:
+            index_ids.append(index_id)
     return index_ids
 
-def get_bot_response(user_input: str, selected_files: List[str], system_prompt: str) -> str:
+def stream_bot_response(user_input: str, selected_files: List[str], system_prompt: str) -> Iterator[str]:
     """
-    Get bot response using RAG service.
+    Stream the bot response token by token using RAG service.
     """
     if not selected_files:
-        return "No documents selected for retrieval."
+        yield "No documents selected for retrieval."
+        return
 
-    index_ids = create_index_for_files(selected_files)
+    index_ids = get_ready_index_ids(selected_files)
     if not index_ids:
-        return "Failed to create indexes for the selected documents."
+        yield "The selected documents are still being indexed, please try again in a moment."
+        return
 
+    from llama_index.core.llms import ChatMessage
     conversation_history = [ChatMessage(role="user", content=user_input)]
     response_gen, _ = RagService.complete_chat(
         query=user_input,
@@ -113,5 +133,10 @@ def get_bot_response(user_input: str, selected_files: List[str], system_prompt:
         index_ids=index_ids,
         system_prompt=system_prompt
     )
-    response = "".join(list(response_gen))
-    return response
+    yield from response_gen
+
+def get_bot_response(user_input: str, selected_files: List[str], system_prompt: str) -> str:
+    """
+    Get bot response using RAG service.
+    """
+    return "".join(stream_bot_response(user_input, selected_files, system_prompt))
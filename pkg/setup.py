@@ -2,6 +2,7 @@ from setuptools import find_packages, setup
 
 requirements = """
 llama-index==0.10.8
+numpy
 streamlit
 python-dotenv
 """
@@ -0,0 +1,27 @@
+from llama_index.core import MockEmbedding, StorageContext, VectorStoreIndex
+from llama_index.core.schema import TextNode
+
+from advanced_chatbot.services.retrievers import EmbeddingBlock
+from advanced_chatbot.services.vector_store import MmapVectorStore
+
+
+def make_index(embeddings):
+    nodes = [TextNode(text=f"node {position}", embedding=embedding) for position, embedding in enumerate(embeddings)]
+    return VectorStoreIndex(nodes=nodes,
+                            storage_context=StorageContext.from_defaults(vector_store=MmapVectorStore()),
+                            embed_model=MockEmbedding(embed_dim=4))
+
+
+def test_empty_index_next_to_non_empty_index():
+    empty, full = make_index([]), make_index([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
+    block = EmbeddingBlock.from_indexes({"empty": empty, "full": full})
+
+    assert block.matrix.shape == (2, 4)
+    rows = block.top_k([0.0, 1.0, 0.0, 0.0], similarity_top_k=2)
+    assert [row for row, _ in rows] == [1, 0]
+    assert {block.index_ids[block.owners[row]] for row, _ in rows} == {"full"}
+
+
+def test_only_empty_indexes():
+    block = EmbeddingBlock.from_indexes({"empty": make_index([])})
+    assert block.top_k([1.0, 0.0, 0.0, 0.0], similarity_top_k=2) == []